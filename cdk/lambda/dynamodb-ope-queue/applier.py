@@ -0,0 +1,67 @@
+"""DynamoDB Streams のレコードを受け取って ope を適用する (OPE_APPLY_MODE=stream)
+
+イベントソースマッピングはシャードごとに 1 つずつ順番に handler を呼び出し、
+同じ ckey のアイテムは同じシャードに入るので、1 つのオブジェクトの ope を適用するのは常に 1 つの呼び出しだけになる。
+レコードはどのオブジェクトに ope が書き込まれたかを知るためだけに使い、
+ope 自体は main.apply_pending で LAST_OPE の lsk までを skey の順にまとめて取得して適用する
+(ope と lsk は同じトランザクションで書き込むので、レコードが届いた ope は必ず lsk 以下にある)。"""
+
+import os
+
+import main
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL") or "INFO")
+# ------------------------------------------------------------------
+
+
+def convert_objects(event) -> dict[str, str]:
+    """ope の INSERT のレコードの cky と、cky ごとのバッチ内の最初のレコードの SequenceNumber を返す"""
+
+    objects: dict[str, str] = {}
+    for record in (event or {}).get("Records") or []:
+        if record.get("eventName") != "INSERT":
+            continue
+        stream = record["dynamodb"]
+        ckey = stream["Keys"][main.DYNAMODB_CHUNK_KEY_NAME]["S"]
+        if not ckey.endswith(main.DYNAMODB_SORT_KEY_OPE_SUFIX):
+            continue
+        objects.setdefault(ckey[:-len(main.DYNAMODB_SORT_KEY_OPE_SUFIX)], stream["SequenceNumber"])
+    return objects
+
+
+def handler(event, context):
+    # print("event")
+    # print(event)
+
+    # DB_JSON_SYNC=async の場合の自身からの非同期呼び出しは main.handler と同じように処理する
+    if event and event.get("action"):
+        return main.handler(event, context)
+
+    objects = convert_objects(event)
+
+    # 失敗したオブジェクトの最初のレコードを返し、そのレコードから再試行させる (ReportBatchItemFailures)
+    # 他のオブジェクトのレコードも再送されるが、適用済みであれば apply_pending は何もしない
+    failures = []
+    for cky, sequence_number in objects.items():
+        obj = main.convert_chunk_key(cky)
+        if obj is None:
+            logger.warning({"msg": "unknown object", "cky": cky})
+            continue
+
+        main.TRACE.reset()
+        try:
+            results = main.apply_pending(obj)
+        except Exception as e:
+            logger.exception({"msg": "Failed", "cky": cky, "exception": f"{e}"})
+            failures.append({"itemIdentifier": sequence_number})
+            continue
+        finally:
+            if main.TRACE_ENABLED:
+                logger.info({"msg": "trace summary", "cky": cky,
+                             "request_id": getattr(context, "aws_request_id", ""), **main.TRACE.summary()})
+
+        logger.info({"msg": "apply stream", "cky": cky, "count": len(results)})
+
+    return {"batchItemFailures": failures}
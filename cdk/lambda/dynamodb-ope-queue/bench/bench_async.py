@@ -0,0 +1,85 @@
+"""POST の応答方式 (SUBMIT_MODE=sync / async) ごとのクライアントのレイテンシと、すべての ope が適用されるまでの時間の比較
+
+data の要素数が --sizes のスナップショット (SNAPSHOT_FORMAT=full) を用意してから書き込む。
+async の場合はすべての非同期呼び出しが終わるまでの時間を applied[s] とし、
+すべての ope の結果を GET /dy-queue/ops/{skey} と同じ方法で取得できることを確認する。
+
+python bench/bench_async.py --writers 10 --ops 20 --sizes 1000 100000"""
+
+import argparse
+import threading
+import time
+
+import local_aws
+
+
+def seed(main, size: int) -> None:
+    """data の要素数が size の Db を保存して公開する"""
+
+    db = main.Db()
+    db.skey = main.put_ope_with_watermark(main.DEFAULT_OBJECT,
+                                          ckey_suffix=main.DYNAMODB_SORT_KEY_OPE_SUFIX,
+                                          skey=main.new_skey(), data="", method=main.Ope.DROP)
+    db.data = [f"{i:08}" for i in range(size)]
+    main.save(main.DEFAULT_OBJECT, db_obj=db, skey=db.skey)
+    main.publish(main.DEFAULT_OBJECT, skey=db.skey, base_skey=db.base_skey)
+
+
+def run(main, mode: str, size: int, writers: int, ops: int) -> dict:
+    local_aws.reset()
+    main.SNAPSHOT_CACHE.clear()
+    seed(main, size)
+
+    skeys: list[str] = []
+    lock = threading.Lock()
+
+    def submit(data: str) -> None:
+        ope = main.new_ope(data=data, method=main.Ope.INSERT)
+        if mode == main.SUBMIT_MODE_ASYNC:
+            skey, = main.submit_opes(main.DEFAULT_OBJECT, [ope])
+        else:
+            skey, = main.post_opes(main.DEFAULT_OBJECT, [ope])
+        with lock:
+            skeys.append(skey)
+
+    start = time.perf_counter()
+    result = local_aws.run_writers(submit, writers, ops)
+    local_aws.LAMBDA.join()
+    applied = time.perf_counter() - start
+
+    for skey in skeys:
+        status_code, res = main.get_ope_result(main.DEFAULT_OBJECT, skey)
+        assert status_code == 200 and res["status"] == "ok", (skey, status_code, res)
+
+    main.SNAPSHOT_CACHE.clear()
+    db = main.get_db(main.DEFAULT_OBJECT)
+    assert len(db.data) == size + writers * ops, (len(db.data), size + writers * ops)
+
+    calls = dict(local_aws.LATENCY_MODEL.calls)
+    return {
+        "mode": mode,
+        "data": size,
+        **result,
+        "applied[s]": round(applied, 2),
+        "s3.put_object": calls.get("s3.put_object", 0),
+        "lambda.invoke": calls.get("lambda.invoke", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=10)
+    parser.add_argument("--ops", type=int, default=20)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    args = parser.parse_args()
+
+    main = local_aws.start()
+    main.SNAPSHOT_FORMAT = main.SNAPSHOT_FORMAT_FULL
+
+    for size in args.sizes:
+        for mode in [main.SUBMIT_MODE_SYNC, main.SUBMIT_MODE_ASYNC]:
+            print(run(main, mode, size, args.writers, args.ops))
+
+
+if __name__ == "__main__":
+    main()
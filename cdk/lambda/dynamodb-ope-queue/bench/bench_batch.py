@@ -0,0 +1,72 @@
+"""1 回の POST でまとめて書き込む ope の数 (バッチサイズ) ごとのスループットの比較
+
+各書き込みスレッドは batch 個の ope を post_opes で書き込むことを requests 回繰り返す。
+ops/s は適用した ope の数 (リクエスト数 * batch) を経過時間で割った値。
+
+python bench/bench_batch.py --writers 4 --requests 5 --batches 1,10,100"""
+
+import argparse
+
+import local_aws
+
+
+def run(main, commit_wait_mode: str, apply_mode: str, writers: int, requests: int, batch: int) -> dict:
+    local_aws.reset()
+    main.SNAPSHOT_CACHE.clear()
+    main.OPE_COMMIT_WAIT_MODE = commit_wait_mode
+    main.OPE_APPLY_MODE = apply_mode
+
+    def post(data: str):
+        opes = [main.new_ope(data=f"{data}-{n:03}") for n in range(batch)]
+        results = main.post_opes(main.DEFAULT_OBJECT, opes)
+        assert len(results) == batch and all(r.status == "ok" for r in results.values()), results
+
+    result = local_aws.run_writers(post, writers, requests)
+
+    calls = dict(local_aws.LATENCY_MODEL.calls)
+
+    # まとめて書き込んだ ope は書き込んだ順に適用されていることを確認する
+    # (トランザクションの上限を超えるバッチは分けてコミットされるので、間に他のリクエストの ope が入ることがある)
+    main.SNAPSHOT_CACHE.clear()
+    db = main.get_db(main.DEFAULT_OBJECT)
+    assert len(db.data) == writers * requests * batch, (len(db.data), writers * requests * batch)
+    requests_data: dict[str, list[str]] = {}
+    for d in db.data:
+        requests_data.setdefault(d[:-4], []).append(d)
+    for prefix, data in requests_data.items():
+        assert data == [f"{prefix}-{n:03}" for n in range(batch)], data
+
+    return {
+        "wait": commit_wait_mode,
+        "apply": apply_mode,
+        "batch": batch,
+        "requests": result["ops"],
+        "errors": result["errors"],
+        "p50[ms]": result["p50[ms]"],
+        "p99[ms]": result["p99[ms]"],
+        "ops/s": round(result["ops/s"] * batch, 1),
+        "dynamodb.transact_write_items": calls.get("dynamodb.transact_write_items", 0),
+        "s3.put_object": calls.get("s3.put_object", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--batches", default="1,10,100", help="バッチサイズ (カンマ区切り)")
+    args = parser.parse_args()
+
+    main = local_aws.start()
+
+    for commit_wait_mode, apply_mode in [
+        (main.OPE_COMMIT_WAIT_MODE_WATERMARK, main.OPE_APPLY_MODE_RACE),
+        (main.OPE_COMMIT_WAIT_MODE_SLEEP, main.OPE_APPLY_MODE_RACE),
+        (main.OPE_COMMIT_WAIT_MODE_WATERMARK, main.OPE_APPLY_MODE_GROUP),
+    ]:
+        for batch in [int(n) for n in args.batches.split(",")]:
+            print(run(main, commit_wait_mode, apply_mode, args.writers, args.requests, batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""post_data のコミット待ち方式 (sleep / watermark) のレイテンシ比較
+
+python bench/bench_commit_wait.py --writers 10 --ops 20"""
+
+import argparse
+
+import local_aws
+
+
+def run(main, mode: str, writers: int, ops: int) -> dict:
+    local_aws.reset()
+    main.SNAPSHOT_CACHE.clear()
+    main.OPE_COMMIT_WAIT_MODE = mode
+
+    result = local_aws.run_writers(
+        lambda data: main.post_data(main.DEFAULT_OBJECT, data=data, method=main.Ope.INSERT), writers, ops)
+
+    db = main.get_db(main.DEFAULT_OBJECT)
+
+    return {"mode": mode, **result, "db.data": len(db.data)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=10)
+    parser.add_argument("--ops", type=int, default=20)
+    args = parser.parse_args()
+
+    main = local_aws.start()
+
+    for mode in [main.OPE_COMMIT_WAIT_MODE_SLEEP, main.OPE_COMMIT_WAIT_MODE_WATERMARK]:
+        print(run(main, mode, args.writers, args.ops))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""ope の適用方式 (race / group) の S3 PUT 数とレイテンシの比較
+
+python bench/bench_group_commit.py --writers 10 --ops 20"""
+
+import argparse
+
+import local_aws
+
+
+def run(main, mode: str, writers: int, ops: int) -> dict:
+    local_aws.reset()
+    main.SNAPSHOT_CACHE.clear()
+    main.OPE_APPLY_MODE = mode
+
+    result = local_aws.run_writers(
+        lambda data: main.post_data(main.DEFAULT_OBJECT, data=data, method=main.Ope.INSERT), writers, ops)
+
+    calls = dict(local_aws.LATENCY_MODEL.calls)
+    db = main.get_db(main.DEFAULT_OBJECT)
+
+    return {
+        "mode": mode,
+        **result,
+        "s3.put_object": calls.get("s3.put_object", 0),
+        "s3.copy_object": calls.get("s3.copy_object", 0),
+        "db.data": len(db.data),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=10)
+    parser.add_argument("--ops", type=int, default=20)
+    args = parser.parse_args()
+
+    main = local_aws.start()
+
+    for mode in [main.OPE_APPLY_MODE_RACE, main.OPE_APPLY_MODE_GROUP]:
+        print(run(main, mode, args.writers, args.ops))
+
+
+if __name__ == "__main__":
+    main()
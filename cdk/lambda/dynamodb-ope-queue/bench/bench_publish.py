@@ -0,0 +1,60 @@
+"""スナップショットの公開方式 (copy / pointer / pointer + db.json の非同期更新) の比較
+
+python bench/bench_publish.py --writers 10 --ops 20"""
+
+import argparse
+import json
+
+import local_aws
+
+
+def run(main, mode: str, db_json_sync: str, writers: int, ops: int) -> dict:
+    local_aws.reset()
+    main.SNAPSHOT_CACHE.clear()
+    main.PUBLISH_MODE = mode
+    main.DB_JSON_SYNC = db_json_sync
+
+    result = local_aws.run_writers(
+        lambda data: main.post_data(main.DEFAULT_OBJECT, data=data, method=main.Ope.INSERT), writers, ops)
+
+    calls = dict(local_aws.LATENCY_MODEL.calls)
+
+    # キャッシュを使わずに公開中のスナップショットを読めることを確認する
+    main.SNAPSHOT_CACHE.clear()
+    db = main.get_db(main.DEFAULT_OBJECT)
+    assert len(db.data) == writers * ops, (len(db.data), writers * ops)
+
+    # db.json を更新する場合は非同期呼び出しの完了後に cur と一致していることを確認する
+    local_aws.LAMBDA.join()
+    if mode == main.PUBLISH_MODE_COPY or db_json_sync == main.DB_JSON_SYNC_ASYNC:
+        # db.json はスナップショットの形式に関係なく従来の形式 ({"skey", "data"} の JSON) になっている
+        db_json = json.loads(local_aws.S3.objects[(local_aws.BUCKET_NAME, main.DEFAULT_OBJECT.db_key)])
+        assert set(db_json) == {"skey", "data"}, set(db_json)
+        assert db_json["skey"] == db.skey, (db_json["skey"], db.skey)
+        assert len(db_json["data"]) == writers * ops, (len(db_json["data"]), writers * ops)
+
+    return {
+        "mode": mode,
+        "db.json": db_json_sync if mode == main.PUBLISH_MODE_POINTER else "copy",
+        **result,
+        "s3.put_object": calls.get("s3.put_object", 0),
+        "dynamodb.get_item": calls.get("dynamodb.get_item", 0),
+        "lambda.invoke": calls.get("lambda.invoke", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=10)
+    parser.add_argument("--ops", type=int, default=20)
+    args = parser.parse_args()
+
+    main = local_aws.start()
+
+    print(run(main, main.PUBLISH_MODE_COPY, main.DB_JSON_SYNC_NONE, args.writers, args.ops))
+    print(run(main, main.PUBLISH_MODE_POINTER, main.DB_JSON_SYNC_NONE, args.writers, args.ops))
+    print(run(main, main.PUBLISH_MODE_POINTER, main.DB_JSON_SYNC_ASYNC, args.writers, args.ops))
+
+
+if __name__ == "__main__":
+    main()
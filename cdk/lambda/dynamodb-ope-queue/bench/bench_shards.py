@@ -0,0 +1,73 @@
+"""オブジェクト (cky) の数を増やしたときのスループットの比較
+
+パーティションごとの書き込みの上限 (--partition-writes) を設定し、
+1 オブジェクトあたりの書き込みスレッド数を固定してオブジェクトの数を増やす。
+オブジェクトごとにパーティションを分けるとオブジェクトの数にほぼ比例してスループットが増える。
+--shared を指定すると、同じ数のクライアントがすべて 1 つのオブジェクトに書き込む場合も計測する
+(パーティションの上限で頭打ちになり、待っている間に溜まった ope の結果の書き込みで更に遅くなる)。
+
+python bench/bench_shards.py --objects 1,2,4,8 --writers-per-object 4 --ops 10
+python bench/bench_shards.py --objects 1,4 --shared"""
+
+import argparse
+
+import local_aws
+
+
+def run(main, objects: int, writers_per_object: int, ops: int, shared: bool) -> dict:
+    local_aws.reset()
+    main.SNAPSHOT_CACHE.clear()
+
+    writers = objects * writers_per_object
+    if shared:
+        # 同じ数のクライアントで 1 つのオブジェクトに書き込む
+        writers_per_object = writers
+        objects = 1
+    targets = [main.QueueObject(f"bench/object-{n:03}") for n in range(objects)]
+
+    # run_writers の data は "{書き込みスレッドの番号:03}-{回数:03}" なので、スレッドの番号でオブジェクトを割り当てる
+    def post(data: str):
+        obj = targets[int(data[:3]) % objects]
+        return main.post_data(obj, data=data, method=main.Ope.INSERT)
+
+    result = local_aws.run_writers(post, writers, ops)
+
+    calls = dict(local_aws.LATENCY_MODEL.calls)
+
+    # オブジェクトごとに自分のオブジェクトへの ope だけが適用されていることを確認する
+    for n, obj in enumerate(targets):
+        db = main.get_db(obj)
+        assert len(db.data) == writers_per_object * ops, (obj.cky, len(db.data))
+        assert all(int(d[:3]) % objects == n for d in db.data), obj.cky
+
+    return {
+        "objects": objects,
+        "writers": writers,
+        **result,
+        "ops/s/object": round(result["ops/s"] / objects, 1),
+        "dynamodb.throttled": calls.get("dynamodb.throttled", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--objects", default="1,2,4,8", help="オブジェクトの数 (カンマ区切り)")
+    parser.add_argument("--writers-per-object", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=10)
+    parser.add_argument("--partition-writes", type=float, default=50,
+                        help="パーティションごとの書き込みの上限[回/s] (0 の場合は制限しない)")
+    parser.add_argument("--shared", action="store_true",
+                        help="同じ数のクライアントで 1 つのオブジェクトに書き込む場合も計測する")
+    args = parser.parse_args()
+
+    main = local_aws.start()
+    local_aws.TABLE.capacity.limit = args.partition_writes or None
+
+    for objects in [int(n) for n in args.objects.split(",")]:
+        print(run(main, objects, args.writers_per_object, args.ops, shared=False))
+        if args.shared and objects > 1:
+            print(run(main, objects, args.writers_per_object, args.ops, shared=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""スナップショットのコーデック (json / binary) ごとの CPU 時間とメモリ使用量の比較
+
+S3 から取得したスナップショットをデコードし、ope を 1 件適用して再度エンコードするまでを計測する。
+
+python bench/bench_snapshot_codec.py"""
+
+import time
+import tracemalloc
+
+import local_aws
+
+
+def run(main, codec: str, size: int, repeat: int = 5) -> dict:
+    main.SNAPSHOT_CODEC = codec
+
+    db = main.Db()
+    db.skey = main.new_skey()
+    db.data = [f"{i:08}-{'x' * 8}" for i in range(size)]
+    data = main.encode_snapshot(db)
+
+    t = time.perf_counter()
+    for _ in range(repeat):
+        loaded = main.Db(main.decode_snapshot(data))
+        main.do(loaded, main.Ope({"m": main.Ope.INSERT, "d": "new"}))
+        encoded = main.encode_snapshot(loaded)
+    elapsed = (time.perf_counter() - t) / repeat
+
+    tracemalloc.start()
+    loaded = main.Db(main.decode_snapshot(data))
+    main.do(loaded, main.Ope({"m": main.Ope.INSERT, "d": "new"}))
+    encoded = main.encode_snapshot(loaded)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert list(main.Db(main.decode_snapshot(encoded)).data) == db.data + ["new"]
+
+    return {
+        "codec": codec,
+        "data": size,
+        "bytes": len(data),
+        "load+save[ms]": round(elapsed * 1000, 2),
+        "peak[KiB]": peak // 1024,
+    }
+
+
+def main():
+    main = local_aws.start(latency=False)
+
+    for size in [10 ** 3, 10 ** 4, 10 ** 5]:
+        for codec in main.SNAPSHOT_CODECS:
+            print(run(main, codec, size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""スナップショットの保存形式 (full / delta) ごとの 1 ope あたりの S3 書き込み量の比較
+
+data の要素数を 10^2 から 10^5 まで増やしたスナップショットを用意し、
+その後の ope の書き込み量を計測する。
+
+python bench/bench_snapshot_delta.py --ops 200"""
+
+import argparse
+
+import local_aws
+
+
+def seed(main, size: int) -> None:
+    """data の要素数が size の Db を保存して公開する"""
+
+    # 後続の ope の skey が必ず大きくなるように、スナップショットの skey も ope として書き込む
+    db = main.Db()
+    db.skey = main.put_ope_with_watermark(main.DEFAULT_OBJECT,
+                                          ckey_suffix=main.DYNAMODB_SORT_KEY_OPE_SUFIX,
+                                          skey=main.new_skey(), data="", method=main.Ope.DROP)
+    db.data = [f"{i:08}" for i in range(size)]
+    main.save(main.DEFAULT_OBJECT, db_obj=db, skey=db.skey)
+    main.publish(main.DEFAULT_OBJECT, skey=db.skey, base_skey=db.base_skey)
+
+
+def run(main, snapshot_format: str, size: int, ops: int) -> dict:
+    local_aws.reset()
+    main.SNAPSHOT_CACHE.clear()
+    main.SNAPSHOT_FORMAT = snapshot_format
+
+    seed(main, size)
+    local_aws.S3.bytes_written = 0
+    local_aws.S3.bytes_copied = 0
+
+    for i in range(ops):
+        main.post_data(main.DEFAULT_OBJECT, data=f"{i:08}", method=main.Ope.INSERT)
+
+    # キャッシュを使わずに復元できることを確認する
+    main.SNAPSHOT_CACHE.clear()
+    db = main.get_db(main.DEFAULT_OBJECT)
+    assert len(db.data) == size + ops, (len(db.data), size + ops)
+
+    # 公開中のスナップショットの base だけが pub=1 で、それ以外の base はライフサイクルルールで削除される
+    bases = {k: local_aws.S3.tags.get((b, k), {}).get(main.S3_SNAPSHOT_PUBLISHED_TAG)
+             for (b, k) in local_aws.S3.objects if k.startswith(main.S3_DB_BASE_FOLDER)}
+    published = [k for k, pub in bases.items() if pub == "1"]
+    expected = [main.DEFAULT_OBJECT.base_key(db.base_skey)] if db.base_skey else []
+    assert published == expected, (published, expected)
+
+    return {
+        "format": snapshot_format,
+        "data": size,
+        "put bytes/op": local_aws.S3.bytes_written // ops,
+        "copy bytes/op": local_aws.S3.bytes_copied // ops,
+        "bases": len(bases),
+        "expired bases": len(bases) - len(published),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=200)
+    args = parser.parse_args()
+
+    main = local_aws.start(latency=False)
+
+    for size in [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5]:
+        for snapshot_format in [main.SNAPSHOT_FORMAT_FULL, main.SNAPSHOT_FORMAT_DELTA]:
+            print(run(main, snapshot_format, size, args.ops))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""ope の適用方式 (race / group / stream) の競合と無駄な処理の比較
+
+- apply/op: 適用した ope の延べ数 (スナップショットの復元での適用を含む) / ope の数
+  (1 を超えた分は他のプロセスと重複して適用した ope)
+- saves/op: 保存したスナップショットの数 / ope の数
+- unpublished: 保存したが公開できなかった (より新しいスナップショットに負けた) スナップショットの割合
+- wasted: 適用した ope の延べ数のうち、重複して適用した分の割合 (1 - ope の数 / 適用した ope の延べ数)
+- cond_failed/op: DynamoDB の条件付き書き込みの失敗の数 / ope の数
+
+stream は local_aws.STREAM (DynamoDB Streams のスタンドイン) から applier.handler を呼び出す。
+--fail-every N を指定すると stream の場合に N 回に 1 回 apply_pending を失敗させ、batchItemFailures からの再試行を確認する。
+
+python bench/bench_stream.py --writers 10 --ops 20"""
+
+import argparse
+import threading
+
+import local_aws
+
+
+class Counters:
+    """main の関数を包んで呼び出し回数を数える"""
+
+    def __init__(self, main) -> None:
+        self.lock = threading.Lock()
+        self.applied = 0
+        self.swaps = 0
+        self.published = 0
+        self.apply_pending_calls = 0
+        self.fail_every = 0
+
+        apply_ope = main.apply_ope
+        swap_current_skey = main.swap_current_skey
+        apply_pending = main.apply_pending
+
+        def counted_apply_ope(*args, **kwargs):
+            with self.lock:
+                self.applied += 1
+            return apply_ope(*args, **kwargs)
+
+        def counted_swap_current_skey(*args, **kwargs):
+            result = swap_current_skey(*args, **kwargs)
+            with self.lock:
+                self.swaps += 1
+                self.published += result[0]
+            return result
+
+        def failing_apply_pending(*args, **kwargs):
+            with self.lock:
+                self.apply_pending_calls += 1
+                fail = self.fail_every and self.apply_pending_calls % self.fail_every == 0
+            if fail:
+                raise Exception("injected failure")
+            return apply_pending(*args, **kwargs)
+
+        main.apply_ope = counted_apply_ope
+        main.swap_current_skey = counted_swap_current_skey
+        main.apply_pending = failing_apply_pending
+
+    def reset(self) -> None:
+        with self.lock:
+            self.applied = 0
+            self.swaps = 0
+            self.published = 0
+            self.apply_pending_calls = 0
+
+
+def run(main, counters: Counters, mode: str, writers: int, ops: int, fail_every: int) -> dict:
+    local_aws.reset()
+    main.SNAPSHOT_CACHE.clear()
+    main.OPE_APPLY_MODE = mode
+    counters.reset()
+    counters.fail_every = fail_every if mode == main.OPE_APPLY_MODE_STREAM else 0
+
+    if mode == main.OPE_APPLY_MODE_STREAM:
+        import applier
+        local_aws.STREAM.start(applier.handler)
+    try:
+        result = local_aws.run_writers(
+            lambda data: main.post_data(main.DEFAULT_OBJECT, data=data, method=main.Ope.INSERT), writers, ops)
+    finally:
+        if mode == main.OPE_APPLY_MODE_STREAM:
+            local_aws.STREAM.drain()
+            local_aws.STREAM.stop()
+
+    calls = dict(local_aws.LATENCY_MODEL.calls)
+    total = result["ops"]
+
+    summary = {
+        "mode": mode,
+        **result,
+        "apply/op": round(counters.applied / total, 2),
+        "saves/op": round(counters.swaps / total, 2),
+        "unpublished": round(1 - counters.published / counters.swaps, 2) if counters.swaps else 0,
+        "wasted": round(1 - total / counters.applied, 2) if counters.applied else 0,
+        "cond_failed/op": round(calls.get("dynamodb.condition_failed", 0) / total, 2),
+        **({"invocations": local_aws.STREAM.invocations, "retries": local_aws.STREAM.retries}
+           if mode == main.OPE_APPLY_MODE_STREAM else {}),
+    }
+
+    # delta 形式のスナップショットの復元でも apply_ope を呼び出すので、集計した後に確認する
+    main.SNAPSHOT_CACHE.clear()
+    db = main.get_db(main.DEFAULT_OBJECT)
+    assert len(db.data) == writers * ops, (len(db.data), writers * ops)
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=10)
+    parser.add_argument("--ops", type=int, default=20)
+    parser.add_argument("--poll-interval", type=float, default=0.25, help="レコードがないときにシャードを確認する間隔[s]")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+
+    main = local_aws.start()
+    local_aws.STREAM.poll_interval = args.poll_interval
+    local_aws.STREAM.batch_size = args.batch_size
+    counters = Counters(main)
+
+    for mode in [main.OPE_APPLY_MODE_RACE, main.OPE_APPLY_MODE_GROUP, main.OPE_APPLY_MODE_STREAM]:
+        print(run(main, counters, mode, args.writers, args.ops, args.fail_every))
+
+
+if __name__ == "__main__":
+    main()
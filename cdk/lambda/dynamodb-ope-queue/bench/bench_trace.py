@@ -0,0 +1,80 @@
+"""トレース (TRACE_ENABLED) の有無による handler のレイテンシの比較と、サマリーの出力例
+
+Lambda では 1 プロセスで 1 リクエストを処理するので、直列に handler を呼び出して計測する。
+
+python bench/bench_trace.py --ops 200"""
+
+import argparse
+import json
+import logging
+import time
+
+import local_aws
+
+
+def event(method: str, data: str = "") -> dict:
+    return {
+        "requestContext": {"http": {"path": "/dy-queue", "method": method}},
+        "body": json.dumps({"data": data}),
+    }
+
+
+def run(main, enabled: bool, ops: int) -> dict:
+    local_aws.reset()
+    main.SNAPSHOT_CACHE.clear()
+    main.TRACE_ENABLED = enabled
+
+    durations = []
+    for i in range(ops):
+        t = time.perf_counter()
+        response = main.handler(event("POST", f"{i:08}"), None)
+        durations.append(time.perf_counter() - t)
+        assert response["statusCode"] == 200, response
+
+    # span 1 回あたりの計測のオーバーヘッド (API 呼び出しを除く)
+    count = 100000
+    t = time.perf_counter()
+    for _ in range(count):
+        main.traced("bench", dict)
+    overhead = (time.perf_counter() - t) / count
+
+    return {
+        "trace": enabled,
+        "ops": ops,
+        "p50[ms]": round(local_aws.percentile(durations, 50) * 1000, 2),
+        "p99[ms]": round(local_aws.percentile(durations, 99) * 1000, 2),
+        "span overhead[us]": round(overhead * 1e6, 2),
+    }
+
+
+class SummaryHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.last = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if isinstance(record.msg, dict) and record.msg.get("msg") == "trace summary":
+            self.last = record.msg
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=200)
+    args = parser.parse_args()
+
+    main = local_aws.start()
+
+    # main.logger はルートロガーなので、サマリー以外は出力しないようにハンドラーを差し替える
+    summary = SummaryHandler()
+    main.logger.handlers.clear()
+    main.logger.addHandler(summary)
+    main.logger.setLevel(logging.INFO)
+
+    for enabled in [False, True]:
+        print(run(main, enabled, args.ops))
+
+    print(json.dumps(summary.last, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,937 @@
+"""ベンチマーク用のローカルな DynamoDB (Streams を含む) / S3 / Lambda のスタンドイン
+
+main.py が使用する API の範囲だけをインメモリで実装し、
+各 API 呼び出しには実環境に近いレイテンシを乱数で付与する。
+main.py を import する前に環境変数を設定し、TABLE / DYNAMODB_CLIENT / S3 / LAMBDA を差し替える。
+STREAM はテーブルへの書き込みをレコードとして記録し、start で渡した handler (applier.handler) を呼び出す。"""
+
+import copy
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+
+from botocore.exceptions import ClientError
+
+TABLE_NAME = "bench-queue-table"
+BUCKET_NAME = "bench-db-bucket"
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ["DYNAMODB_TABLE_NAME"] = TABLE_NAME
+os.environ["DYNAMODB_CHUNK_KEY_NAME"] = "ckey"
+os.environ["DYNAMODB_SORT_KEY_NAME"] = "skey"
+os.environ["DYNAMODB_TTL_ITEM_NAME"] = "expired"
+os.environ["S3_BUKET_NAME"] = BUCKET_NAME
+os.environ.setdefault("AWS_LAMBDA_FUNCTION_NAME", "bench-ope-function")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# 操作ごとのレイテンシ (平均[s], 標準偏差[s])
+LATENCY = {
+    "dynamodb": (0.006, 0.002),
+    "s3": (0.020, 0.008),
+}
+
+
+class Latency:
+
+    def __init__(self, enabled: bool = True, seed: int = 0) -> None:
+        self.enabled = enabled
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls: dict[str, int] = {}
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def sleep(self, service: str, ratio: float = 0.5) -> None:
+        if not self.enabled:
+            return
+        mean, sd = LATENCY[service]
+        with self.lock:
+            t = self.random.gauss(mean, sd)
+        time.sleep(max(t, mean / 4) * ratio)
+
+
+class PartitionCapacity:
+    """パーティション (chunk key) ごとの書き込みの上限[回/s]
+
+    実環境の 1 パーティションあたりの上限 (1000 WCU/s) を縮小して模擬する。
+    上限を超えた書き込みは SDK のスロットリングの再試行と同様に、空きができるまで待たせる。
+    limit が None の場合は制限しない。"""
+
+    def __init__(self, latency: Latency) -> None:
+        self.latency = latency
+        self.limit: float | None = None
+        self.lock = threading.Lock()
+        self.next_free: dict[str, float] = {}
+
+    def acquire(self, ckeys: list[str]) -> None:
+        if not self.limit:
+            return
+        now = time.monotonic()
+        wait = 0.0
+        with self.lock:
+            for ckey in ckeys:
+                t = max(now, self.next_free.get(ckey, 0.0))
+                self.next_free[ckey] = t + 1 / self.limit
+                wait = max(wait, t - now)
+        if wait > 0:
+            self.latency.count("dynamodb.throttled")
+            time.sleep(wait)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.next_free.clear()
+
+
+def _error(code: str, operation: str, **extra) -> ClientError:
+    response = {"Error": {"Code": code, "Message": code}}
+    response.update(extra)
+    return ClientError(response, operation)
+
+
+# ------------------------------------------------------------------
+# DynamoDB
+
+
+_TOKEN = re.compile(
+    r"\s*(attribute_not_exists|attribute_exists|begins_with|AND|OR|<=|>=|<>|<|>|=|\(|\)|,|:[A-Za-z0-9_]+|#[A-Za-z0-9_]+|[A-Za-z_][A-Za-z0-9_.]*)")
+
+
+def _tokenize(expression: str) -> list[str]:
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        m = _TOKEN.match(expression, pos)
+        if not m:
+            raise ValueError(f"unsupported expression: {expression}")
+        tokens.append(m.group(1))
+        pos = m.end()
+    return tokens
+
+
+class _Condition:
+    """ConditionExpression の最小限の評価器 (OR / AND / 比較 / attribute_(not_)exists / begins_with)"""
+
+    def __init__(self, expression: str, names: dict, values: dict) -> None:
+        self.tokens = _tokenize(expression)
+        self.names = names or {}
+        self.values = values or {}
+        self.pos = 0
+
+    def evaluate(self, item: dict | None) -> bool:
+        self.item = item or {}
+        self.pos = 0
+        return self._or()
+
+    def _peek(self) -> str | None:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self) -> str:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def _or(self) -> bool:
+        result = self._and()
+        while self._peek() == "OR":
+            self._next()
+            right = self._and()
+            result = result or right
+        return result
+
+    def _and(self) -> bool:
+        result = self._term()
+        while self._peek() == "AND":
+            self._next()
+            right = self._term()
+            result = result and right
+        return result
+
+    def _name(self, token: str) -> str:
+        return self.names.get(token, token)
+
+    def _operand(self):
+        token = self._next()
+        if token.startswith(":"):
+            return self.values[token]
+        return self.item.get(self._name(token))
+
+    def _term(self) -> bool:
+        token = self._peek()
+        if token == "(":
+            self._next()
+            result = self._or()
+            self._next()
+            return result
+        if token in ("attribute_not_exists", "attribute_exists", "begins_with"):
+            self._next()
+            self._next()
+            name = self._name(self._next())
+            if token == "begins_with":
+                self._next()
+                prefix = self._operand()
+                self._next()
+                value = self.item.get(name)
+                return isinstance(value, str) and value.startswith(prefix)
+            self._next()
+            exists = name in self.item
+            return exists if token == "attribute_exists" else not exists
+
+        left = self._operand()
+        op = self._next()
+        right = self._operand()
+        if left is None or right is None:
+            return op == "<>" and left != right
+        return {
+            "=": left == right,
+            "<>": left != right,
+            "<": left < right,
+            "<=": left <= right,
+            ">": left > right,
+            ">=": left >= right,
+        }[op]
+
+
+def _update(item: dict, expression: str, names: dict, values: dict) -> None:
+    """UpdateExpression の SET / ADD / DELETE / REMOVE を適用する"""
+
+    names = names or {}
+    values = values or {}
+    sections = re.split(r"\b(SET|ADD|DELETE|REMOVE)\b", expression)
+    for i in range(1, len(sections), 2):
+        action = sections[i]
+        for clause in [c.strip() for c in sections[i + 1].split(",") if c.strip()]:
+            if action == "SET":
+                name, value = [v.strip() for v in clause.split("=", 1)]
+                name = names.get(name, name)
+                m = re.match(
+                    r"if_not_exists\(\s*(\S+)\s*,\s*(\S+)\s*\)", value)
+                if m:
+                    current = names.get(m.group(1), m.group(1))
+                    item[name] = item.get(current, values[m.group(2)])
+                elif "+" in value or "-" in value:
+                    left, op, right = re.split(r"\s*([+-])\s*", value)
+                    left = item.get(names.get(left, left), 0) if not left.startswith(
+                        ":") else values[left]
+                    right = values[right] if right.startswith(
+                        ":") else item.get(names.get(right, right), 0)
+                    item[name] = left + right if op == "+" else left - right
+                else:
+                    item[name] = copy.deepcopy(values[value])
+            elif action == "ADD":
+                name, value = clause.split()
+                name = names.get(name, name)
+                value = values[value]
+                if isinstance(value, set):
+                    item[name] = set(item.get(name) or set()) | value
+                else:
+                    item[name] = item.get(name, 0) + value
+            elif action == "DELETE":
+                name, value = clause.split()
+                name = names.get(name, name)
+                rest = set(item.get(name) or set()) - values[value]
+                if rest:
+                    item[name] = rest
+                else:
+                    item.pop(name, None)
+            elif action == "REMOVE":
+                item.pop(names.get(clause, clause), None)
+
+
+def _key_condition(condition) -> tuple[str, list]:
+    """boto3.dynamodb.conditions で組み立てたキー条件を (パーティション値, [(演算子, 値...)]) に変換する"""
+
+    expression = condition.get_expression()
+    operator = expression["operator"]
+    if operator == "AND":
+        ckey, left = _key_condition(expression["values"][0])
+        _, right = _key_condition(expression["values"][1])
+        return ckey or _, left + right
+    name = expression["values"][0].name
+    values = list(expression["values"][1:])
+    if operator == "=" and name == os.environ["DYNAMODB_CHUNK_KEY_NAME"]:
+        return values[0], []
+    return None, [(operator, values)]
+
+
+def _match_sort_key(skey: str, conditions: list) -> bool:
+    for operator, values in conditions:
+        if operator == "BETWEEN":
+            if not (values[0] <= skey <= values[1]):
+                return False
+        elif operator == "begins_with":
+            if not skey.startswith(values[0]):
+                return False
+        elif not {
+            "=": skey == values[0],
+            "<": skey < values[0],
+            "<=": skey <= values[0],
+            ">": skey > values[0],
+            ">=": skey >= values[0],
+        }[operator]:
+            return False
+    return True
+
+
+def _size(item: dict) -> int:
+    return len(repr(item))
+
+
+class FakeTable:
+
+    # Query / Scan の 1 ページの上限
+    PAGE_BYTES = 1024 * 1024
+
+    def __init__(self, latency: Latency) -> None:
+        self.latency = latency
+        self.capacity = PartitionCapacity(latency)
+        self.lock = threading.Lock()
+        self.items: dict[tuple[str, str], dict] = {}
+        self.ckey_name = os.environ["DYNAMODB_CHUNK_KEY_NAME"]
+        self.skey_name = os.environ["DYNAMODB_SORT_KEY_NAME"]
+        self.name = TABLE_NAME
+        # 書き込みを記録する DynamoDB Streams (None の場合は記録しない)
+        self.stream: "FakeStream | None" = None
+
+    def _key(self, key: dict) -> tuple[str, str]:
+        return (key[self.ckey_name], key[self.skey_name])
+
+    def _call(self, name: str):
+        self.latency.count("dynamodb." + name)
+        self.latency.sleep("dynamodb")
+
+    def _write(self, name: str, keys: list[dict]):
+        self._call(name)
+        self.capacity.acquire([key[self.ckey_name] for key in keys])
+
+    def _check(self, item: dict | None, kwargs: dict, operation: str) -> None:
+        expression = kwargs.get("ConditionExpression")
+        if not expression:
+            return
+        condition = _Condition(expression, kwargs.get("ExpressionAttributeNames"),
+                               kwargs.get("ExpressionAttributeValues"))
+        if not condition.evaluate(item):
+            self.latency.count("dynamodb.condition_failed")
+            raise _error("ConditionalCheckFailedException", operation)
+
+    def _store(self, key: tuple[str, str], item: dict) -> None:
+        """アイテムを書き込む (self.lock を取得した状態で呼び出す)"""
+
+        if self.stream:
+            self.stream.record(key, "MODIFY" if key in self.items else "INSERT")
+        self.items[key] = item
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        self._write("put_item", [Item])
+        with self.lock:
+            key = self._key(Item)
+            self._check(self.items.get(key), kwargs, "PutItem")
+            self._store(key, copy.deepcopy(Item))
+        self.latency.sleep("dynamodb")
+        return {}
+
+    def get_item(self, Key: dict, **kwargs) -> dict:
+        self._call("get_item")
+        with self.lock:
+            item = self.items.get(self._key(Key))
+            item = copy.deepcopy(item) if item is not None else None
+        self.latency.sleep("dynamodb")
+        return {"Item": item} if item is not None else {}
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        self._write("delete_item", [Key])
+        with self.lock:
+            key = self._key(Key)
+            self._check(self.items.get(key), kwargs, "DeleteItem")
+            self.items.pop(key, None)
+        self.latency.sleep("dynamodb")
+        return {}
+
+    def update_item(self, Key: dict, UpdateExpression: str, **kwargs) -> dict:
+        self._write("update_item", [Key])
+        with self.lock:
+            key = self._key(Key)
+            old = self.items.get(key)
+            self._check(old, kwargs, "UpdateItem")
+            item = copy.deepcopy(old) if old else dict(Key)
+            _update(item, UpdateExpression,
+                    kwargs.get("ExpressionAttributeNames"), kwargs.get("ExpressionAttributeValues"))
+            self._store(key, item)
+            result = copy.deepcopy(item)
+            old = copy.deepcopy(old)
+        self.latency.sleep("dynamodb")
+        return_values = kwargs.get("ReturnValues")
+        if return_values in ("ALL_NEW", "UPDATED_NEW"):
+            return {"Attributes": result}
+        if return_values in ("ALL_OLD", "UPDATED_OLD") and old:
+            return {"Attributes": old}
+        return {}
+
+    def query(self, KeyConditionExpression, **kwargs) -> dict:
+        self._call("query")
+        ckey, conditions = _key_condition(KeyConditionExpression)
+        start = kwargs.get("ExclusiveStartKey")
+        limit = kwargs.get("Limit")
+        forward = kwargs.get("ScanIndexForward", True)
+        with self.lock:
+            items = [copy.deepcopy(v) for (c, s), v in self.items.items()
+                     if c == ckey and _match_sort_key(s, conditions)]
+        items.sort(key=lambda x: x[self.skey_name], reverse=not forward)
+        if start:
+            items = [i for i in items if (i[self.skey_name] > start[self.skey_name])
+                     == forward and i[self.skey_name] != start[self.skey_name]]
+
+        page = []
+        size = 0
+        for item in items:
+            if (limit and len(page) >= limit) or size >= self.PAGE_BYTES:
+                break
+            page.append(item)
+            size += _size(item)
+
+        if kwargs.get("FilterExpression") is not None:
+            raise ValueError("FilterExpression is not supported")
+
+        self.latency.sleep("dynamodb")
+        response = {"Items": page, "Count": len(page)}
+        if len(page) < len(items):
+            last = page[-1]
+            response["LastEvaluatedKey"] = {
+                self.ckey_name: last[self.ckey_name], self.skey_name: last[self.skey_name]}
+        return response
+
+    def batch_writer(self):
+        return _BatchWriter(self)
+
+    def scan(self, **kwargs) -> dict:
+        with self.lock:
+            return {"Items": [copy.deepcopy(v) for v in self.items.values()]}
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+        self.capacity.clear()
+
+
+class _BatchWriter:
+    """Table.batch_writer と同様に 25 件ずつ BatchWriteItem で書き込む"""
+
+    def __init__(self, table: FakeTable) -> None:
+        self.table = table
+        self.requests: list[dict] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+        return False
+
+    def flush(self) -> None:
+        client = FakeDynamoDbClient(self.table)
+        while self.requests:
+            chunk = self.requests[:client.MAX_BATCH_WRITE]
+            self.requests = self.requests[client.MAX_BATCH_WRITE:]
+            client.batch_write_item(RequestItems={self.table.name: chunk})
+
+    def put_item(self, Item: dict) -> None:
+        self.requests.append({"PutRequest": {"Item": Item}})
+        if len(self.requests) >= FakeDynamoDbClient.MAX_BATCH_WRITE:
+            self.flush()
+
+    def delete_item(self, Key: dict) -> None:
+        self.requests.append({"DeleteRequest": {"Key": Key}})
+        if len(self.requests) >= FakeDynamoDbClient.MAX_BATCH_WRITE:
+            self.flush()
+
+
+class FakeDynamoDbClient:
+    """DYNAMODB.meta.client と同様に Python の型のまま値を受け取るクライアント"""
+
+    MAX_BATCH_WRITE = 25
+
+    def __init__(self, table: FakeTable) -> None:
+        self.table = table
+
+    def transact_write_items(self, TransactItems: list[dict], **kwargs) -> dict:
+        table = self.table
+        table._write("transact_write_items",
+                     [body.get("Item") or body.get("Key") for action in TransactItems
+                      for body in action.values()])
+        with table.lock:
+            reasons = []
+            failed = False
+            for action in TransactItems:
+                (kind, body), = action.items()
+                item = body.get("Item") or body.get("Key")
+                old = table.items.get(table._key(item))
+                try:
+                    table._check(old, body, "TransactWriteItems")
+                    reasons.append({"Code": "None"})
+                except ClientError:
+                    failed = True
+                    reason = {"Code": "ConditionalCheckFailed"}
+                    if body.get("ReturnValuesOnConditionCheckFailure") == "ALL_OLD" and old:
+                        reason["Item"] = copy.deepcopy(old)
+                    reasons.append(reason)
+            if failed:
+                table.latency.sleep("dynamodb")
+                raise _error("TransactionCanceledException",
+                             "TransactWriteItems", CancellationReasons=reasons)
+
+            for action in TransactItems:
+                (kind, body), = action.items()
+                if kind == "Put":
+                    table._store(table._key(body["Item"]), copy.deepcopy(body["Item"]))
+                elif kind == "Update":
+                    key = table._key(body["Key"])
+                    item = copy.deepcopy(table.items.get(key)
+                                         or dict(body["Key"]))
+                    _update(item, body["UpdateExpression"], body.get(
+                        "ExpressionAttributeNames"), body.get("ExpressionAttributeValues"))
+                    table._store(key, item)
+                elif kind == "Delete":
+                    table.items.pop(table._key(body["Key"]), None)
+        table.latency.sleep("dynamodb")
+        return {}
+
+    def query(self, TableName: str, **kwargs) -> dict:
+        return self.table.query(**kwargs)
+
+    def batch_write_item(self, RequestItems: dict, **kwargs) -> dict:
+        table = self.table
+        requests = RequestItems[table.name]
+        table._write("batch_write_item",
+                     [(r.get("PutRequest") or {}).get("Item") or r["DeleteRequest"]["Key"] for r in requests])
+        if len(requests) > self.MAX_BATCH_WRITE:
+            raise _error("ValidationException", "BatchWriteItem")
+        with table.lock:
+            for request in requests:
+                if "PutRequest" in request:
+                    item = request["PutRequest"]["Item"]
+                    table._store(table._key(item), copy.deepcopy(item))
+                else:
+                    table.items.pop(table._key(
+                        request["DeleteRequest"]["Key"]), None)
+        table.latency.sleep("dynamodb")
+        return {"UnprocessedItems": {}}
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        table = self.table
+        table._call("batch_get_item")
+        keys = RequestItems[table.name]["Keys"]
+        with table.lock:
+            items = [copy.deepcopy(table.items[table._key(k)])
+                     for k in keys if table._key(k) in table.items]
+        table.latency.sleep("dynamodb")
+        return {"Responses": {table.name: items}, "UnprocessedKeys": {}}
+
+
+# ------------------------------------------------------------------
+# S3
+
+
+class _Body:
+
+    def __init__(self, data: bytes) -> None:
+        self._io = io.BytesIO(data)
+
+    def read(self, amt: int | None = None) -> bytes:
+        return self._io.read() if amt is None else self._io.read(amt)
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while chunk := self._io.read(chunk_size):
+            yield chunk
+
+    def close(self) -> None:
+        pass
+
+
+class FakeS3:
+
+    def __init__(self, latency: Latency) -> None:
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.tags: dict[tuple[str, str], dict[str, str]] = {}
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.bytes_copied = 0
+        self.uploads: dict[str, list[bytes]] = {}
+
+    def _call(self, name: str):
+        self.latency.count("s3." + name)
+        self.latency.sleep("s3")
+
+    def put_object(self, Body: bytes, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("put_object")
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        with self.lock:
+            self.objects[(Bucket, Key)] = bytes(Body)
+            self.tags[(Bucket, Key)] = dict(
+                t.split("=", 1) for t in (kwargs.get("Tagging") or "").split("&") if t)
+            self.bytes_written += len(Body)
+        self.latency.sleep("s3")
+        return {}
+
+    def put_object_tagging(self, Bucket: str, Key: str, Tagging: dict, **kwargs) -> dict:
+        self._call("put_object_tagging")
+        with self.lock:
+            if (Bucket, Key) not in self.objects:
+                raise _error("NoSuchKey", "PutObjectTagging")
+            self.tags[(Bucket, Key)] = {t["Key"]: t["Value"] for t in Tagging["TagSet"]}
+        self.latency.sleep("s3")
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("get_object")
+        with self.lock:
+            data = self.objects.get((Bucket, Key))
+        if data is None:
+            self.latency.sleep("s3")
+            raise _error("NoSuchKey", "GetObject")
+        byte_range = kwargs.get("Range")
+        if byte_range:
+            start, end = byte_range.split("=")[1].split("-")
+            data = data[int(start):int(end) + 1 if end else None]
+        with self.lock:
+            self.bytes_read += len(data)
+        self.latency.sleep("s3")
+        return {"Body": _Body(data), "ContentLength": len(data)}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("head_object")
+        with self.lock:
+            data = self.objects.get((Bucket, Key))
+        self.latency.sleep("s3")
+        if data is None:
+            raise _error("404", "HeadObject")
+        return {"ContentLength": len(data)}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("delete_object")
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+            self.tags.pop((Bucket, Key), None)
+        self.latency.sleep("s3")
+        return {}
+
+    def copy_object(self, CopySource: dict, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("copy_object")
+        with self.lock:
+            data = self.objects.get((CopySource["Bucket"], CopySource["Key"]))
+            if data is None:
+                raise _error("NoSuchKey", "CopyObject")
+            self.objects[(Bucket, Key)] = data
+            self.tags[(Bucket, Key)] = dict(
+                self.tags.get((CopySource["Bucket"], CopySource["Key"])) or {})
+            self.bytes_copied += len(data)
+        self.latency.sleep("s3")
+        return {}
+
+    def copy(self, CopySource: dict, Bucket: str, Key: str, **kwargs) -> None:
+        self.copy_object(CopySource=CopySource, Bucket=Bucket, Key=Key)
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", **kwargs) -> dict:
+        self._call("list_objects_v2")
+        start_after = kwargs.get("StartAfter") or ""
+        token = kwargs.get("ContinuationToken") or ""
+        max_keys = kwargs.get("MaxKeys") or 1000
+        with self.lock:
+            keys = sorted((k, len(v)) for (b, k), v in self.objects.items()
+                          if b == Bucket and k.startswith(Prefix) and k > start_after and k > token)
+        self.latency.sleep("s3")
+        page = keys[:max_keys]
+        response = {
+            "Contents": [{"Key": k, "Size": s} for k, s in page],
+            "KeyCount": len(page),
+            "IsTruncated": len(keys) > max_keys,
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1][0]
+        return response
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("create_multipart_upload")
+        upload_id = f"{Bucket}/{Key}/{len(self.uploads)}"
+        with self.lock:
+            self.uploads[upload_id] = []
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Body: bytes, Bucket: str, Key: str, UploadId: str, PartNumber: int, **kwargs) -> dict:
+        self._call("upload_part")
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        with self.lock:
+            parts = self.uploads[UploadId]
+            while len(parts) < PartNumber:
+                parts.append(b"")
+            parts[PartNumber - 1] = bytes(Body)
+            self.bytes_written += len(Body)
+        return {"ETag": str(PartNumber)}
+
+    def upload_part_copy(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, CopySource: dict, **kwargs) -> dict:
+        self._call("upload_part_copy")
+        with self.lock:
+            data = self.objects[(CopySource["Bucket"], CopySource["Key"])]
+            byte_range = kwargs.get("CopySourceRange")
+            if byte_range:
+                start, end = byte_range.split("=")[1].split("-")
+                data = data[int(start):int(end) + 1]
+            parts = self.uploads[UploadId]
+            while len(parts) < PartNumber:
+                parts.append(b"")
+            parts[PartNumber - 1] = data
+        return {"CopyPartResult": {"ETag": str(PartNumber)}}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self._call("complete_multipart_upload")
+        with self.lock:
+            self.objects[(Bucket, Key)] = b"".join(self.uploads.pop(UploadId))
+        return {}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def clear(self) -> None:
+        with self.lock:
+            self.objects.clear()
+            self.tags.clear()
+            self.uploads.clear()
+            self.bytes_written = 0
+            self.bytes_read = 0
+            self.bytes_copied = 0
+
+
+# ------------------------------------------------------------------
+
+
+# Lambda
+
+
+class FakeLambda:
+    """自身の非同期呼び出し (InvocationType=Event) を別スレッドで main.handler に渡す"""
+
+    def __init__(self, latency: Latency) -> None:
+        self.latency = latency
+        self.handler = None
+        self.threads: list[threading.Thread] = []
+
+    def invoke(self, FunctionName: str, InvocationType: str = "RequestResponse", Payload: bytes = b"{}", **kwargs) -> dict:
+        self.latency.count("lambda.invoke")
+        self.latency.sleep("dynamodb")
+        thread = threading.Thread(target=self.handler, args=(json.loads(Payload), None))
+        thread.start()
+        self.threads.append(thread)
+        return {"StatusCode": 202}
+
+    def join(self) -> None:
+        """非同期呼び出しがすべて終わるまで待つ"""
+        while self.threads:
+            self.threads.pop().join()
+
+
+class FakeStream:
+    """DynamoDB Streams (StreamViewType=KEYS_ONLY) と Lambda のイベントソースマッピングのスタンドイン
+
+    テーブルへの書き込みを ckey のハッシュで決まるシャードにレコードとして記録し、
+    シャードごとに 1 つのスレッドが最大 batch_size 件ずつ handler を順番に呼び出す。
+    レコードがない場合は poll_interval 秒ごとにシャードを確認する。
+    handler が batchItemFailures を返した場合はその中で最も小さい SequenceNumber のレコードから、
+    例外の場合はバッチ全体を再試行する (ReportBatchItemFailures)。"""
+
+    def __init__(self, table: FakeTable, shards: int = 4, batch_size: int = 100,
+                 poll_interval: float = 0.25) -> None:
+        self.table = table
+        self.shards: list[list[dict]] = [[] for _ in range(shards)]
+        self.positions = [0] * shards
+        self.busy = [False] * shards
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.threads: list[threading.Thread] = []
+        self.stopped = False
+        self.invocations = 0
+        self.retries = 0
+
+    def record(self, key: tuple[str, str], event_name: str) -> None:
+        ckey, skey = key
+        with self.condition:
+            self.sequence += 1
+            shard = self.shards[zlib.crc32(ckey.encode()) % len(self.shards)]
+            shard.append({
+                "eventID": str(self.sequence),
+                "eventName": event_name,
+                "eventSource": "aws:dynamodb",
+                "dynamodb": {
+                    "Keys": {self.table.ckey_name: {"S": ckey}, self.table.skey_name: {"S": skey}},
+                    "SequenceNumber": f"{self.sequence:021}",
+                    "StreamViewType": "KEYS_ONLY",
+                },
+            })
+
+    def start(self, handler) -> None:
+        self.stopped = False
+        self.table.stream = self
+        self.threads = [threading.Thread(target=self._poll, args=(n, handler), daemon=True)
+                        for n in range(len(self.shards))]
+        for thread in self.threads:
+            thread.start()
+
+    def _poll(self, n: int, handler) -> None:
+        shard = self.shards[n]
+        while not self.stopped:
+            with self.condition:
+                batch = shard[self.positions[n]:self.positions[n] + self.batch_size]
+                self.busy[n] = bool(batch)
+            if not batch:
+                time.sleep(self.poll_interval)
+                continue
+
+            self.table.latency.count("lambda.stream_invoke")
+            self.table.latency.sleep("dynamodb")
+            self.invocations += 1
+            try:
+                response = handler({"Records": batch}, None) or {}
+                failures = [f["itemIdentifier"] for f in response.get("batchItemFailures") or []]
+            except Exception:
+                failures = [batch[0]["dynamodb"]["SequenceNumber"]]
+
+            processed = len(batch)
+            if failures:
+                self.retries += 1
+                first = min(failures)
+                processed = next(i for i, r in enumerate(batch) if r["dynamodb"]["SequenceNumber"] == first)
+            with self.condition:
+                self.positions[n] += processed
+                self.busy[n] = False
+                self.condition.notify_all()
+
+    def drain(self, timeout: float = 60) -> None:
+        """記録されたレコードをすべて handler が処理し終わるまで待つ"""
+
+        deadline = time.time() + timeout
+        with self.condition:
+            while any(self.busy) or any(p < len(s) for p, s in zip(self.positions, self.shards)):
+                if time.time() > deadline:
+                    raise TimeoutError("stream is not drained")
+                self.condition.wait(0.05)
+
+    def stop(self) -> None:
+        self.stopped = True
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.table.stream = None
+
+    def clear(self) -> None:
+        with self.condition:
+            for shard in self.shards:
+                shard.clear()
+            self.positions = [0] * len(self.shards)
+            self.invocations = 0
+            self.retries = 0
+
+
+# ------------------------------------------------------------------
+
+
+LATENCY_MODEL = Latency()
+TABLE = FakeTable(LATENCY_MODEL)
+DYNAMODB_CLIENT = FakeDynamoDbClient(TABLE)
+S3 = FakeS3(LATENCY_MODEL)
+LAMBDA = FakeLambda(LATENCY_MODEL)
+STREAM = FakeStream(TABLE)
+
+
+def start(latency: bool = True):
+    """main モジュールを import して DynamoDB / S3 をスタンドインに差し替えて返す"""
+
+    LATENCY_MODEL.enabled = latency
+
+    import main
+
+    main.TABLE = TABLE
+    main.DYNAMODB_CLIENT = DYNAMODB_CLIENT
+    main.S3 = S3
+    main.LAMBDA = LAMBDA
+    LAMBDA.handler = main.handler
+
+    return main
+
+
+def reset():
+    """テーブルとバケットの中身を空にする"""
+
+    LAMBDA.join()
+    if TABLE.stream:
+        STREAM.drain()
+    STREAM.clear()
+    TABLE.clear()
+    S3.clear()
+    if (main := sys.modules.get("main")):
+        main.CURRENT_POINTER.clear()
+    LATENCY_MODEL.calls.clear()
+
+
+def run_writers(func, writers: int, ops: int) -> dict:
+    """writers 個のスレッドから func(data) を ops 回ずつ呼び出してレイテンシを計測する"""
+
+    durations: list[float] = []
+    errors: list[Exception] = []
+    lock = threading.Lock()
+
+    def writer(no: int):
+        for i in range(ops):
+            data = f"{no:03}-{i:03}"
+            t = time.perf_counter()
+            try:
+                func(data)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                durations.append(time.perf_counter() - t)
+
+    threads = [threading.Thread(target=writer, args=(no,))
+               for no in range(writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "ops": len(durations),
+        "errors": len(errors),
+        "p50[ms]": round(percentile(durations, 50) * 1000, 1),
+        "p99[ms]": round(percentile(durations, 99) * 1000, 1),
+        "ops/s": round(len(durations) / elapsed, 1),
+    }
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1,
+                max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
@@ -1,6 +1,12 @@
 import json
+import math
+from decimal import Decimal
 import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import os
+import threading
 import boto3
 from botocore.exceptions import ClientError
 import time
@@ -21,17 +27,138 @@ DYNAMODB_OPE_ITEM_NAME = "ope"
 
 DYNAMODB_SORT_KEY_OPE_SUFIX = "_OPE"
 DYNAMODB_SORT_KEY_SAV_SUFIX = "_SAV"
+DYNAMODB_SORT_KEY_RES_SUFIX = "_RES"
+DYNAMODB_SORT_KEY_META_SUFIX = "_META"
+
+# オブジェクトを指定しない場合 (/dy-queue) の cky (従来の TEST_OPE / TEST_META などのパーティション)
+DYNAMODB_DEFAULT_CHUNK_KEY = "TEST"
+DYNAMODB_LAST_OPE_SORT_KEY = "LAST_OPE"
+DYNAMODB_APPLY_LEASE_SORT_KEY = "APPLY_LEASE"
+DYNAMODB_RESULT_SORT_KEY_PREFIX = "OP:c0:"
 
 S3_BUKET_NAME = os.environ["S3_BUKET_NAME"]
 
 S3_DEFAULT_DB_KEY = "db.json"
 
 S3_DB_SNAPSHOT_FOLDER = "snapshot/"
+S3_DB_BASE_FOLDER = "base/"
+
+# オブジェクトの cky (${system_name}:${object_path}) の system_name
+OBJECT_SYSTEM_NAME = os.environ.get("OBJECT_SYSTEM_NAME") or "async-api-sample"
+# object_path の上限の長さ (cky はパーティションキーなので 2048 byte 以内に収める)
+OBJECT_PATH_MAX_LENGTH = 512
+OBJECT_PATH_SEGMENT = re.compile(r"[A-Za-z0-9_.\-]+")
+
+# スナップショットの保存形式
+#   full: 毎回 Db 全体を保存する
+#   delta: base/ に保存した Db 全体 (base) からの差分の ope だけを保存し、
+#          差分が大きくなったら新しい base を保存する (compaction)
+SNAPSHOT_FORMAT_FULL = "full"
+SNAPSHOT_FORMAT_DELTA = "delta"
+SNAPSHOT_FORMAT = os.environ.get("SNAPSHOT_FORMAT") or SNAPSHOT_FORMAT_DELTA
+# 差分のサイズが SNAPSHOT_DELTA_FACTOR * sqrt(base のサイズ) を超えたら compaction する
+# 1 ope あたりの書き込み量が base のサイズの平方根に比例する程度に抑えられる
+SNAPSHOT_DELTA_FACTOR = float(os.environ.get("SNAPSHOT_DELTA_FACTOR") or "8")
+SNAPSHOT_DELTA_MIN_BYTES = 4 * 1024
+
+# スナップショットを書き込むときの形式 (json or binary)
+# 読み込み時は先頭のヘッダーで判別するので、バケット内に形式が混在していてもよい
+SNAPSHOT_CODEC = os.environ.get("SNAPSHOT_CODEC") or "json"
+
+# スナップショットの公開方式
+#   pointer: CURRENT_DB (cur) の条件付き更新だけで公開し、読み込み側は cur の snapshot/ を直接読む
+#   copy: cur の更新後に snapshot/ を db.json に従来の形式 (skey, data) で書き込む (従来の方式)
+PUBLISH_MODE_POINTER = "pointer"
+PUBLISH_MODE_COPY = "copy"
+PUBLISH_MODE = os.environ.get("PUBLISH_MODE") or PUBLISH_MODE_POINTER
+# pointer の場合に db.json を読む既存の利用者のために db.json を更新するか
+#   none: 更新しない
+#   async: 自身を非同期 (Event) で呼び出して cur のスナップショットを db.json に従来の形式で書き込む
+DB_JSON_SYNC_NONE = "none"
+DB_JSON_SYNC_ASYNC = "async"
+DB_JSON_SYNC = os.environ.get("DB_JSON_SYNC") or DB_JSON_SYNC_NONE
+DB_JSON_SYNC_ACTION = "sync-db-json"
+# GET で読み込むときに cur を再利用する期間[s] (0 の場合は毎回 DynamoDB から取得する)
+POINTER_CACHE_TTL = float(os.environ.get("POINTER_CACHE_TTL") or "0.5")
+# 公開中のスナップショットに付けるタグ
+# バケットのライフサイクルルールは pub=0 のスナップショットだけを削除する
+S3_SNAPSHOT_PUBLISHED_TAG = "pub"
+# 失敗してもリクエストを失敗させない処理 (公開前後のタグの更新や非同期呼び出し) の試行回数と最初の再試行までの時間[s]
+BEST_EFFORT_MAX_ATTEMPTS = 3
+BEST_EFFORT_RETRY_DELAY = 0.05
+
+# 自分より前の ope がコミットされるのを待つ方式
+#   watermark: ope の書き込みと最新の操作 (lsk) の条件付き更新を同一トランザクションで行う
+#   sleep: ope の書き込み後に OPE_COMMIT_WAIT_SLEEP 秒待機する (従来の方式)
+OPE_COMMIT_WAIT_MODE_WATERMARK = "watermark"
+OPE_COMMIT_WAIT_MODE_SLEEP = "sleep"
+OPE_COMMIT_WAIT_MODE = os.environ.get(
+    "OPE_COMMIT_WAIT_MODE") or OPE_COMMIT_WAIT_MODE_WATERMARK
+OPE_COMMIT_WAIT_SLEEP = float(os.environ.get("OPE_COMMIT_WAIT_SLEEP") or "0.05")
+OPE_COMMIT_MAX_ATTEMPTS = 10
+# TransactWriteItems の上限のアイテム数 (watermark 方式では 1 トランザクションに lsk の更新と ope を 99 件まで含める)
+DYNAMODB_TRANSACT_MAX_ITEMS = 100
+# BatchGetItem の上限のキー数
+DYNAMODB_BATCH_GET_MAX_KEYS = 100
+
+# 1 回の POST でまとめて書き込める ope の数
+BATCH_MAX_OPES = int(os.environ.get("BATCH_MAX_OPES") or "100")
+
+# POST / DELETE の応答の方式 (クエリパラメータ submit=sync|async で呼び出しごとに指定することもできる)
+#   sync: ope の適用・スナップショットの保存・公開まで待って結果を返す
+#   async: ope をコミットした時点で 202 と skey を返し、適用は自身の非同期呼び出し (または後続の sync のリクエスト) で行う
+#          結果は GET /dy-queue/ops/{skey} で取得する
+SUBMIT_MODE_SYNC = "sync"
+SUBMIT_MODE_ASYNC = "async"
+SUBMIT_MODE = os.environ.get("SUBMIT_MODE") or SUBMIT_MODE_SYNC
+APPLY_PENDING_ACTION = "apply-pending"
+
+# ope の TTL[s]
+OPE_TTL = 60
+# ope の結果の TTL[s] (async の場合はこの時間内に GET /dy-queue/ops/{skey} で取得する)
+RESULT_TTL = int(os.environ.get("RESULT_TTL") or "300")
+
+# ope を取得するときの 1 ページの件数 (0 の場合は DynamoDB の上限 1MB まで)
+QUERY_PAGE_SIZE = int(os.environ.get("QUERY_PAGE_SIZE") or "0")
+# 取得したページを適用している間に次のページを先読みするか
+QUERY_PREFETCH = (os.environ.get("QUERY_PREFETCH") or "true").lower() == "true"
+
+# ope の適用方式
+#   race: 各リクエストが自分の ope までを適用してスナップショットを保存する
+#   group: リースを取得した 1 つのリクエストがコミット済みの ope をまとめて適用し、
+#          他のリクエストは保存された結果を待つ
+#   stream: リクエストは ope を書き込むだけで、DynamoDB Streams から呼び出される applier.py の handler が
+#           シャードごとに 1 つずつ順番にまとめて適用し、リクエストは保存された結果を待つ
+OPE_APPLY_MODE_RACE = "race"
+OPE_APPLY_MODE_GROUP = "group"
+OPE_APPLY_MODE_STREAM = "stream"
+OPE_APPLY_MODE = os.environ.get("OPE_APPLY_MODE") or OPE_APPLY_MODE_RACE
+# リースの有効期間[s] (リーダーが異常終了した場合はこの時間後に他のリクエストが引き継ぐ)
+GROUP_COMMIT_LEASE = float(os.environ.get("GROUP_COMMIT_LEASE") or "3")
+# フォロワー (stream の場合はリクエスト) が結果を待つ上限[s]
+GROUP_COMMIT_TIMEOUT = float(os.environ.get("GROUP_COMMIT_TIMEOUT") or "8")
+GROUP_COMMIT_POLL_INTERVAL = 0.01
+GROUP_COMMIT_POLL_INTERVAL_MAX = 0.1
+
+# API 呼び出しとフェーズごとの所要時間を集計して呼び出しごとに 1 件のサマリーを出力するか
+TRACE_ENABLED = (os.environ.get("TRACE_ENABLED") or "true").lower() == "true"
+# API 呼び出しごとの所要時間も出力するか (ログの量が増えるので調査時のみ有効にする)
+TRACE_SPAN_LOG = (os.environ.get("TRACE_SPAN_LOG") or "false").lower() == "true"
+
+# ウォームコンテナ内で保持する Db のスナップショットの上限
+SNAPSHOT_CACHE_MAX_ENTRIES = int(
+    os.environ.get("SNAPSHOT_CACHE_MAX_ENTRIES") or "4")
+SNAPSHOT_CACHE_MAX_ITEMS = int(
+    os.environ.get("SNAPSHOT_CACHE_MAX_ITEMS") or "200000")
 
 
 # ------------------------------------------------------------------
 
 
+RESPONSE_400 = {
+    'statusCode': 400,
+    'body': json.dumps('Bad Request')
+}
 RESPONSE_404 = {
     'statusCode': 404,
     'body': json.dumps('Not Found')
@@ -48,6 +175,128 @@ DEBUG_DATA = ""
 # ------------------------------------------------------------------
 
 
+class Span:
+    """1 回の API 呼び出しの計測値"""
+
+    __slots__ = ("name", "started", "bytes", "retries")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.started = time.perf_counter()
+        self.bytes = 0
+        self.retries = 0
+
+    def record(self, response: dict | None, nbytes: int | None = None) -> None:
+        """レスポンスのメタデータから再試行回数と転送量を記録する
+        nbytes を省略した場合はレスポンスの content-length を転送量とする"""
+
+        meta = (response or {}).get("ResponseMetadata") or {}
+        self.retries = meta.get("RetryAttempts") or 0
+        if nbytes is None:
+            nbytes = int((meta.get("HTTPHeaders") or {}).get("content-length") or 0)
+        self.bytes = nbytes
+
+
+class Trace:
+    """1 回の呼び出しの API 呼び出しとフェーズの所要時間を集計する
+
+    API 呼び出しは名前ごとに回数・時間・転送量・再試行回数を合計する (先読みのスレッドからも呼ばれる)。
+    フェーズは入れ子にでき、内側のフェーズの時間は外側のフェーズから除く (入れ子はスレッドごとに管理する)。"""
+
+    PHASES = ["put_ope", "wait", "query", "load", "apply", "save", "publish"]
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.perf_counter()
+        with self.lock:
+            self.calls: dict[str, dict] = {}
+            self.phases: dict[str, float] = {}
+        self.local.stack = []
+
+    @contextmanager
+    def span(self, name: str):
+        span = Span(name)
+        try:
+            yield span
+        except ClientError as e:
+            span.record(e.response, nbytes=span.bytes)
+            raise
+        finally:
+            ms = (time.perf_counter() - span.started) * 1000
+            if TRACE_ENABLED:
+                with self.lock:
+                    call = self.calls.get(name)
+                    if call is None:
+                        call = self.calls[name] = {"n": 0, "ms": 0.0, "bytes": 0, "retries": 0}
+                    call["n"] += 1
+                    call["ms"] += ms
+                    call["bytes"] += span.bytes
+                    call["retries"] += span.retries
+            if TRACE_SPAN_LOG:
+                logger.info({"msg": "span", "data": DEBUG_DATA, "name": name, "ms": round(ms, 2),
+                             "bytes": span.bytes, "retries": span.retries})
+
+    @contextmanager
+    def phase(self, name: str):
+        if not TRACE_ENABLED:
+            yield
+            return
+
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+
+        now = time.perf_counter()
+        if stack:
+            parent = stack[-1]
+            self._add_phase(parent[0], now - parent[1])
+        stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            _, started = stack.pop()
+            self._add_phase(name, now - started)
+            if stack:
+                stack[-1][1] = now
+
+    def _add_phase(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def summary(self) -> dict:
+        total = (time.perf_counter() - self.started) * 1000
+        with self.lock:
+            phases = {name: round(self.phases.get(name, 0.0) * 1000, 2)
+                      for name in self.PHASES}
+            calls = {name: {**call, "ms": round(call["ms"], 2)}
+                     for name, call in sorted(self.calls.items())}
+        return {
+            "total_ms": round(total, 2),
+            "phases": phases,
+            "other_ms": round(total - sum(phases.values()), 2),
+            "calls": calls,
+        }
+
+
+TRACE = Trace()
+# ウォームスタートかどうかの判定に使用する (最初の呼び出しの終了時に False にする)
+COLD_START = True
+
+
+def traced(name: str, func, /, *args, nbytes: int | None = None, **kwargs):
+    """func を呼び出して name の API 呼び出しとして計測する"""
+
+    with TRACE.span(name) as span:
+        response = func(*args, **kwargs)
+        span.record(response if isinstance(response, dict) else None, nbytes=nbytes)
+        return response
+
+
 def convert_path(event) -> str:
     if not event:
         return ""
@@ -78,13 +327,95 @@ def convert_body_data(event) -> dict:
         return {}
     return json.loads(event.get("body") or "{}")
 
+
+class QueueObject:
+    """操作対象のオブジェクト
+
+    cky (${system_name}:${object_path}) ごとに ope・結果・メタデータ (CURRENT_DB / LAST_OPE / APPLY_LEASE) の
+    パーティションと、S3 のスナップショット・base・db.json のキーを分ける。
+    異なるオブジェクトへの操作は同じアイテムもオブジェクトも更新しないので、互いの完了を待たない。
+    object_path が空の場合は従来のキー (TEST_OPE / TEST_META / snapshot/ / db.json) を使用する。"""
+
+    def __init__(self, object_path: str = "", system_name: str = OBJECT_SYSTEM_NAME) -> None:
+        self.object_path = object_path
+        if object_path:
+            self.cky = f"{system_name}:{object_path}"
+            # スナップショットはライフサイクルルールの対象になるように snapshot/ の下に置く
+            self.s3_prefix = f"{system_name}/{object_path}/"
+        else:
+            self.cky = DYNAMODB_DEFAULT_CHUNK_KEY
+            self.s3_prefix = ""
+
+    def chunk_key(self, suffix: str) -> str:
+        return self.cky + suffix
+
+    def snapshot_key(self, skey: str) -> str:
+        return S3_DB_SNAPSHOT_FOLDER + self.s3_prefix + skey + ".json"
+
+    def base_key(self, skey: str) -> str:
+        return S3_DB_BASE_FOLDER + self.s3_prefix + skey + ".json"
+
+    @property
+    def db_key(self) -> str:
+        return self.s3_prefix + S3_DEFAULT_DB_KEY
+
+
+DEFAULT_OBJECT = QueueObject()
+
+
+def is_valid_object_path(object_path: str) -> bool:
+    if not object_path or len(object_path) > OBJECT_PATH_MAX_LENGTH:
+        return False
+    return all(OBJECT_PATH_SEGMENT.fullmatch(segment) and segment not in (".", "..")
+               for segment in object_path.split("/"))
+
+
+def convert_object(path: str) -> QueueObject | None:
+    """/dy-queue/objects/{object_path} の object_path のオブジェクトを返す
+
+    /dy-queue の場合は従来のオブジェクト、それ以外のパスや object_path が不正な場合は None を返す。"""
+
+    m = re.match(r".*[/]dy-queue(?:/objects/(?P<object_path>.*))?/?$", path)
+    if not m:
+        return None
+    object_path = m.group("object_path")
+    if object_path is None:
+        return DEFAULT_OBJECT
+    object_path = object_path.strip("/")
+    return QueueObject(object_path) if is_valid_object_path(object_path) else None
+
+
+def convert_chunk_key(cky: str) -> QueueObject | None:
+    """cky (ckey からサフィックスを除いたもの) のオブジェクトを返す (この system_name のものでない場合は None)"""
+
+    if cky == DYNAMODB_DEFAULT_CHUNK_KEY:
+        return DEFAULT_OBJECT
+    system_name, sep, object_path = cky.partition(":")
+    if not sep or system_name != OBJECT_SYSTEM_NAME or not is_valid_object_path(object_path):
+        return None
+    return QueueObject(object_path)
+
+
+def convert_ope_path(path: str) -> tuple[str, str] | None:
+    """/dy-queue[/objects/{object_path}]/ops/{skey} を (オブジェクトのパス, skey) に分ける
+
+    ope の結果の取得のパスでない場合は None を返す (skey は ULID の形式のみ)。"""
+
+    m = re.match(r"(?P<path>.*[/]dy-queue(?:/objects/.*)?)/ops/(?P<skey>[0-9A-HJKMNP-TV-Z]{26})$", path)
+    if not m:
+        return None
+    return m.group("path"), m.group("skey")
+
 # ------------------------------------------------------------------
 
 
 DYNAMODB = boto3.resource("dynamodb")
 TABLE = DYNAMODB.Table(DYNAMODB_TABLE_NAME)
+# Table と同じく Python の型のまま値を渡せるクライアント
+DYNAMODB_CLIENT = DYNAMODB.meta.client
 
 S3 = boto3.client("s3")
+LAMBDA = boto3.client("lambda")
 
 
 class Db(dict):
@@ -93,6 +424,23 @@ class Db(dict):
         if (src):
             super().__init__(src)
 
+        # delta 形式で保存するための情報 (Db の内容としてはシリアライズしない)
+        # base_skey: 差分の元になる base の skey
+        # base_bytes: base のサイズ
+        # delta: base 以降に適用した [skey, ope] のリスト
+        self.base_skey: str | None = None
+        self.base_bytes = 0
+        self.delta: list[list] = []
+
+    def clone(self) -> "Db":
+        # data 以外は文字列なので data だけ複製すれば呼び出し側で変更しても影響しない
+        dst = Db(self)
+        dst.data = self.data.copy()
+        dst.base_skey = self.base_skey
+        dst.base_bytes = self.base_bytes
+        dst.delta = list(self.delta)
+        return dst
+
     @property
     def skey(self) -> str | None:
         return self.get("skey")
@@ -180,18 +528,146 @@ class Result(dict):
         self["message"] = value
 
 
-def put_ope(ckey_suffix: str, skey: str, data: str, method: str = Ope.INSERT):
+class PackedData:
+    """バイナリ形式のスナップショットの data を、必要になるまでデコードせずに保持するリスト
+
+    要素は (4 byte の長さ + UTF-8) の連続したバイト列のまま保持し、
+    追加された要素だけを tail に持つ。再度バイナリ形式で保存する場合はバイト列をそのまま書き出す。"""
+
+    def __init__(self, buffer: bytes = b"", count: int = 0):
+        self.buffer = buffer
+        self.count = count
+        self.tail: list[str] = []
+
+    def __len__(self) -> int:
+        return self.count + len(self.tail)
+
+    def __iter__(self):
+        buffer = memoryview(self.buffer)
+        pos = 0
+        for _ in range(self.count):
+            size = int.from_bytes(buffer[pos:pos + 4], "big")
+            pos += 4
+            yield str(buffer[pos:pos + size], "utf-8")
+            pos += size
+        yield from self.tail
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def append(self, value: str) -> None:
+        self.tail.append(value)
+
+    def clear(self) -> None:
+        self.buffer = b""
+        self.count = 0
+        self.tail = []
+
+    def copy(self) -> "PackedData":
+        dst = PackedData(self.buffer, self.count)
+        dst.tail = list(self.tail)
+        return dst
+
+
+def encode_json_default(value):
+    """json.dumps で変換できない値を変換する (変換できない型は TypeError)
+
+    PackedData はリストに、DynamoDB から読み込んだ数値 (Decimal) は int か float にする。"""
+
+    if isinstance(value, PackedData):
+        return list(value)
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonCodec:
+
+    name = "json"
+
+    def encode(self, obj: dict) -> bytes:
+        return json.dumps(obj, default=encode_json_default).encode("utf-8")
+
+    def decode(self, data: bytes) -> dict:
+        return json.loads(data.decode("utf-8"))
+
+
+class BinaryCodec:
+    """長さ付きのバイナリ形式
 
-    ckey = "TEST" + ckey_suffix
-    ttl = int(time.time()) + 60
+    MAGIC (4 byte) | ヘッダー長 (4 byte) | ヘッダー (data 以外の JSON) | data の要素数 (4 byte) | (要素長 (4 byte) | 要素)...
 
+    デコード時は data を PackedData のまま返すので、要素数に比例した str の生成は行わない。"""
+
+    name = "binary"
+    MAGIC = b"ADB\x01"
+
+    def encode(self, obj: dict) -> bytes:
+        header = json.dumps(
+            {k: v for k, v in obj.items() if k != "data"}, default=encode_json_default).encode("utf-8")
+        values = obj.get("data") or []
+
+        if isinstance(values, PackedData):
+            body = [values.buffer]
+            tail = values.tail
+        else:
+            body = []
+            tail = values
+        for value in tail:
+            b = value.encode("utf-8")
+            body.append(len(b).to_bytes(4, "big"))
+            body.append(b)
+
+        return b"".join([self.MAGIC, len(header).to_bytes(4, "big"), header,
+                         len(values).to_bytes(4, "big"), *body])
+
+    def decode(self, data: bytes) -> dict:
+        pos = len(self.MAGIC)
+        size = int.from_bytes(data[pos:pos + 4], "big")
+        pos += 4
+        obj = json.loads(data[pos:pos + size].decode("utf-8"))
+        pos += size
+        count = int.from_bytes(data[pos:pos + 4], "big")
+        pos += 4
+        if count:
+            obj["data"] = PackedData(data[pos:], count)
+        return obj
+
+
+SNAPSHOT_CODECS = {codec.name: codec for codec in [JsonCodec(), BinaryCodec()]}
+
+
+def encode_snapshot(obj: dict) -> bytes:
+    return SNAPSHOT_CODECS[SNAPSHOT_CODEC].encode(obj)
+
+
+def decode_snapshot(data: bytes) -> dict:
+    if data.startswith(BinaryCodec.MAGIC):
+        return SNAPSHOT_CODECS[BinaryCodec.name].decode(data)
+    return SNAPSHOT_CODECS[JsonCodec.name].decode(data)
+
+
+def new_ope(data: str, method: str = Ope.INSERT) -> Ope:
     ope = Ope()
     ope.method = method
     ope.data = data
+    return ope
+
+
+def put_ope(obj: QueueObject, ckey_suffix: str, skey: str, data: str, method: str = Ope.INSERT):
+
+    ckey = obj.chunk_key(ckey_suffix)
+    ttl = int(time.time()) + OPE_TTL
+
+    ope = new_ope(data=data, method=method)
 
     logger.info({"msg": "put to dynamodb - before",
                 "data": DEBUG_DATA, "ckey": ckey, "skey": skey})
-    response = TABLE.put_item(
+    response = traced(
+        "dynamodb.put_item", TABLE.put_item,
         Item={
             DYNAMODB_CHUNK_KEY_NAME: ckey,
             DYNAMODB_SORT_KEY_NAME: skey,
@@ -203,41 +679,249 @@ def put_ope(ckey_suffix: str, skey: str, data: str, method: str = Ope.INSERT):
                 "data": DEBUG_DATA, "ckey": ckey, "skey": skey})
 
 
-def set_current_skey(skey: str) -> bool:
-    chunk_key = "TEST_META"
+def put_opes(obj: QueueObject, ckey_suffix: str, skeys: list[str], opes: list[Ope]) -> None:
+    """ope を BatchWriteItem でまとめて書き込む (25 件ずつ)"""
+
+    ckey = obj.chunk_key(ckey_suffix)
+    ttl = int(time.time()) + OPE_TTL
+
+    logger.info({"msg": "put batch to dynamodb - before",
+                "data": DEBUG_DATA, "ckey": ckey, "skey": skeys[0], "count": len(opes)})
+    with TRACE.span("dynamodb.batch_write_item"), TABLE.batch_writer() as batch:
+        for skey, ope in zip(skeys, opes):
+            batch.put_item(
+                Item={
+                    DYNAMODB_CHUNK_KEY_NAME: ckey,
+                    DYNAMODB_SORT_KEY_NAME: skey,
+                    DYNAMODB_TTL_ITEM_NAME: ttl,
+                    DYNAMODB_OPE_ITEM_NAME: dict(ope),
+                }
+            )
+    logger.info({"msg": "put batch to dynamodb - after",
+                "data": DEBUG_DATA, "ckey": ckey, "skey": skeys[0], "count": len(opes)})
+
+
+def put_ope_with_watermark(obj: QueueObject, ckey_suffix: str, skey: str, data: str,
+                           method: str = Ope.INSERT) -> str:
+    """ope の書き込みと LAST_OPE の lsk の更新を 1 つのトランザクションで行う
+
+    lsk より小さい skey の ope は書き込めないので、書き込みが成功した時点で
+    自分より前の skey を持つ ope はすべてコミット済みになっている。
+    書き込みに失敗した場合は lsk より大きい skey を採番しなおして再試行する。
+    実際に書き込んだ skey を返す。"""
+
+    return put_opes_with_watermark(obj, ckey_suffix=ckey_suffix, skeys=[skey],
+                                   opes=[new_ope(data=data, method=method)])[0]
+
+
+def put_opes_with_watermark(obj: QueueObject, ckey_suffix: str, skeys: list[str], opes: list[Ope]) -> list[str]:
+    """連続した skey の ope をまとめて書き込み、LAST_OPE の lsk を最後の skey に更新する
+
+    TransactWriteItems の上限を超える場合は複数のトランザクションに分ける。
+    各トランザクションの skey は前のトランザクションの skey より大きいので、順序はまとめて書き込んだ順になる。
+    実際に書き込んだ skey を返す。"""
+
+    size = DYNAMODB_TRANSACT_MAX_ITEMS - 1
+    written: list[str] = []
+    for start in range(0, len(opes), size):
+        chunk = opes[start:start + size]
+        chunk_skeys = skeys[start:start + size]
+        if written and chunk_skeys[0] <= written[-1]:
+            # 前のトランザクションで採番しなおしている
+            chunk_skeys = new_skeys(len(chunk), written[-1])
+        written += transact_opes_with_watermark(obj, ckey_suffix, chunk_skeys, chunk)
+    return written
+
+
+def transact_opes_with_watermark(obj: QueueObject, ckey_suffix: str, skeys: list[str],
+                                 opes: list[Ope]) -> list[str]:
+
+    ckey = obj.chunk_key(ckey_suffix)
+
+    meta_key = {
+        DYNAMODB_CHUNK_KEY_NAME: obj.chunk_key(DYNAMODB_SORT_KEY_META_SUFIX),
+        DYNAMODB_SORT_KEY_NAME: DYNAMODB_LAST_OPE_SORT_KEY,
+    }
+
+    for attempt in range(OPE_COMMIT_MAX_ATTEMPTS):
+        ttl = int(time.time()) + OPE_TTL
+        puts = [
+            {
+                "Put": {
+                    "TableName": DYNAMODB_TABLE_NAME,
+                    "Item": {
+                        DYNAMODB_CHUNK_KEY_NAME: ckey,
+                        DYNAMODB_SORT_KEY_NAME: skey,
+                        DYNAMODB_TTL_ITEM_NAME: ttl,
+                        DYNAMODB_OPE_ITEM_NAME: dict(ope),
+                    },
+                }
+            }
+            for skey, ope in zip(skeys, opes)
+        ]
+        try:
+            logger.info({"msg": "put to dynamodb with watermark - before", "data": DEBUG_DATA,
+                        "ckey": ckey, "skey": skeys[0], "count": len(opes), "attempt": attempt})
+            traced(
+                "dynamodb.transact_write_items", DYNAMODB_CLIENT.transact_write_items,
+                TransactItems=[
+                    *puts,
+                    {
+                        "Update": {
+                            "TableName": DYNAMODB_TABLE_NAME,
+                            "Key": meta_key,
+                            "UpdateExpression": "SET lsk = :last",
+                            "ConditionExpression": "attribute_not_exists(lsk) OR lsk < :first",
+                            "ExpressionAttributeValues": {":first": skeys[0], ":last": skeys[-1]},
+                            "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+                        }
+                    },
+                ]
+            )
+            logger.info({"msg": "put to dynamodb with watermark - after", "data": DEBUG_DATA,
+                        "ckey": ckey, "skey": skeys[0], "count": len(opes), "attempt": attempt})
+            return skeys
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+
+            reasons = e.response.get("CancellationReasons") or []
+            codes = [r.get("Code") for r in reasons]
+            logger.info({"msg": "put to dynamodb with watermark - canceled", "data": DEBUG_DATA,
+                        "ckey": ckey, "skey": skeys[0], "attempt": attempt, "codes": codes})
+
+            meta_reason = reasons[-1] if len(reasons) > len(opes) else {}
+            if meta_reason.get("Code") == "ConditionalCheckFailed":
+                # 自分より大きい skey が既にコミットされているので採番しなおす
+                lsk = (meta_reason.get("Item") or {}).get("lsk")
+                if isinstance(lsk, dict):
+                    # エラーレスポンスは型変換されないので DynamoDB の型表現のままになっている
+                    lsk = lsk.get("S")
+                skeys = new_skeys(len(opes), lsk or get_last_ope_skey(obj))
+            else:
+                # TransactionConflict など。少し待ってから同じ skey で再試行する
+                time.sleep(0.005 * (attempt + 1))
+
+    raise Exception("put ope with watermark failed")
+
+
+def get_last_ope_skey(obj: QueueObject) -> str:
+    response = traced(
+        "dynamodb.get_item", TABLE.get_item,
+        Key={
+            DYNAMODB_CHUNK_KEY_NAME: obj.chunk_key(DYNAMODB_SORT_KEY_META_SUFIX),
+            DYNAMODB_SORT_KEY_NAME: DYNAMODB_LAST_OPE_SORT_KEY
+        },
+        ConsistentRead=True,
+    )
+    return response['Item']["lsk"] if ('Item' in response) else ""
+
+
+def exists_ope(obj: QueueObject, skey: str) -> bool:
+    """skey の ope が書き込まれているか (TTL で消えていないか)"""
+
+    response = traced(
+        "dynamodb.get_item", TABLE.get_item,
+        Key={
+            DYNAMODB_CHUNK_KEY_NAME: obj.chunk_key(DYNAMODB_SORT_KEY_OPE_SUFIX),
+            DYNAMODB_SORT_KEY_NAME: skey
+        },
+        ProjectionExpression=DYNAMODB_SORT_KEY_NAME,
+        ConsistentRead=True,
+    )
+    return 'Item' in response
+
+
+def commit_ope(obj: QueueObject, ckey_suffix: str, skey: str, data: str, method: str = Ope.INSERT) -> str:
+    """OPE_COMMIT_WAIT_MODE に従って ope を書き込み、
+    自分より前の ope がすべてコミットされた状態になってから実際の skey を返す"""
+
+    return commit_opes(obj, ckey_suffix=ckey_suffix, skeys=[skey],
+                       opes=[new_ope(data=data, method=method)])[0]
+
+
+def commit_opes(obj: QueueObject, ckey_suffix: str, skeys: list[str], opes: list[Ope]) -> list[str]:
+    """commit_ope の複数の ope をまとめて書き込む版 (skeys は昇順)"""
+
+    if OPE_COMMIT_WAIT_MODE == OPE_COMMIT_WAIT_MODE_SLEEP:
+        with TRACE.phase("put_ope"):
+            if len(opes) == 1:
+                put_ope(obj, ckey_suffix=ckey_suffix, skey=skeys[0],
+                        data=opes[0].data, method=opes[0].method)
+            else:
+                put_opes(obj, ckey_suffix=ckey_suffix, skeys=skeys, opes=opes)
+        # 自分より前に実行される必要のある他のプロセスの ope がコミットされるのを待つ
+        with TRACE.phase("wait"):
+            time.sleep(OPE_COMMIT_WAIT_SLEEP)
+        return skeys
+
+    with TRACE.phase("put_ope"):
+        return put_opes_with_watermark(obj, ckey_suffix=ckey_suffix, skeys=skeys, opes=opes)
+
+
+def swap_current_skey(obj: QueueObject, skey: str, base_skey: str | None = None) -> tuple[bool, str, str]:
+    """CURRENT_DB を skey に更新し、更新できたかと更新前の cur と bsk を返す
+
+    base_skey を指定した場合は公開するスナップショットの base の skey (bsk) も同時に更新する
+    (full 形式の場合は空文字列)。"""
+    chunk_key = obj.chunk_key(DYNAMODB_SORT_KEY_META_SUFIX)
     sort_key = "CURRENT_DB"
 
     try:
         logger.info({"msg": "check current db skey from dynamo - before",
                      "data": DEBUG_DATA, "ckey": chunk_key, "skey": sort_key, "cur": skey})
-        response = TABLE.update_item(
+        response = traced(
+            "dynamodb.update_item", TABLE.update_item,
             Key={
                 DYNAMODB_CHUNK_KEY_NAME: chunk_key,
                 DYNAMODB_SORT_KEY_NAME: sort_key
             },
-            UpdateExpression='SET cur = :newSkey',
+            UpdateExpression='SET cur = :newSkey' + (', bsk = :baseSkey' if base_skey is not None else ''),
             ExpressionAttributeValues={
-                ':newSkey': skey
+                ':newSkey': skey,
+                **({':baseSkey': base_skey} if base_skey is not None else {}),
             },
             ConditionExpression='attribute_not_exists(cur) OR cur <= :newSkey',
+            ReturnValues="UPDATED_OLD",
         )
         logger.info({"msg": "check current db skey from dynamo - after",
                      "data": DEBUG_DATA, "ckey": chunk_key, "skey": sort_key, "cur": skey})
-        return True
+        attributes = response.get("Attributes") or {}
+        return True, attributes.get("cur") or "", attributes.get("bsk") or ""
     except ClientError as e:
         if e.response["Error"]["Code"] != 'ConditionalCheckFailedException':
             raise
         else:
-            return False
+            return False, "", ""
 
 
-def get_current_skey() -> str:
-    chunk_key = "TEST_META"
+def set_current_skey(obj: QueueObject, skey: str, base_skey: str | None = None) -> bool:
+    return swap_current_skey(obj, skey, base_skey)[0]
+
+
+def get_current_base_skey(obj: QueueObject) -> str:
+    """CURRENT_DB の bsk (公開中のスナップショットの base の skey) を取得する"""
+
+    response = traced(
+        "dynamodb.get_item", TABLE.get_item,
+        Key={
+            DYNAMODB_CHUNK_KEY_NAME: obj.chunk_key(DYNAMODB_SORT_KEY_META_SUFIX),
+            DYNAMODB_SORT_KEY_NAME: "CURRENT_DB"
+        },
+        ProjectionExpression="bsk",
+        ConsistentRead=True,
+    )
+    return (response.get("Item") or {}).get("bsk") or ""
+
+
+def get_current_skey(obj: QueueObject) -> str:
+    chunk_key = obj.chunk_key(DYNAMODB_SORT_KEY_META_SUFIX)
     sort_key = "CURRENT_DB"
 
     logger.info({"msg": "get current db skey from dynamo - before",
                  "data": DEBUG_DATA, "ckey": chunk_key, "skey": sort_key})
-    response = TABLE.get_item(
+    response = traced(
+        "dynamodb.get_item", TABLE.get_item,
         Key={
             DYNAMODB_CHUNK_KEY_NAME: chunk_key,
             DYNAMODB_SORT_KEY_NAME: sort_key
@@ -252,12 +936,58 @@ def get_current_skey() -> str:
     logger.info({"msg": "get current skey",
                  "data": DEBUG_DATA, "ckey": chunk_key, "skey": sort_key, "cur": skey})
 
+    CURRENT_POINTER.set(obj, skey)
     return skey
 
 
-def query(ckey_suffix: str, top_skey: str | None = None, last_skey: str | None = None) -> list[dict]:
+class CurrentPointer:
+    """ウォームコンテナ内で直近に確認したオブジェクトごとの CURRENT_DB の cur
+
+    cur は大きくなる方向にしか更新されないので、保持している値より小さい値では更新しない。"""
+
+    def __init__(self) -> None:
+        # cky: (cur, 確認した時刻)
+        self.entries: dict[str, tuple[str, float]] = {}
 
-    kce = cond.Key(DYNAMODB_CHUNK_KEY_NAME).eq("TEST" + ckey_suffix)
+    def get(self, obj: QueueObject, ttl: float) -> str | None:
+        skey, checked = self.entries.get(obj.cky) or ("", 0.0)
+        if skey and time.monotonic() - checked < ttl:
+            return skey
+        return None
+
+    def set(self, obj: QueueObject, skey: str) -> None:
+        current, _ = self.entries.get(obj.cky) or ("", 0.0)
+        if skey >= current:
+            self.entries[obj.cky] = (skey, time.monotonic())
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+CURRENT_POINTER = CurrentPointer()
+
+
+def resolve_current_skey(obj: QueueObject) -> str:
+    """読み込み用に cur を取得する (POINTER_CACHE_TTL 以内に確認した値があればそれを使用する)"""
+
+    if (skey := CURRENT_POINTER.get(obj, POINTER_CACHE_TTL)):
+        return skey
+    return get_current_skey(obj)
+
+
+def iter_query(obj: QueueObject, ckey_suffix: str, top_skey: str | None = None, last_skey: str | None = None,
+               page_size: int | None = None, prefetch: bool | None = None):
+    """skey の範囲の ope を昇順に返すジェネレーター
+
+    LastEvaluatedKey をたどって範囲内のすべてのページを取得する。
+    prefetch が有効な場合は、呼び出し側が現在のページを処理している間に次のページを取得する
+    (呼び出しごとに先読みのスレッドを使うので、並行に呼び出しても他の呼び出しの先読みを待たない。
+    スレッドは 2 ページ目を先読みするときに作成され、ジェネレーターが終了するか閉じられたときに終了する)。"""
+
+    page_size = QUERY_PAGE_SIZE if page_size is None else page_size
+    prefetch = QUERY_PREFETCH if prefetch is None else prefetch
+
+    kce = cond.Key(DYNAMODB_CHUNK_KEY_NAME).eq(obj.chunk_key(ckey_suffix))
 
     if top_skey and last_skey:
         kce = kce & cond.Key(DYNAMODB_SORT_KEY_NAME).between(
@@ -267,84 +997,294 @@ def query(ckey_suffix: str, top_skey: str | None = None, last_skey: str | None =
     elif last_skey:
         kce = kce & cond.Key(DYNAMODB_SORT_KEY_NAME).lte(last_skey)
 
-    logger.info({"msg": "query to dynamodb - before", "data": DEBUG_DATA,
-                 "ckey_suffix": ckey_suffix, "top_skey": top_skey, "last_skey": last_skey})
-    response = TABLE.query(
-        KeyConditionExpression=kce,
-        ConsistentRead=True,
-        # Limit=5
-    )
-    logger.info({"msg": "query to dynamodb - after", "data": DEBUG_DATA,
-                 "ckey_suffix": ckey_suffix, "top_skey": top_skey})
-
-    items = response["Items"]
-
-    logger.info({"msg": "query items", "data": DEBUG_DATA,
-                 "ckey_suffix": ckey_suffix, "top_skey": top_skey, "skeys": [i[DYNAMODB_SORT_KEY_NAME] for i in items]})
-
-    return items
+    def fetch(start_key: dict | None, page: int) -> dict:
+        kwargs = {
+            "TableName": DYNAMODB_TABLE_NAME,
+            "KeyConditionExpression": kce,
+            "ConsistentRead": True,
+        }
+        if page_size:
+            kwargs["Limit"] = page_size
+        if start_key:
+            kwargs["ExclusiveStartKey"] = start_key
+
+        logger.info({"msg": "query to dynamodb - before", "data": DEBUG_DATA,
+                     "ckey_suffix": ckey_suffix, "top_skey": top_skey, "last_skey": last_skey, "page": page})
+        # Table (resource) はスレッドセーフではないので先読みできるようにクライアントを使用する
+        response = traced("dynamodb.query", DYNAMODB_CLIENT.query, **kwargs)
+        logger.info({"msg": "query to dynamodb - after", "data": DEBUG_DATA,
+                     "ckey_suffix": ckey_suffix, "top_skey": top_skey, "page": page})
+
+        logger.info({"msg": "query items", "data": DEBUG_DATA,
+                     "ckey_suffix": ckey_suffix, "top_skey": top_skey, "page": page,
+                     "skeys": [i[DYNAMODB_SORT_KEY_NAME] for i in response["Items"]]})
+        return response
+
+    page = 0
+    with TRACE.phase("query"):
+        response = fetch(None, page)
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        while True:
+            start_key = response.get("LastEvaluatedKey")
+            future = executor.submit(fetch, start_key, page + 1) if (start_key and executor) else None
+
+            yield from response["Items"]
+
+            if not start_key:
+                break
+            page += 1
+            # 先読みしている場合は取得の完了を待った時間だけが query のフェーズになる
+            with TRACE.phase("query"):
+                response = future.result() if future else fetch(start_key, page)
+    finally:
+        if executor:
+            # 途中で閉じられた場合は先読みの完了を待たない
+            executor.shutdown(wait=False, cancel_futures=True)
 
 
-def save(db_obj: Db, skey: str | None = None):
+def query(obj: QueueObject, ckey_suffix: str, top_skey: str | None = None, last_skey: str | None = None) -> list[dict]:
+    return list(iter_query(obj, ckey_suffix=ckey_suffix, top_skey=top_skey, last_skey=last_skey))
 
-    object_key = (S3_DB_SNAPSHOT_FOLDER + skey + ".json") if skey else (
-        S3_DEFAULT_DB_KEY
-    )
-    data = json.dumps(db_obj).encode("utf-8")
 
+def put_object(object_key: str, data: bytes, tagging: str | None = None) -> None:
     logger.info({"msg": "save to s3 - before",
-                "data": DEBUG_DATA, "object_key": object_key})
-    S3.put_object(
-        Body=data, Bucket=S3_BUKET_NAME, Key=object_key
+                "data": DEBUG_DATA, "object_key": object_key, "bytes": len(data)})
+    traced(
+        "s3.put_object", S3.put_object, nbytes=len(data),
+        Body=data, Bucket=S3_BUKET_NAME, Key=object_key,
+        **({"Tagging": tagging} if tagging else {})
     )
     logger.info({"msg": "save to s3 - after",
-                "data": DEBUG_DATA, "object_key": object_key})
-
-
-def load(skey: str | None = None) -> Db:
+                "data": DEBUG_DATA, "object_key": object_key, "bytes": len(data)})
 
-    object_key = S3_DB_SNAPSHOT_FOLDER + skey + ".json" if skey else (
-        S3_DEFAULT_DB_KEY
-    )
 
+def get_object(object_key: str) -> bytes | None:
     try:
         logger.info({"msg": "load from s3 - before",
                     "data": DEBUG_DATA, "object_key": object_key})
-        response = S3.get_object(Bucket=S3_BUKET_NAME, Key=object_key)
+        with TRACE.span("s3.get_object") as span:
+            response = S3.get_object(Bucket=S3_BUKET_NAME, Key=object_key)
+            data = response["Body"].read()
+            span.record(response, nbytes=len(data))
         logger.info({"msg": "load from s3 - after",
                     "data": DEBUG_DATA, "object_key": object_key})
 
-        data_text = response["Body"].read().decode("utf-8")
-        return Db(json.loads(data_text))
+        return data
     except ClientError as e:
         if e.response["Error"]["Code"] == "NoSuchKey":
-            return Db()
-        raise
-    except:
+            return None
         raise
 
 
-def cp(src_skey: str | None = None, dest_skey: str | None = None):
+def needs_compaction(db: Db, delta_bytes: int) -> bool:
+    if not db.base_skey:
+        return True
+    limit = max(SNAPSHOT_DELTA_MIN_BYTES,
+                SNAPSHOT_DELTA_FACTOR * math.sqrt(db.base_bytes))
+    return delta_bytes > limit
+
+
+def save(obj: QueueObject, db_obj: Db, skey: str | None = None):
+
+    object_key = obj.snapshot_key(skey) if skey else obj.db_key
+    # pointer の場合は公開後のタグの更新に失敗しても削除されないように pub=1 で保存し、公開できなかった場合に pub=0 に戻す
+    # copy の場合は公開しても pub=1 にしないので、期限切れで削除される対象にしておく
+    published = PUBLISH_MODE == PUBLISH_MODE_POINTER
+    tagging = f"{S3_SNAPSHOT_PUBLISHED_TAG}={int(published)}" if skey else None
+
+    if SNAPSHOT_FORMAT != SNAPSHOT_FORMAT_DELTA:
+        put_object(object_key, encode_snapshot(db_obj), tagging)
+        # base/ には保存していないので delta 形式に切り替えた場合は compaction させる
+        db_obj.base_skey = None
+        db_obj.delta = []
+        return
+
+    delta = {
+        "base": db_obj.base_skey,
+        "bsz": db_obj.base_bytes,
+        "skey": db_obj.skey,
+        "opes": db_obj.delta,
+    }
+    data = encode_snapshot(delta)
+
+    if needs_compaction(db_obj, len(data)):
+        # compaction: Db 全体を新しい base として保存し、差分を空にする
+        base = encode_snapshot(db_obj)
+        # base は公開方式に関係なく pub=1 で保存し、公開できなかった場合と参照されなくなった場合に pub=0 にする
+        put_object(obj.base_key(db_obj.skey), base, f"{S3_SNAPSHOT_PUBLISHED_TAG}=1" if skey else None)
+
+        db_obj.base_skey = db_obj.skey
+        db_obj.base_bytes = len(base)
+        db_obj.delta = []
+
+        delta = {
+            "base": db_obj.base_skey,
+            "bsz": db_obj.base_bytes,
+            "skey": db_obj.skey,
+            "opes": [],
+        }
+        data = encode_snapshot(delta)
 
-    src_object_key = S3_DB_SNAPSHOT_FOLDER + src_skey + ".json" if src_skey else (
-        S3_DEFAULT_DB_KEY
-    )
+    put_object(object_key, data, tagging)
 
-    dest_object_key = S3_DB_SNAPSHOT_FOLDER + dest_skey + ".json" if dest_skey else (
-        S3_DEFAULT_DB_KEY
-    )
-    src = {
-        "Bucket": S3_BUKET_NAME,
-        "Key": src_object_key
-    }
+
+class SnapshotNotFound(Exception):
+    pass
+
+
+def load_base(obj: QueueObject, skey: str) -> Db:
+    # 同じ skey の Db は同じ内容なのでキャッシュにあればそれを使用する
+    if (db := SNAPSHOT_CACHE.get(obj, skey)):
+        return db
+
+    data = get_object(obj.base_key(skey))
+    if data is None:
+        # 削除されていた場合は、キャッシュの古い Db に skey までの ope を適用して作り直し、base を保存し直す
+        db = replay_cached(obj, skey)
+        if db is None:
+            raise SnapshotNotFound(f"base snapshot not found : {obj.cky} {skey}")
+        data = encode_snapshot(db)
+        put_object(obj.base_key(skey), data, f"{S3_SNAPSHOT_PUBLISHED_TAG}=1")
+        logger.warning({"msg": "base snapshot restored", "data": DEBUG_DATA, "cky": obj.cky, "skey": skey})
+        db.delta = []
+    else:
+        db = Db(decode_snapshot(data))
+    db.base_skey = skey
+    db.base_bytes = len(data)
+    SNAPSHOT_CACHE.put(obj, db)
+    return db
+
+
+def decode(obj: QueueObject, data: bytes) -> Db:
+    """full / delta のどちらの形式のスナップショットも Db に復元する"""
+
+    snapshot = decode_snapshot(data)
+
+    if "base" not in snapshot:
+        db = Db(snapshot)
+        # full 形式は base として扱い、delta 形式で保存するときに compaction させる
+        db.base_skey = None
+        return db
+
+    db = load_base(obj, snapshot["base"])
+    db.base_skey = snapshot["base"]
+    db.base_bytes = snapshot["bsz"]
+    db.delta = []
+    for skey, ope in snapshot["opes"]:
+        apply_ope(db=db, skey=skey, ope=Ope(ope))
+    return db
+
+
+def load(obj: QueueObject, skey: str | None = None) -> Db:
+
+    object_key = obj.snapshot_key(skey) if skey else obj.db_key
+
+    data = get_object(object_key)
+    if data is None:
+        return Db()
+    return decode(obj, data)
+
+
+def load_published(obj: QueueObject, cur: str) -> Db:
+    """公開中の cur のスナップショットを読み込む
+
+    snapshot/ の cur を直接読み、db.json は読まない (copy の場合も db.json は既存の利用者向けの従来の形式で、
+    delta 形式の base の情報を持たないため)。
+    ただし snapshot/ か参照している base が削除されていて復元できない場合に限り、cur と同じ時点の db.json を使用する
+    (db.json は full 形式として読み込まれるので、次の保存で compaction されて新しい base が公開される)。"""
+
+    if not cur:
+        return load(obj)
+
+    data = get_object(obj.snapshot_key(cur))
+    if data is not None:
+        try:
+            return decode(obj, data)
+        except SnapshotNotFound as e:
+            logger.warning({"msg": "load published - base not found", "data": DEBUG_DATA,
+                            "cur": cur, "exception": f"{e}"})
+
+    db = load(obj)
+    if db.skey != cur:
+        raise Exception(f"published snapshot not found : {cur}")
+    return db
+
+
+# 公開を終えたスナップショットのタグの更新に使用する
+# (ベンチマークでは複数のリクエストを 1 プロセスのスレッドで模擬するので余裕を持たせる)
+TAG_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+
+def tag_snapshot(obj: QueueObject, skey: str, published: bool) -> None:
+    """スナップショットのタグを更新する (pub=0 のものはライフサイクルルールで削除される)"""
+
+    tag_object(obj.snapshot_key(skey), published)
+
+
+def tag_bases(obj: QueueObject, base_skey: str, prev_base_skey: str) -> None:
+    """公開したスナップショットの base を pub=1 に、前に公開したスナップショットの base を pub=0 にする
+
+    base が同じ場合は何もしない。前の base はライフサイクルルールで削除されるので、
+    同じ base の古いスナップショットが並行して公開された場合 (CURRENT_DB の bsk が前の base に戻っている場合) は
+    pub=0 にしない。pub=0 にしている間に戻された場合は、その公開の pub=1 を上書きした可能性があるので pub=1 に戻す。"""
+
+    if base_skey == prev_base_skey:
+        return
+    if base_skey:
+        tag_object(obj.base_key(base_skey), published=True)
+    if prev_base_skey:
+        demote_base(obj, prev_base_skey)
+
+
+def demote_base(obj: QueueObject, base_skey: str) -> None:
+    """公開中のスナップショットが参照していない base を pub=0 にする"""
+
+    if get_current_base_skey(obj) == base_skey:
+        return
+    tag_object(obj.base_key(base_skey), published=False)
+    if get_current_base_skey(obj) == base_skey:
+        logger.warning({"msg": "tag base - republished", "data": DEBUG_DATA,
+                        "cky": obj.cky, "base": base_skey})
+        tag_object(obj.base_key(base_skey), published=True)
+
+
+def untag_new_base(obj: QueueObject, skey: str, base_skey: str) -> None:
+    """公開できなかったスナップショットの保存で compaction した base (skey と同じ skey の base) を pub=0 に戻す"""
+
+    if base_skey and base_skey == skey:
+        run_best_effort("untag base", demote_base, obj, base_skey)
+
+
+def tag_object(object_key: str, published: bool) -> None:
+    tag = {"Key": S3_SNAPSHOT_PUBLISHED_TAG, "Value": "1" if published else "0"}
     try:
-        logger.info({"msg": "cp to s3 - before", "data": DEBUG_DATA,
-                     "src": src_object_key, "dest": dest_object_key})
-        S3.copy(src, S3_BUKET_NAME, dest_object_key)
-        logger.info({"msg": "cp to s3 - after", "data": DEBUG_DATA,
-                     "src": src_object_key, "dest": dest_object_key})
-    except Exception as e:
-        raise
+        logger.info({"msg": "tag s3 - before", "data": DEBUG_DATA,
+                     "object_key": object_key, "tag": tag})
+        traced("s3.put_object_tagging", S3.put_object_tagging,
+               Bucket=S3_BUKET_NAME, Key=object_key, Tagging={"TagSet": [tag]})
+        logger.info({"msg": "tag s3 - after", "data": DEBUG_DATA,
+                     "object_key": object_key, "tag": tag})
+    except ClientError as e:
+        # 既に期限切れで削除されている場合は何もしない
+        if e.response["Error"]["Code"] != "NoSuchKey":
+            raise
+        logger.warning({"msg": "tag s3 - not found", "data": DEBUG_DATA,
+                        "object_key": object_key, "tag": tag})
+
+
+def write_db_json(obj: QueueObject, skey: str) -> None:
+    """skey のスナップショットを Db に復元して、db.json に従来の形式 ({"skey", "data"} の JSON) で書き込む
+
+    スナップショットは delta 形式や binary 形式の場合があるので、snapshot/ をそのままコピーしない。"""
+
+    db = SNAPSHOT_CACHE.get(obj, skey)
+    if db is None:
+        data = get_object(obj.snapshot_key(skey))
+        if data is None:
+            raise Exception(f"snapshot not found : {obj.cky} {skey}")
+        db = decode(obj, data)
+    put_object(obj.db_key, SNAPSHOT_CODECS[JsonCodec.name].encode({"skey": db.skey, "data": db.data}))
 
 # ------------------------------------------------------------------
 
@@ -363,6 +1303,15 @@ def do(db: Db, ope: Ope) -> Result:
     return res
 
 
+def apply_ope(db: Db, skey: str, ope: Ope) -> Result:
+    """ope を適用して db の skey を進め、delta 形式で保存するための差分に記録する"""
+
+    db.skey = skey
+    res = do(db=db, ope=ope)
+    db.delta.append([skey, ope])
+    return res
+
+
 def new_skey(top_skey: str | None = None) -> str:
     if not top_skey:
         return str(ulid.new())
@@ -371,46 +1320,209 @@ def new_skey(top_skey: str | None = None) -> str:
     return skey
 
 
-def post_data(data: str, method: str):
+def new_skeys(count: int, top_skey: str | None = None) -> list[str]:
+    """top_skey より大きい連続した count 個の skey を採番する (先頭の ULID の値に 1 ずつ加える)"""
 
-    db = load()
+    first = ulid.from_str(new_skey(top_skey)).int
+    return [str(ulid.from_int(first + i)) for i in range(count)]
 
-    current_skey = new_skey(db.skey)
 
-    skey = current_skey
-    put_ope(ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
-            skey=skey, data=data, method=method)
+class SnapshotCache:
+    """ウォームコンテナ内で使い回す Db のスナップショット ((cky, skey) をキーにした LRU)
+
+    同じオブジェクトの同じ skey のスナップショットは常に同じ内容になるので、
+    CURRENT_DB の cur と一致するものがあればそのまま使用できる。
+    上限はすべてのオブジェクトで共有し、エントリ数と data の合計要素数が上限を超えたら古く使われたものから破棄する。"""
+
+    def __init__(self, max_entries: int, max_items: int):
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self.entries: OrderedDict[tuple[str, str], Db] = OrderedDict()
+        self.items = 0
+
+        self.hits = 0
+        self.replays = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _copy(db: Db) -> Db:
+        return db.clone()
+
+    def get(self, obj: QueueObject, skey: str) -> Db | None:
+        key = (obj.cky, skey)
+        db = self.entries.get(key)
+        if db is None:
+            return None
+        self.entries.move_to_end(key)
+        return self._copy(db)
+
+    def latest(self, obj: QueueObject, skey: str) -> Db | None:
+        """オブジェクトの skey より前の最も新しいスナップショットを取得する"""
+        base = max((k for c, k in list(self.entries) if c == obj.cky and k < skey), default=None)
+        return self.get(obj, base) if base else None
+
+    def put(self, obj: QueueObject, db: Db) -> None:
+        if not db.skey or self.max_entries <= 0 or len(db.data) > self.max_items:
+            return
+        key = (obj.cky, db.skey)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+
+        self.entries[key] = self._copy(db)
+        self.items += len(db.data)
+
+        while len(self.entries) > self.max_entries or self.items > self.max_items:
+            _, old = self.entries.popitem(last=False)
+            self.items -= len(old.data)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.items = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "replays": self.replays,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+        }
+
+
+SNAPSHOT_CACHE = SnapshotCache(max_entries=SNAPSHOT_CACHE_MAX_ENTRIES,
+                               max_items=SNAPSHOT_CACHE_MAX_ITEMS)
+
+
+def is_replayable(skey: str) -> bool:
+    """skey 以降の ope が TTL で消えていないと判断できるか"""
+    try:
+        created = ulid.from_str(skey).timestamp().timestamp
+    except ValueError:
+        return False
+    return time.time() - created < OPE_TTL / 2
+
+
+def replay_cached(obj: QueueObject, skey: str) -> Db | None:
+    """キャッシュの skey より前の Db に skey までの ope を DynamoDB から取得して適用した Db を返す
+
+    キャッシュにないか、ope が TTL で消えている可能性がある場合は None を返す。"""
+
+    if not (db := SNAPSHOT_CACHE.latest(obj, skey)) or not is_replayable(db.skey):
+        return None
+    for item in iter_query(obj, ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
+                           top_skey=db.skey, last_skey=skey):
+        ope_skey = item[DYNAMODB_SORT_KEY_NAME]
+        if ope_skey == db.skey:
+            continue
+        apply_ope(db=db, skey=ope_skey, ope=Ope(item[DYNAMODB_OPE_ITEM_NAME]))
+
+    # skey の ope が取得できない場合は途中の ope が欠けている可能性があるので使用しない
+    # (db はキャッシュの複製なので破棄してよい)
+    return db if db.skey == skey else None
+
+
+def load_latest(obj: QueueObject, cur: str | None = None) -> Db:
+    """CURRENT_DB の cur 時点の Db を取得する
+
+    キャッシュに cur のスナップショットがあればそれを使用し、
+    cur より前のスナップショットがあれば cur までの ope だけを DynamoDB から取得して適用する。
+    どちらもなければ S3 から取得する。
+    cur を取得済みの場合は引数で渡す。"""
+
+    if cur is None:
+        cur = get_current_skey(obj)
+
+    if cur and (db := SNAPSHOT_CACHE.get(obj, cur)):
+        SNAPSHOT_CACHE.hits += 1
+        logger.info({"msg": "load snapshot - hit", "data": DEBUG_DATA,
+                     "cur": cur, "cache": SNAPSHOT_CACHE.stats()})
+        return db
+
+    if cur and (db := replay_cached(obj, cur)):
+        SNAPSHOT_CACHE.replays += 1
+        SNAPSHOT_CACHE.put(obj, db)
+        logger.info({"msg": "load snapshot - replay", "data": DEBUG_DATA,
+                     "cur": cur, "cache": SNAPSHOT_CACHE.stats()})
+        return db
+
+    SNAPSHOT_CACHE.misses += 1
+    db = load_published(obj, cur)
+    SNAPSHOT_CACHE.put(obj, db)
+    logger.info({"msg": "load snapshot - miss", "data": DEBUG_DATA,
+                 "cur": cur, "skey": db.skey, "cache": SNAPSHOT_CACHE.stats()})
+    return db
+
+
+def post_data(obj: QueueObject, data: str, method: str):
+    return next(iter(post_opes(obj, [new_ope(data=data, method=method)]).values()))
+
+
+def post_opes(obj: QueueObject, opes: list[Ope]) -> dict[str, Result]:
+    """opes を連続した skey でまとめて書き込み、1 回の適用でスナップショットを保存・公開する
 
-    # 自分より前に実行される必要のある他のプロセスの ope がコミットされるのを待つ
-    time.sleep(0.05)
+    ope ごとの結果を skey の昇順に返す。"""
 
-    items = query(ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
-                  top_skey=db.skey, last_skey=skey)
+    if OPE_APPLY_MODE == OPE_APPLY_MODE_GROUP:
+        return post_opes_group(obj, opes)
+    if OPE_APPLY_MODE == OPE_APPLY_MODE_STREAM:
+        return post_opes_stream(obj, opes)
+
+    if OPE_COMMIT_WAIT_MODE == OPE_COMMIT_WAIT_MODE_SLEEP:
+        # スナップショットより後の skey で書き込む必要があるので先に取得する
+        with TRACE.phase("load"):
+            db = load_latest(obj)
+        current_skeys = commit_opes(obj, ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
+                                    skeys=new_skeys(len(opes), db.skey), opes=opes)
+    else:
+        # watermark 方式ではコミット済みの skey より大きい skey が採番されるので先に書き込める
+        current_skeys = commit_opes(obj, ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
+                                    skeys=new_skeys(len(opes)), opes=opes)
+
+        with TRACE.phase("load"):
+            cur = get_current_skey(obj)
+            if cur and cur >= current_skeys[-1]:
+                # 他のプロセスで自分の ope まで適用済みなので保存された結果を返す
+                return get_applied_results(obj, current_skeys)
+
+            db = load_latest(obj, cur=cur)
+
+    current_skey = current_skeys[-1]
+    if db.skey and db.skey >= current_skey:
+        with TRACE.phase("load"):
+            return get_applied_results(obj, current_skeys)
+
+    top_skey = db.skey
+    skey = current_skey
+
+    items = iter_query(obj, ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
+                       top_skey=db.skey, last_skey=skey)
 
     # ここで取得できる操作に抜けが発生するのは自分が登録した操作以降のデータも取得しようとすると
     # 自分の書き込み以降のデータ取得についても抜けがないかリスクを負うことになるので
     # 自分の操作までで取得を止める
     # 自分の操作以降も取得できると効率化にはつながるので何か対策があれば実施
 
-    items = sorted(items, key=lambda x: x[DYNAMODB_SORT_KEY_NAME])
-
-    current_res = Result()
-    for item in items:
-        skey = item[DYNAMODB_SORT_KEY_NAME]
-
-        if skey == db.skey:
-            continue
+    results: dict[str, Result] = {}
+    with TRACE.phase("apply"):
+        for item in items:
+            skey = item[DYNAMODB_SORT_KEY_NAME]
 
-        ope = Ope(item[DYNAMODB_OPE_ITEM_NAME])
+            if skey == db.skey:
+                continue
 
-        db.skey = skey
+            ope = Ope(item[DYNAMODB_OPE_ITEM_NAME])
 
-        res = do(db=db, ope=ope)
+            results[skey] = apply_ope(db=db, skey=skey, ope=ope)
 
-        if skey == current_skey:
-            current_res = res
+    with TRACE.phase("save"):
+        # 自分以外の ope の結果も保存して、後続のリクエストが再計算しなくて済むようにする
+        put_results(obj, results)
 
-    save(db_obj=db, skey=skey)
+        save(obj, db_obj=db, skey=skey)
+        SNAPSHOT_CACHE.put(obj, db)
 
     # put_ope(ckey_suffix=DYNAMODB_SORT_KEY_SAV_SUFIX, skey=skey, data=skey)
 
@@ -431,18 +1543,508 @@ def post_data(data: str, method: str):
     #     time.sleep(sleep_time)
     #     sleep_time = 0.1
 
-    while set_current_skey(skey=skey):
-        cp(src_skey=skey)
-        current_skey = get_current_skey()
+    with TRACE.phase("publish"):
+        publish(obj, skey=skey, base_skey=db.base_skey)
+
+    # 自分の ope のうち読み込んだスナップショットに含まれていたものは、適用したプロセスが保存した結果を返す
+    applied = [s for s in current_skeys if top_skey and s <= top_skey]
+    current_res = get_applied_results(obj, applied) if applied else {}
+    return {s: current_res.get(s) or results.get(s) or Result() for s in current_skeys}
+
+
+def publish(obj: QueueObject, skey: str, base_skey: str | None = None) -> None:
+    """skey のスナップショットを公開する
+
+    pointer: CURRENT_DB を skey に更新するだけで公開が完了する。
+    更に新しい skey に更新されていた場合は何もしない (自分のスナップショットは期限切れで削除される)。
+    copy: CURRENT_DB を skey に更新して db.json に反映する。
+    他のプロセスにより更に新しい skey に更新されていた場合はそのスナップショットを反映する。
+    どちらの場合も base_skey (スナップショットの base) を CURRENT_DB に記録し、base が変わった場合は前の base を pub=0 にする。"""
+
+    base_skey = base_skey or ""
+    if PUBLISH_MODE == PUBLISH_MODE_COPY:
+        sync_db_json(obj, skey, base_skey)
+        return
+
+    # スナップショットは pub=1 で保存してあるので、公開できなかった場合に pub=0 に戻す
+    # (ope は保存済みなので、タグの更新や非同期呼び出しに失敗してもリクエストは失敗させない。再送で ope が重複するため)
+    swapped, prev, prev_base_skey = swap_current_skey(obj, skey, base_skey)
+    if not swapped:
+        run_best_effort("untag snapshot", tag_snapshot, obj, skey, published=False)
+        untag_new_base(obj, skey, base_skey)
+        return
+
+    CURRENT_POINTER.set(obj, skey)
+    # 前のスナップショットのタグの更新は base のタグの更新と並行して行う
+    future = TAG_EXECUTOR.submit(run_best_effort, "tag prev snapshot", tag_snapshot, obj, prev, False) if (
+        prev and prev != skey) else None
+    run_best_effort("tag bases", tag_bases, obj, base_skey, prev_base_skey)
+    if future:
+        future.result()
+
+    if DB_JSON_SYNC == DB_JSON_SYNC_ASYNC:
+        run_best_effort("request db.json sync", request_db_json_sync, obj, skey)
+
+
+def run_best_effort(name: str, func, *args, **kwargs) -> bool:
+    """タグの更新や非同期呼び出しを再試行し、失敗した場合はログに出力して False を返す (例外にしない)"""
+
+    for attempt in range(1, BEST_EFFORT_MAX_ATTEMPTS + 1):
+        try:
+            func(*args, **kwargs)
+            return True
+        except Exception as e:
+            logger.warning({"msg": "best effort - failed", "data": DEBUG_DATA, "name": name,
+                            "attempt": attempt, "exception": f"{e}"})
+            if attempt < BEST_EFFORT_MAX_ATTEMPTS:
+                time.sleep(BEST_EFFORT_RETRY_DELAY * 2 ** (attempt - 1))
+    return False
+
+
+def sync_db_json(obj: QueueObject, skey: str, base_skey: str = "") -> None:
+    """CURRENT_DB を skey に更新して db.json に反映する
+    他のプロセスにより更に新しい skey に更新されていた場合はそのスナップショットを反映する"""
+
+    swapped, _, prev_base_skey = swap_current_skey(obj, skey, base_skey)
+    if swapped:
+        run_best_effort("tag bases", tag_bases, obj, base_skey, prev_base_skey)
+    else:
+        untag_new_base(obj, skey, base_skey)
+    while swapped:
+        write_db_json(obj, skey)
+        current_skey = get_current_skey(obj)
         if skey == current_skey:
             break
         skey = current_skey
+        swapped = set_current_skey(obj, skey=skey)
 
-    return current_res
 
+def handle_db_json_sync(obj: QueueObject, skey: str) -> None:
+    """db.json を CURRENT_DB の cur のスナップショットに合わせる
 
-def get_db() -> dict:
-    return load()
+    skey が既に cur でない場合は、新しい cur の公開時の呼び出しに任せて何もしない。
+    書き込み中に cur が更新された場合は新しい cur のスナップショットで書き込み直す
+    (後から終わった古い書き込みで db.json が巻き戻らないようにするため)。"""
+
+    if get_current_skey(obj) != skey:
+        return
+    while skey:
+        write_db_json(obj, skey)
+        current_skey = get_current_skey(obj)
+        if skey == current_skey:
+            break
+        skey = current_skey
+
+
+def request_db_json_sync(obj: QueueObject, skey: str) -> None:
+    """db.json の更新を自身の非同期呼び出しに依頼する"""
+
+    logger.info({"msg": "request db.json sync", "data": DEBUG_DATA, "cky": obj.cky, "skey": skey})
+    traced(
+        "lambda.invoke", LAMBDA.invoke,
+        FunctionName=os.environ["AWS_LAMBDA_FUNCTION_NAME"],
+        InvocationType="Event",
+        Payload=json.dumps({"action": DB_JSON_SYNC_ACTION, "object": obj.object_path,
+                            "skey": skey}).encode(),
+    )
+
+
+def acquire_apply_lease(obj: QueueObject, owner: str) -> bool:
+    """ope を適用するリーダーのリースを取得する"""
+
+    now = int(time.time() * 1000)
+    try:
+        logger.info({"msg": "acquire apply lease - before",
+                     "data": DEBUG_DATA, "owner": owner})
+        traced(
+            "dynamodb.update_item", TABLE.update_item,
+            Key={
+                DYNAMODB_CHUNK_KEY_NAME: obj.chunk_key(DYNAMODB_SORT_KEY_META_SUFIX),
+                DYNAMODB_SORT_KEY_NAME: DYNAMODB_APPLY_LEASE_SORT_KEY
+            },
+            UpdateExpression='SET own = :owner, lxp = :expired',
+            ExpressionAttributeValues={
+                ':owner': owner,
+                ':expired': now + int(GROUP_COMMIT_LEASE * 1000),
+                ':now': now,
+            },
+            ConditionExpression='attribute_not_exists(own) OR lxp < :now',
+        )
+        logger.info({"msg": "acquire apply lease - after",
+                     "data": DEBUG_DATA, "owner": owner})
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+
+def release_apply_lease(obj: QueueObject, owner: str) -> None:
+    try:
+        traced(
+            "dynamodb.update_item", TABLE.update_item,
+            Key={
+                DYNAMODB_CHUNK_KEY_NAME: obj.chunk_key(DYNAMODB_SORT_KEY_META_SUFIX),
+                DYNAMODB_SORT_KEY_NAME: DYNAMODB_APPLY_LEASE_SORT_KEY
+            },
+            UpdateExpression='REMOVE own, lxp',
+            ExpressionAttributeValues={':owner': owner},
+            ConditionExpression='own = :owner',
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != 'ConditionalCheckFailedException':
+            raise
+        # リースの期限が切れて他のリーダーに引き継がれている
+        logger.warning({"msg": "apply lease lost",
+                        "data": DEBUG_DATA, "owner": owner})
+
+
+def result_sort_key(skey: str) -> str:
+    return DYNAMODB_RESULT_SORT_KEY_PREFIX + skey
+
+
+def put_results(obj: QueueObject, results: dict[str, Result]) -> None:
+    """ope ごとの結果を BatchWriteItem でまとめて保存する
+
+    README の「操作の結果」の形式 (sky: OP:c0:${sky}, res: {sky: {ste, typ, dat}}) で
+    ope 1 件につき 1 アイテムを書き込み、GetItem 1 回で結果を取得できるようにする。"""
+
+    if not results:
+        return
+
+    ckey = obj.chunk_key(DYNAMODB_SORT_KEY_RES_SUFIX)
+    ttl = int(time.time()) + RESULT_TTL
+
+    logger.info({"msg": "put results to dynamodb - before",
+                 "data": DEBUG_DATA, "ckey": ckey, "count": len(results)})
+    with TRACE.span("dynamodb.batch_write_item"), TABLE.batch_writer() as batch:
+        for skey, res in results.items():
+            batch.put_item(
+                Item={
+                    DYNAMODB_CHUNK_KEY_NAME: ckey,
+                    DYNAMODB_SORT_KEY_NAME: result_sort_key(skey),
+                    DYNAMODB_TTL_ITEM_NAME: ttl,
+                    "ver": 1,
+                    "res": {
+                        skey: {
+                            "ste": 0 if res.status == "ok" else 1,
+                            "typ": "json",
+                            "dat": json.dumps(res),
+                        }
+                    },
+                }
+            )
+    logger.info({"msg": "put results to dynamodb - after",
+                 "data": DEBUG_DATA, "ckey": ckey, "count": len(results)})
+
+
+def get_result(obj: QueueObject, skey: str) -> Result | None:
+    """他のプロセスで適用済みの ope の結果を取得する"""
+
+    ckey = obj.chunk_key(DYNAMODB_SORT_KEY_RES_SUFIX)
+
+    logger.info({"msg": "get result from dynamodb - before",
+                 "data": DEBUG_DATA, "ckey": ckey, "skey": skey})
+    response = traced(
+        "dynamodb.get_item", TABLE.get_item,
+        Key={
+            DYNAMODB_CHUNK_KEY_NAME: ckey,
+            DYNAMODB_SORT_KEY_NAME: result_sort_key(skey)
+        },
+        ConsistentRead=True,
+    )
+    logger.info({"msg": "get result from dynamodb - after",
+                 "data": DEBUG_DATA, "ckey": ckey, "skey": skey, "found": 'Item' in response})
+
+    if 'Item' not in response:
+        return None
+    res = response["Item"]["res"][skey]
+    return Result(json.loads(res["dat"]))
+
+
+def get_results(obj: QueueObject, skeys: list[str]) -> dict[str, Result]:
+    """保存されている ope の結果を BatchGetItem でまとめて取得する (保存されていないものは含まない)"""
+
+    ckey = obj.chunk_key(DYNAMODB_SORT_KEY_RES_SUFIX)
+    results: dict[str, Result] = {}
+
+    logger.info({"msg": "get results from dynamodb - before",
+                 "data": DEBUG_DATA, "ckey": ckey, "count": len(skeys)})
+    for start in range(0, len(skeys), DYNAMODB_BATCH_GET_MAX_KEYS):
+        keys = [{DYNAMODB_CHUNK_KEY_NAME: ckey, DYNAMODB_SORT_KEY_NAME: result_sort_key(skey)}
+                for skey in skeys[start:start + DYNAMODB_BATCH_GET_MAX_KEYS]]
+        request = {DYNAMODB_TABLE_NAME: {"Keys": keys, "ConsistentRead": True}}
+        while request:
+            response = traced("dynamodb.batch_get_item", DYNAMODB_CLIENT.batch_get_item,
+                              RequestItems=request)
+            for item in response["Responses"].get(DYNAMODB_TABLE_NAME) or []:
+                for skey, res in item["res"].items():
+                    results[skey] = Result(json.loads(res["dat"]))
+            request = response.get("UnprocessedKeys") or None
+    logger.info({"msg": "get results from dynamodb - after",
+                 "data": DEBUG_DATA, "ckey": ckey, "count": len(skeys), "found": len(results)})
+
+    return results
+
+
+def get_saved_results(obj: QueueObject, skeys: list[str]) -> dict[str, Result]:
+    """保存されている ope の結果を取得する (1 件の場合は GetItem、複数の場合は BatchGetItem)"""
+
+    if len(skeys) == 1:
+        res = get_result(obj, skeys[0])
+        return {skeys[0]: res} if res else {}
+    return get_results(obj, skeys)
+
+
+def get_applied_result(obj: QueueObject, skey: str) -> Result:
+    """自分の ope が他のプロセスで適用済みのときにその結果を返す"""
+
+    res = get_result(obj, skey)
+    if res is None:
+        # 結果は cur の更新より前に保存しているので、ここに来るのは TTL で消えた場合のみ
+        raise Exception(f"result not found : {skey}")
+    return res
+
+
+def get_applied_results(obj: QueueObject, skeys: list[str]) -> dict[str, Result]:
+    """get_applied_result の複数の ope をまとめて取得する版 (skeys の順に返す)"""
+
+    if len(skeys) == 1:
+        return {skeys[0]: get_applied_result(obj, skeys[0])}
+
+    results = get_results(obj, skeys)
+    missing = [s for s in skeys if s not in results]
+    if missing:
+        raise Exception(f"result not found : {missing[0]}")
+    return {s: results[s] for s in skeys}
+
+
+def apply_pending(obj: QueueObject) -> dict[str, Result]:
+    """コミット済みの ope (LAST_OPE の lsk まで) をまとめて適用し、
+    各 ope の結果を保存してからスナップショットを保存・公開する"""
+
+    with TRACE.phase("load"):
+        db = load_latest(obj)
+
+        # watermark 方式では lsk までの ope はすべてコミット済み
+        last_skey = get_last_ope_skey(obj)
+        if not last_skey or (db.skey and last_skey <= db.skey):
+            return {}
+
+    results: dict[str, Result] = {}
+    with TRACE.phase("apply"):
+        for item in iter_query(obj, ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
+                               top_skey=db.skey, last_skey=last_skey):
+            skey = item[DYNAMODB_SORT_KEY_NAME]
+            if skey == db.skey:
+                continue
+            results[skey] = apply_ope(db=db, skey=skey,
+                                      ope=Ope(item[DYNAMODB_OPE_ITEM_NAME]))
+
+    if not results:
+        return results
+
+    with TRACE.phase("save"):
+        # フォロワーは cur が更新される前に結果を参照する可能性があるので先に結果を保存する
+        put_results(obj, results)
+
+        save(obj, db_obj=db, skey=db.skey)
+        SNAPSHOT_CACHE.put(obj, db)
+
+    with TRACE.phase("publish"):
+        publish(obj, skey=db.skey, base_skey=db.base_skey)
+
+    logger.info({"msg": "group commit", "data": DEBUG_DATA,
+                 "cky": obj.cky, "skey": db.skey, "count": len(results)})
+
+    return results
+
+
+def is_published(obj: QueueObject, skey: str) -> bool:
+    """skey までの ope を含むスナップショットが公開済みかを返す
+
+    cur は大きくなる方向にしか更新されないので、CURRENT_POINTER に保持している値が skey 以上であれば確認しない
+    (リーダーは自分で公開した cur を保持しているので、CURRENT_DB を読み直さずに済む)。"""
+
+    cached = CURRENT_POINTER.get(obj, ttl=float("inf"))
+    if cached and cached >= skey:
+        return True
+    return get_current_skey(obj) >= skey
+
+
+def post_opes_group(obj: QueueObject, opes: list[Ope]) -> dict[str, Result]:
+    """group commit 方式で ope を適用する
+
+    リースを取得できたリクエストがリーダーとしてコミット済みの ope をまとめて適用する。
+    取得できなかったリクエストは自分の ope までのスナップショットが公開されるのを待ってから結果を返し
+    (結果は公開より前に保存されるので、結果だけを待つと応答後の GET に自分の ope が含まれない場合がある)、
+    その間にリースが解放されれば自分がリーダーになる。"""
+
+    # リーダーは lsk までの ope がコミット済みであることを前提にするので常に watermark 方式で書き込む
+    with TRACE.phase("put_ope"):
+        current_skeys = put_opes_with_watermark(obj, ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
+                                                skeys=new_skeys(len(opes)), opes=opes)
+    # リースの所有者は最後の skey で識別する
+    owner = current_skeys[-1]
+    own: dict[str, Result] = {}
+
+    # リーダーとして適用している時間以外 (リースの取得と結果の確認を含む) は wait のフェーズとする
+    deadline = time.time() + GROUP_COMMIT_TIMEOUT
+    interval = GROUP_COMMIT_POLL_INTERVAL
+    with TRACE.phase("wait"):
+        while True:
+            if acquire_apply_lease(obj, owner=owner):
+                try:
+                    results = apply_pending(obj)
+                finally:
+                    release_apply_lease(obj, owner=owner)
+                own.update((s, results[s]) for s in current_skeys if s in results)
+
+            if is_published(obj, owner):
+                pending = [s for s in current_skeys if s not in own]
+                if pending:
+                    own.update(get_saved_results(obj, pending))
+                if len(own) == len(current_skeys):
+                    return {s: own[s] for s in current_skeys}
+
+            if time.time() > deadline:
+                raise Exception("group commit timeout")
+
+            time.sleep(interval)
+            interval = min(interval * 2, GROUP_COMMIT_POLL_INTERVAL_MAX)
+
+
+def post_opes_stream(obj: QueueObject, opes: list[Ope]) -> dict[str, Result]:
+    """stream 方式で ope を書き込み、applier.py の handler が適用して公開した結果を待つ"""
+
+    # applier は lsk までの ope がコミット済みであることを前提にするので常に watermark 方式で書き込む
+    with TRACE.phase("put_ope"):
+        current_skeys = put_opes_with_watermark(obj, ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
+                                                skeys=new_skeys(len(opes)), opes=opes)
+    own: dict[str, Result] = {}
+
+    deadline = time.time() + GROUP_COMMIT_TIMEOUT
+    interval = GROUP_COMMIT_POLL_INTERVAL
+    with TRACE.phase("wait"):
+        while True:
+            time.sleep(interval)
+            interval = min(interval * 2, GROUP_COMMIT_POLL_INTERVAL_MAX)
+
+            if not is_published(obj, current_skeys[-1]):
+                if time.time() > deadline:
+                    raise Exception("stream apply timeout")
+                continue
+
+            own.update(get_saved_results(obj, [s for s in current_skeys if s not in own]))
+            if len(own) == len(current_skeys):
+                return {s: own[s] for s in current_skeys}
+
+            if time.time() > deadline:
+                raise Exception("stream apply timeout")
+
+
+def submit_opes(obj: QueueObject, opes: list[Ope]) -> list[str]:
+    """opes をコミットして適用を自身の非同期呼び出しに依頼し、skey を返す (SUBMIT_MODE=async)
+
+    スナップショットの大きさや他のリクエストとの競合に関係なく、ope の書き込みだけで応答できる。
+    非同期呼び出しが失敗しても、後続の sync のリクエストが自分の ope までを適用するときに一緒に適用される。
+    そのため ope のコミット後は非同期呼び出しが失敗してもリクエストは失敗させない (再送で ope が重複するため)。
+    stream 方式では applier.py の handler が適用するので非同期呼び出しは行わない。"""
+
+    # 非同期呼び出しは lsk までの ope がコミット済みであることを前提にするので常に watermark 方式で書き込む
+    with TRACE.phase("put_ope"):
+        current_skeys = put_opes_with_watermark(obj, ckey_suffix=DYNAMODB_SORT_KEY_OPE_SUFIX,
+                                                skeys=new_skeys(len(opes)), opes=opes)
+    if OPE_APPLY_MODE != OPE_APPLY_MODE_STREAM:
+        run_best_effort("request apply pending", request_apply_pending, obj)
+    return current_skeys
+
+
+def request_apply_pending(obj: QueueObject) -> None:
+    """コミット済みの ope の適用を自身の非同期呼び出しに依頼する"""
+
+    logger.info({"msg": "request apply pending", "data": DEBUG_DATA, "cky": obj.cky})
+    traced(
+        "lambda.invoke", LAMBDA.invoke,
+        FunctionName=os.environ["AWS_LAMBDA_FUNCTION_NAME"],
+        InvocationType="Event",
+        Payload=json.dumps({"action": APPLY_PENDING_ACTION, "object": obj.object_path}).encode(),
+    )
+
+
+def handle_apply_pending(obj: QueueObject) -> int:
+    """コミット済みの ope を lsk まで適用し、適用した ope の数を返す
+
+    リースを取得できない場合は、リースを持っている呼び出しが解放後に lsk を確認して
+    残りを適用するので何もしない。"""
+
+    owner = new_skey()
+    count = 0
+    while acquire_apply_lease(obj, owner=owner):
+        try:
+            count += len(apply_pending(obj))
+        finally:
+            release_apply_lease(obj, owner=owner)
+
+        # リースを持っている間にコミットされた ope の呼び出しはリースを取得できずに終わっているので、
+        # 解放後に lsk が公開済みの skey より大きければ続けて適用する
+        last_skey = get_last_ope_skey(obj)
+        cur = get_current_skey(obj)
+        if not last_skey or (cur and last_skey <= cur):
+            break
+    return count
+
+
+def get_ope_result(obj: QueueObject, skey: str) -> tuple[int, dict]:
+    """GET /dy-queue/ops/{skey} の (ステータスコード, body) を返す
+
+    結果が保存されていれば 200 と結果、コミット済みで未適用なら 202、
+    それ以外 (書き込まれていない skey や TTL で結果が消えた ope) は 404 とする。"""
+
+    if (res := get_result(obj, skey)):
+        return 200, res
+
+    # 結果は cur の更新より前に保存するので、結果がなく cur 以下なら結果は残っていない
+    last_skey = get_last_ope_skey(obj)
+    cur = get_current_skey(obj)
+    if last_skey and skey <= last_skey and not (cur and skey <= cur) and exists_ope(obj, skey):
+        return 202, {"skey": skey, "status": "pending"}
+    return 404, {"skey": skey, "status": "not found"}
+
+
+def convert_opes(body_data: dict) -> list[Ope] | None:
+    """まとめて書き込む ope の配列 ({"ops": [{"method": "insert", "data": "..."}, ...]}) を変換する
+
+    method を省略した場合は insert とする。配列が空か BATCH_MAX_OPES を超える場合、不正な要素がある場合は None を返す。"""
+
+    ops = body_data.get("ops")
+    if not isinstance(ops, list) or not 0 < len(ops) <= BATCH_MAX_OPES:
+        return None
+
+    opes = []
+    for op in ops:
+        if not isinstance(op, dict):
+            return None
+        method = op.get("method") or Ope.INSERT
+        data = convert_data(op)
+        if method not in (Ope.INSERT, Ope.DROP) or data is None:
+            return None
+        opes.append(new_ope(data=data, method=method))
+    return opes
+
+
+def convert_data(src: dict) -> str | None:
+    """POST する ope の data を返す (省略した場合は空文字列、文字列以外の場合は None)
+
+    数値などは DynamoDB から Decimal などで返されてスナップショットに保存できなくなるので、コミットする前に拒否する。"""
+
+    data = src.get("data", "")
+    return data if isinstance(data, str) else None
+
+
+def get_db(obj: QueueObject) -> dict:
+    with TRACE.phase("load"):
+        return load_latest(obj, cur=resolve_current_skey(obj))
 
 # ------------------------------------------------------------------
 
@@ -453,6 +2055,21 @@ def handler(event, context):
     # print("context")
     # print(context)
 
+    # DB_JSON_SYNC=async の場合の自身からの非同期呼び出し
+    if event and event.get("action") == DB_JSON_SYNC_ACTION:
+        logger.info({"msg": "sync db.json", "object": event.get("object"), "skey": event.get("skey")})
+        object_path = event.get("object") or ""
+        handle_db_json_sync(QueueObject(object_path) if object_path else DEFAULT_OBJECT,
+                            skey=event.get("skey") or "")
+        return {"statusCode": 200}
+
+    # SUBMIT_MODE=async の場合の自身からの非同期呼び出し
+    if event and event.get("action") == APPLY_PENDING_ACTION:
+        object_path = event.get("object") or ""
+        count = handle_apply_pending(QueueObject(object_path) if object_path else DEFAULT_OBJECT)
+        logger.info({"msg": "apply pending", "object": object_path, "count": count})
+        return {"statusCode": 200}
+
     path = convert_path(event)
     method = convert_method(event)
     body_data = convert_body_data(event)
@@ -461,23 +2078,72 @@ def handler(event, context):
     global DEBUG_DATA
     DEBUG_DATA = body_data.get("data")
 
+    TRACE.reset()
     logger.info({"msg": "prcess start", "data": DEBUG_DATA})
     try:
-        if (m := re.match(r".*[/]dy-queue", path)):
+        if method == "GET" and (ope_path := convert_ope_path(path)):
+            object_path, skey = ope_path
+            obj = convert_object(object_path)
+            if obj is None:
+                return RESPONSE_400
+
+            status_code, body = get_ope_result(obj, skey)
+            return {
+                'statusCode': status_code,
+                'body': json.dumps(body)
+            }
+        if method == "GET" and re.match(r".*[/]dy-queue(?:/objects/.*)?/ops(?:/.*)?$", path):
+            # skey が ULID の形式ではない
+            return RESPONSE_400
+
+        # /dy-queue と /dy-queue/objects/{object_path} 以外のパスは 404 (従来のオブジェクトとして扱わない)
+        if (m := re.match(r".*[/]dy-queue(?:/objects/.*)?/?$", path)):
+            obj = convert_object(path)
+            if obj is None:
+                return RESPONSE_400
+
+            submit_mode = parameters.get("submit") or SUBMIT_MODE
+            if submit_mode not in (SUBMIT_MODE_SYNC, SUBMIT_MODE_ASYNC):
+                return RESPONSE_400
+
             if method == "GET":
-                db = get_db()
+                db = get_db(obj)
                 return {
                     'statusCode': 200,
-                    'body': json.dumps(db)
+                    'body': json.dumps(db, default=encode_json_default)
+                }
+            elif method == "POST" and "ops" in body_data:
+                opes = convert_opes(body_data)
+                if opes is None:
+                    return RESPONSE_400
+                if submit_mode == SUBMIT_MODE_ASYNC:
+                    return {
+                        'statusCode': 202,
+                        'body': json.dumps({"skeys": submit_opes(obj, opes)})
+                    }
+                results = post_opes(obj, opes)
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps({"results": [{"skey": skey, **res} for skey, res in results.items()]})
+                }
+            elif method == "POST" and (data := convert_data(body_data)) is None:
+                return RESPONSE_400
+            elif method in ("POST", "DELETE") and submit_mode == SUBMIT_MODE_ASYNC:
+                ope = (new_ope(data=data, method=Ope.INSERT) if method == "POST"
+                       else new_ope(data="", method=Ope.DROP))
+                skey, = submit_opes(obj, [ope])
+                return {
+                    'statusCode': 202,
+                    'body': json.dumps({"skey": skey, "status": "accepted"})
                 }
             elif method == "POST":
-                res = post_data(data=body_data["data"], method=Ope.INSERT)
+                res = post_data(obj, data=data, method=Ope.INSERT)
                 return {
                     'statusCode': 200,
                     'body': json.dumps(res)
                 }
             elif method == "DELETE":
-                res = post_data(data="", method=Ope.DROP)
+                res = post_data(obj, data="", method=Ope.DROP)
                 return {
                     'statusCode': 200,
                     'body': json.dumps(res)
@@ -491,4 +2157,11 @@ def handler(event, context):
             'body': f"{e}"
         }
     finally:
-        logger.info({"msg": "prcess end", "data": DEBUG_DATA})
+        global COLD_START
+        if TRACE_ENABLED:
+            logger.info({"msg": "trace summary", "data": DEBUG_DATA,
+                         "request_id": getattr(context, "aws_request_id", ""),
+                         "path": path, "method": method, "cold": COLD_START, **TRACE.summary()})
+        COLD_START = False
+        logger.info({"msg": "prcess end", "data": DEBUG_DATA,
+                     "cache": SNAPSHOT_CACHE.stats()})
@@ -0,0 +1,113 @@
+"""publish した topic の結果を待つ方法の比較
+
+- ls: cdk/measure/01/ls-response.ps1 と同じく、クライアントが 1 秒ごとに response/ を一覧して数を確認する
+- long-poll: GET /s3/responses?ids=... (publisher の handler) をすべて 200 になるまで繰り返す
+
+--ops 個の ope を 1 回でまとめて publish し、--delay 秒後に subscriber (SUBSCRIBER_MODE=drain) を呼び出す。
+
+- lag[ms]: subscriber が response/ を書き込み終わってから、クライアントが結果を確認できるまでの時間
+- requests: クライアントが送ったリクエストの数 (ls は S3 の一覧、long-poll は API の呼び出し)
+- s3.list_objects_v2 / s3.get_object: 結果を待つ間の S3 の呼び出しの数
+
+python bench/bench_poll.py --ops 100 --delay 3"""
+
+import argparse
+import json
+import threading
+import time
+
+from bench_publisher import api_event, load_publisher
+from bench_subscriber import load_subscriber, s3_event
+import local_aws  # noqa: E402
+
+LS_INTERVAL = 1.0
+
+
+def wait_ls(subscriber, ops: int) -> int:
+    requests = 0
+    while True:
+        time.sleep(LS_INTERVAL)
+        count = 0
+        kwargs = {}
+        while True:
+            requests += 1
+            response = local_aws.S3.list_objects_v2(Bucket=subscriber.RESPONSE_BUCKET_NAME,
+                                                    Prefix=subscriber.RESPONSE_FOLDER, **kwargs)
+            count += response["KeyCount"]
+            if not response.get("IsTruncated"):
+                break
+            kwargs = {"ContinuationToken": response["NextContinuationToken"]}
+        if count >= ops:
+            return requests
+
+
+def wait_long_poll(publisher, topic_ids: list[str], wait: float) -> int:
+    requests = 0
+    while True:
+        requests += 1
+        event = {
+            "requestContext": {"http": {"method": "GET", "path": "/s3/responses"}},
+            "queryStringParameters": {"ids": ",".join(topic_ids), "wait": str(wait)},
+        }
+        response = publisher.handler(event, None)
+        if response["statusCode"] == 200:
+            return requests
+        assert response["statusCode"] == 202, response
+
+
+def run(publisher, subscriber, mode: str, ops: int, delay: float, wait: float) -> dict:
+    local_aws.reset()
+    subscriber.CONFIRMED_UNSENT = []
+
+    response = publisher.handler(api_event({"ops": [{"data": f"ope-{i}"} for i in range(ops)]}), None)
+    topic_ids = json.loads(response["body"])["topic_ids"]
+    topic_key = min(k for (b, k) in local_aws.S3.objects if b == subscriber.TOPIC_BUCKET_NAME)
+
+    written = {}
+
+    def subscribe():
+        time.sleep(delay)
+        subscriber.handler(s3_event([topic_key]), None)
+        written["at"] = time.perf_counter()
+
+    thread = threading.Thread(target=subscribe)
+    thread.start()
+    calls = dict(local_aws.LATENCY_MODEL.calls)
+    if mode == "ls":
+        requests = wait_ls(subscriber, ops)
+    else:
+        requests = wait_long_poll(publisher, topic_ids, wait)
+    found = time.perf_counter()
+    thread.join()
+
+    # subscriber の呼び出し (topic/ の一覧 2 回、DB と topic の取得) を除いた、結果を待つ間の S3 の呼び出し
+    subscriber_calls = {"s3.list_objects_v2": 2, "s3.get_object": 2}
+    after = dict(local_aws.LATENCY_MODEL.calls)
+    return {
+        "mode": mode,
+        "ops": ops,
+        "lag[ms]": round((found - written["at"]) * 1000, 1),
+        "requests": requests,
+        **{name: after.get(name, 0) - calls.get(name, 0) - count for name, count in subscriber_calls.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=100)
+    parser.add_argument("--delay", type=float, default=3, help="publish してから subscriber を呼び出すまでの時間[s]")
+    parser.add_argument("--wait", type=float, default=20, help="long-poll の wait[s]")
+    parser.add_argument("--modes", nargs="+", default=["ls", "long-poll"])
+    args = parser.parse_args()
+
+    publisher = load_publisher()
+    subscriber = load_subscriber()
+    subscriber.SUBSCRIBER_MODE = subscriber.SUBSCRIBER_MODE_DRAIN
+    subscriber.SUBSCRIBER_SETTLE_MS = 0
+
+    for mode in args.modes:
+        print(run(publisher, subscriber, mode, args.ops, args.delay, args.wait))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""publisher で ope を 1 つずつ publish する場合と、まとめて publish する場合の比較
+
+S3 は dynamodb-ope-queue の bench/local_aws.py のスタンドインを使用し、
+--ops 個の ope を --clients 並行で publish した後に、subscriber (SUBSCRIBER_MODE=drain) を 1 回呼び出して処理する。
+
+- publish[ms]: すべての ope の publish が終わるまでの時間
+- topics: topic/ に書き込んだオブジェクトの数 (S3 の PutObject とイベント通知の数)
+- topic_bytes: topic/ に書き込んだ合計の大きさ
+- drain[ms]: subscriber がすべての ope を DB に適用して response/ を書き込むまでの時間
+
+python bench/bench_publisher.py --ops 100 --batch-sizes 1 10 100"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../subscriber/bench"))
+
+from bench_subscriber import TOPIC_BUCKET_NAME, load_subscriber, s3_event  # noqa: E402
+import local_aws  # noqa: E402
+
+
+def load_publisher():
+    """publisher の main.py を別の名前で import して S3 (書き込み用と確認用) を差し替える"""
+
+    spec = importlib.util.spec_from_file_location(
+        "publisher_main", os.path.join(os.path.dirname(__file__), "../main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.S3 = local_aws.S3
+    module.POLL_S3 = local_aws.S3
+    module.TOPIC_BUCKET_NAME = TOPIC_BUCKET_NAME
+    return module
+
+
+def api_event(body: dict) -> dict:
+    return {
+        "requestContext": {"http": {"method": "POST", "path": "/s3"}},
+        "body": json.dumps(body),
+    }
+
+
+def run(publisher, subscriber, ops: int, batch_size: int, clients: int) -> dict:
+    local_aws.reset()
+    subscriber.CONFIRMED_UNSENT = []
+
+    requests = []
+    for offset in range(0, ops, batch_size):
+        count = min(batch_size, ops - offset)
+        if count == 1:
+            requests.append({"data": f"ope-{offset}"})
+        else:
+            requests.append({"ops": [{"data": f"ope-{offset + i}"} for i in range(count)]})
+
+    def post(body: dict) -> list[str]:
+        response = publisher.handler(api_event(body), None)
+        assert response["statusCode"] == 202, response
+        result = json.loads(response["body"])
+        return result.get("topic_ids") or [result["topic_id"]]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        topic_ids = [topic_id for ids in executor.map(post, requests) for topic_id in ids]
+    published = time.perf_counter() - start
+
+    topics = {k: v for (b, k), v in local_aws.S3.objects.items() if b == TOPIC_BUCKET_NAME}
+
+    start = time.perf_counter()
+    subscriber.handler(s3_event([min(topics)]), None)
+    drained = time.perf_counter() - start
+
+    responses = {k for (b, k) in local_aws.S3.objects if b == subscriber.RESPONSE_BUCKET_NAME}
+    assert responses == {f"response/{topic_id}.json" for topic_id in topic_ids}, len(responses)
+    db = json.loads(local_aws.S3.objects[(subscriber.DB_BUCKET_NAME, subscriber.DB_KEY)])
+    assert len(db["data"]) == ops, (len(db["data"]), ops)
+
+    return {
+        "batch_size": batch_size,
+        "ops": ops,
+        "publish[ms]": round(published * 1000, 1),
+        "topics": len(topics),
+        "topic_bytes": sum(len(v) for v in topics.values()),
+        "drain[ms]": round(drained * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=100)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--clients", type=int, default=10, help="並行に publish するクライアントの数")
+    args = parser.parse_args()
+
+    publisher = load_publisher()
+    subscriber = load_subscriber()
+    subscriber.SUBSCRIBER_MODE = subscriber.SUBSCRIBER_MODE_DRAIN
+    # 書き込みが終わった後に 1 回だけ呼び出すので、書き込み中の topic を待つ必要はない
+    subscriber.SUBSCRIBER_SETTLE_MS = 0
+
+    for batch_size in args.batch_sizes:
+        print(run(publisher, subscriber, args.ops, batch_size, args.clients))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,338 @@
+import json
+import os
+import re
+import time
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import logging
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL") or "INFO")
+# ------------------------------------------------------------------
+
+
+TOPIC_BUCKET_NAME = os.environ.get("TOPIC_BUCKET_NAME") or "async-api-sample--api-bucket"
+TOPIC_FOLDER = "topic/"
+# 複数の ope をまとめて書き込む topic のファイル名の接尾辞 (ファイル名は先頭の topic id)
+TOPIC_BATCH_SUFFIX = ".batch.json"
+TOPIC_SUFFIX = ".json"
+RESPONSE_BUCKET_NAME = os.environ.get("RESPONSE_BUCKET_NAME") or "async-api-sample--response-bucket"
+RESPONSE_FOLDER = "response/"
+TOPIC_ID = re.compile(r"[0-9A-HJKMNP-TV-Z]{26}")
+
+# 1 回のリクエストで受け付ける ope の数の上限
+PUBLISHER_MAX_OPES = int(os.environ.get("PUBLISHER_MAX_OPES") or "100")
+
+# topic/ の書き込みの目安の時間[s]
+# 書き込みは再試行せずに、接続と応答の待ち時間をこの時間内のタイムアウトで打ち切り、失敗した場合はクライアントに再試行させる
+# (本文の送信にかかる時間は打ち切れないので、書き込みがこの時間を超えることはある)
+# subscriber の SUBSCRIBER_SETTLE_MS をこれより長くすると、ほとんどの topic は採番した順に適用される
+# (超えた topic は "late topic" を出力し、subscriber が後の topic を先に適用した場合はその topic のイベントで適用される)
+PUBLISHER_PUT_TIMEOUT = float(os.environ.get("PUBLISHER_PUT_TIMEOUT") or "2")
+
+# response/ を待つ時間の上限[s] (wait パラメーターで短くできる、Lambda のタイムアウトからも制限する)
+PUBLISHER_POLL_TIMEOUT = float(os.environ.get("PUBLISHER_POLL_TIMEOUT") or "20")
+# response/ を確認する間隔 (PUBLISHER_POLL_INTERVAL から倍々に延ばし、PUBLISHER_POLL_INTERVAL_MAX で止める)
+PUBLISHER_POLL_INTERVAL = 0.05
+PUBLISHER_POLL_INTERVAL_MAX = 0.5
+# Lambda のタイムアウトまでに応答を返すための余裕[s]
+PUBLISHER_POLL_MARGIN = 1.0
+# まとめて待つ topic id の数の上限
+PUBLISHER_POLL_MAX_IDS = int(os.environ.get("PUBLISHER_POLL_MAX_IDS") or "1000")
+
+OPE_INSERT = "insert"
+OPE_DROP = "drop"
+
+ULID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+RESPONSE_400 = {
+    'statusCode': 400,
+    'body': json.dumps('Bad Request')
+}
+RESPONSE_404 = {
+    'statusCode': 404,
+    'body': json.dumps('Not Found')
+}
+
+# ------------------------------------------------------------------
+
+
+# topic/ の書き込み用 (再試行しない)
+S3 = boto3.client("s3", config=Config(connect_timeout=PUBLISHER_PUT_TIMEOUT / 4, read_timeout=PUBLISHER_PUT_TIMEOUT / 2,
+                                      retries={"total_max_attempts": 1}))
+# response/ を待つ間の確認用 (一時的なエラーやスロットリングで待つのをやめないように、通常どおり再試行する)
+POLL_S3 = boto3.client("s3")
+
+
+def convert_path(event) -> str:
+    if not event:
+        return ""
+    requestContext = event.get("requestContext") or {}
+    http = requestContext.get("http") or {}
+    path = http.get("path") or ""
+    return path
+
+
+def convert_method(event) -> str:
+    if not event:
+        return ""
+
+    requestContext = event.get("requestContext") or {}
+    http = requestContext.get("http") or {}
+    method = http.get("method") or ""
+    return method
+
+
+def convert_parameters(event) -> dict:
+    if not event:
+        return {}
+    return event.get("queryStringParameters") or {}
+
+
+def convert_body_data(event) -> dict:
+    if not event:
+        return {}
+    return json.loads(event.get("body") or "{}")
+
+
+def convert_opes(body_data: dict) -> list[dict] | None:
+    """まとめて publish する ope の配列 ({"ops": [{"method": "insert", "data": "..."}, ...]}) を変換する
+
+    dynamodb-ope-queue の POST の ops と同じ形式で、method を省略した場合は insert とする。
+    配列が空か PUBLISHER_MAX_OPES を超える場合、不正な要素がある場合は None を返す。"""
+
+    ops = body_data.get("ops")
+    if not isinstance(ops, list) or not 0 < len(ops) <= PUBLISHER_MAX_OPES:
+        return None
+
+    opes = []
+    for op in ops:
+        if not isinstance(op, dict):
+            return None
+        method = op.get("method") or OPE_INSERT
+        data = op.get("data") or ""
+        if method not in (OPE_INSERT, OPE_DROP) or not isinstance(data, str):
+            return None
+        opes.append(new_ope(data=data, method=method))
+    return opes
+
+
+def new_ope(data: str, method: str = OPE_INSERT) -> dict:
+    """subscriber が DB に適用する ope (dynamodb-ope-queue の ope と同じ形式)"""
+
+    return {"v": "1", "m": method, "d": data}
+
+
+def encode_ulid(value: int) -> str:
+    return "".join(ULID_ALPHABET[(value >> (5 * i)) & 31] for i in range(25, -1, -1))
+
+
+def new_topic_ids(count: int) -> list[str]:
+    """連続した count 個の ULID を採番する (先頭の ULID の値に 1 ずつ加える)
+
+    subscriber は topic をキーの順に適用するので、1 回のリクエストの ope は採番した順に適用される。"""
+
+    # 乱数部分の最上位ビットを 0 にして、count を加えても時刻の部分に繰り上がらないようにする
+    first = (int(time.time() * 1000) << 80) | (int.from_bytes(os.urandom(10), "big") >> 1)
+    return [encode_ulid(first + i) for i in range(count)]
+
+
+def encode_topic(data) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def publish(opes: list[dict]) -> list[str]:
+    """ope を topic/ に書き込み、ope ごとの topic id を返す
+
+    1 つの場合は topic/{id}.json に ope を書き込み、
+    複数の場合は 1 つのオブジェクト topic/{先頭の id}.batch.json ({"v": "1", "ops": [...]}) にまとめて書き込む
+    (id は連続しているので、ops の i 番目の id は先頭の id に i を加えた値になり、書き込まない)。
+    結果は subscriber が ope を適用した後に response/{id}.json に書き込む。"""
+
+    ids = new_topic_ids(len(opes))
+    if len(opes) == 1:
+        key = TOPIC_FOLDER + ids[0] + TOPIC_SUFFIX
+        body = encode_topic(opes[0])
+    else:
+        key = TOPIC_FOLDER + ids[0] + TOPIC_BATCH_SUFFIX
+        body = encode_topic({"v": "1", "ops": opes})
+
+    start = time.perf_counter()
+    S3.put_object(Body=body, Bucket=TOPIC_BUCKET_NAME, Key=key, ContentType="application/json")
+    put_ms = round((time.perf_counter() - start) * 1000, 1)
+    logger.info({"msg": "published", "key": key, "count": len(opes), "bytes": len(body), "put_ms": put_ms})
+    if put_ms > PUBLISHER_PUT_TIMEOUT * 1000:
+        # 本文の送信に時間がかかった場合などで、subscriber が先に後の topic を処理した可能性がある
+        # (この topic もイベントで処理されるが、採番した順ではなくなる)
+        logger.warning({"msg": "late topic", "key": key, "put_ms": put_ms})
+    return ids
+
+
+def convert_deadline(parameters: dict, context) -> float | None:
+    """wait パラメーター[s] (省略した場合は PUBLISHER_POLL_TIMEOUT) と Lambda の残り時間から、待つ期限 (time.monotonic) を返す"""
+
+    try:
+        wait = float(parameters.get("wait") or PUBLISHER_POLL_TIMEOUT)
+    except ValueError:
+        return None
+    wait = max(0.0, min(wait, PUBLISHER_POLL_TIMEOUT))
+    if context is not None:
+        wait = min(wait, context.get_remaining_time_in_millis() / 1000 - PUBLISHER_POLL_MARGIN)
+    return time.monotonic() + wait
+
+
+def poll(check, deadline: float) -> int:
+    """check が True を返すか deadline を過ぎるまで、間隔を倍々に延ばしながら check を呼び出し、呼び出した回数を返す"""
+
+    interval = PUBLISHER_POLL_INTERVAL
+    attempts = 0
+    while True:
+        attempts += 1
+        if check():
+            return attempts
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return attempts
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, PUBLISHER_POLL_INTERVAL_MAX)
+
+
+def convert_response_key(topic_id: str) -> str:
+    return RESPONSE_FOLDER + topic_id + TOPIC_SUFFIX
+
+
+def get_response(topic_id: str) -> dict | None:
+    """response/{topic id}.json の内容を返す (まだ書き込まれていない場合は None を返す)"""
+
+    try:
+        body = POLL_S3.get_object(Bucket=RESPONSE_BUCKET_NAME, Key=convert_response_key(topic_id))["Body"].read()
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            return None
+        raise
+    return json.loads(body)
+
+
+def list_responses(topic_ids: set[str]) -> set[str]:
+    """topic_ids のうち response/ が書き込まれている topic id を、topic id の共通の接頭辞で一覧して返す
+
+    topic id は ULID なので、同じリクエストや近い時刻に publish した topic id は長い接頭辞を共有し、
+    最小の topic id から最大の topic id までの範囲だけを一覧すればよい。"""
+
+    first, last = min(topic_ids), max(topic_ids)
+    prefix = RESPONSE_FOLDER + os.path.commonprefix([first, last])
+    kwargs = {"StartAfter": RESPONSE_FOLDER + first}
+    found = set()
+    while True:
+        response = POLL_S3.list_objects_v2(Bucket=RESPONSE_BUCKET_NAME, Prefix=prefix, **kwargs)
+        for content in response.get("Contents") or []:
+            topic_id = content["Key"][len(RESPONSE_FOLDER):].split(".")[0]
+            if topic_id > last:
+                return found
+            if topic_id in topic_ids:
+                found.add(topic_id)
+        if not response.get("IsTruncated"):
+            return found
+        kwargs = {"ContinuationToken": response["NextContinuationToken"]}
+
+
+def wait_response(topic_id: str, deadline: float) -> dict:
+    """response/{topic id}.json が書き込まれるまで待ち、結果を返す"""
+
+    result = {}
+
+    def check() -> bool:
+        data = get_response(topic_id)
+        if data is None:
+            return False
+        result["data"] = data
+        return True
+
+    attempts = poll(check, deadline)
+    logger.info({"msg": "poll response", "topic_id": topic_id, "attempts": attempts, "done": "data" in result})
+    if "data" not in result:
+        return {"topic_id": topic_id, "status": "pending"}
+    return {"topic_id": topic_id, "status": "done", "data": result["data"]}
+
+
+def wait_responses(topic_ids: list[str], deadline: float) -> list[dict]:
+    """すべての topic id の response/ が書き込まれるまで待ち、topic id ごとの状態を返す
+
+    1 回の確認は、まだ書き込まれていない topic id の範囲の一覧だけで行う。"""
+
+    pending = set(topic_ids)
+
+    def check() -> bool:
+        pending.difference_update(list_responses(pending))
+        return not pending
+
+    attempts = poll(check, deadline)
+    logger.info({"msg": "poll responses", "count": len(topic_ids), "pending": len(pending), "attempts": attempts})
+    return [{"topic_id": topic_id, "status": "pending" if topic_id in pending else "done"}
+            for topic_id in topic_ids]
+
+
 def handler(event, context):
-    return {
-        'statusCode': 200,
-        'body': 'Hello, CDK!'
-    }
+    # print(event)
+
+    path = convert_path(event)
+    method = convert_method(event)
+    parameters = convert_parameters(event)
+
+    try:
+        # response/{topic id}.json が書き込まれるまで待ち、書き込まれた内容を返す (書き込まれなかった場合は 202)
+        if method == "GET" and (m := re.match(r".*[/]s3/responses/(?P<topic_id>[^/]+)$", path)):
+            deadline = convert_deadline(parameters, context)
+            if deadline is None or not TOPIC_ID.fullmatch(m.group("topic_id")):
+                return RESPONSE_400
+            result = wait_response(m.group("topic_id"), deadline)
+            return {
+                'statusCode': 200 if result["status"] == "done" else 202,
+                'body': json.dumps(result)
+            }
+
+        # ids (カンマ区切り) のすべての response/ が書き込まれるまで待ち、topic id ごとの状態を返す (すべて書き込まれなかった場合は 202)
+        if method == "GET" and re.match(r".*[/]s3/responses$", path):
+            deadline = convert_deadline(parameters, context)
+            topic_ids = list(dict.fromkeys(i for i in (parameters.get("ids") or "").split(",") if i))
+            if (deadline is None or not 0 < len(topic_ids) <= PUBLISHER_POLL_MAX_IDS
+                    or not all(TOPIC_ID.fullmatch(i) for i in topic_ids)):
+                return RESPONSE_400
+            results = wait_responses(topic_ids, deadline)
+            pending = sum(r["status"] == "pending" for r in results)
+            return {
+                'statusCode': 202 if pending else 200,
+                'body': json.dumps({"responses": results, "pending": pending})
+            }
+
+        if re.match(r".*[/]s3$", path):
+            body_data = convert_body_data(event)
+
+            if method == "POST" and "ops" in body_data:
+                opes = convert_opes(body_data)
+                if opes is None:
+                    return RESPONSE_400
+                return {
+                    'statusCode': 202,
+                    'body': json.dumps({"topic_ids": publish(opes), "status": "accepted"})
+                }
+            elif method in ("POST", "DELETE"):
+                data = body_data.get("data") or ""
+                if method == "POST" and not isinstance(data, str):
+                    return RESPONSE_400
+                ope = new_ope(data=data, method=OPE_INSERT) if method == "POST" else new_ope(data="", method=OPE_DROP)
+                topic_id, = publish([ope])
+                return {
+                    'statusCode': 202,
+                    'body': json.dumps({"topic_id": topic_id, "status": "accepted"})
+                }
+
+        return RESPONSE_404
+    except Exception as e:
+        logger.exception({"msg": "Failed", "exception": f"{e}"})
+        return {
+            'statusCode': 500,
+            'body': f"{e}"
+        }
@@ -0,0 +1,164 @@
+"""topic を response/ に書き込む方式 (SUBSCRIBER_COPY_MODE) ごとの、topic の大きさに対する subscriber のメモリ使用量の比較
+
+- read: 変更前の方式 (topic 全体を読み込んでから PutObject する) をベンチマーク内で再現したもの
+- copy: S3 のサーバー側でコピーする
+- stream: STREAM_CHUNK_SIZE ずつ読み込み、MULTIPART_PART_SIZE を超えたらマルチパートアップロードで書き込む
+
+peak[MiB] は tracemalloc で計測した handler の実行中の割り当ての最大値。
+S3 は ResponseSink を通して、読み込みは実際のネットワークと同じく読み込むたびに新しいバイト列を返し、
+response バケットへの書き込みは大きさだけを記録する (S3 側の保持を含めない)。
+
+python bench/bench_copy.py --sizes 1 16 64"""
+
+import argparse
+import time
+import tracemalloc
+
+# bench_subscriber が local_aws を import できるように sys.path を設定する
+from bench_subscriber import TOPIC_BUCKET_NAME, load_subscriber, s3_event
+import local_aws  # noqa: E402
+
+MIB = 1024 * 1024
+
+
+class NetworkBody:
+    """受信したデータのように、読み込むたびに新しいバイト列を返す StreamingBody"""
+
+    def __init__(self, data: bytes) -> None:
+        self.view = memoryview(data)
+        self.position = 0
+
+    def read(self, amt: int | None = None) -> bytes:
+        end = len(self.view) if amt is None else min(self.position + amt, len(self.view))
+        chunk = bytes(self.view[self.position:end])
+        self.position = end
+        return chunk
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while chunk := self.read(chunk_size):
+            yield chunk
+
+    def close(self) -> None:
+        self.view.release()
+
+
+class ResponseSink:
+    """local_aws.S3 に委譲し、読み込みは NetworkBody で返し、response バケットへの書き込みは大きさだけを記録する"""
+
+    def __init__(self, s3, bucket: str) -> None:
+        self.s3 = s3
+        self.bucket = bucket
+        self.sizes: dict[str, int] = {}
+        self.uploads: dict[str, int] = {}
+
+    def __getattr__(self, name):
+        return getattr(self.s3, name)
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self.s3.get_object(Bucket=Bucket, Key=Key, **kwargs)
+        data = self.s3.objects[(Bucket, Key)]
+        return {"Body": NetworkBody(data), "ContentLength": len(data)}
+
+    def put_object(self, Body: bytes, Bucket: str, Key: str, **kwargs) -> dict:
+        if Bucket != self.bucket:
+            return self.s3.put_object(Body=Body, Bucket=Bucket, Key=Key, **kwargs)
+        self.s3._call("put_object")
+        self.sizes[Key] = len(Body)
+        return {}
+
+    def copy_object(self, CopySource: dict, Bucket: str, Key: str, **kwargs) -> dict:
+        self.s3._call("copy_object")
+        self.sizes[Key] = len(self.s3.objects[(CopySource["Bucket"], CopySource["Key"])])
+        return {}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self.s3._call("create_multipart_upload")
+        upload_id = f"{Key}/{len(self.uploads)}"
+        self.uploads[upload_id] = 0
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Body: bytes, Bucket: str, Key: str, UploadId: str, PartNumber: int, **kwargs) -> dict:
+        self.s3._call("upload_part")
+        self.uploads[UploadId] += len(Body)
+        return {"ETag": str(PartNumber)}
+
+    def upload_part_copy(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, CopySource: dict,
+                         CopySourceRange: str, **kwargs) -> dict:
+        self.s3._call("upload_part_copy")
+        start, end = CopySourceRange.split("=")[1].split("-")
+        self.uploads[UploadId] += int(end) - int(start) + 1
+        return {"CopyPartResult": {"ETag": str(PartNumber)}}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self.s3._call("complete_multipart_upload")
+        self.sizes[Key] = self.uploads.pop(UploadId)
+        return {}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self.uploads.pop(UploadId, None)
+        return {}
+
+
+def read_object(subscriber, topic, dest_key: str) -> tuple[int, int]:
+    """変更前の方式: topic 全体を読み込んでから PutObject する"""
+
+    data = subscriber.S3.get_object(Bucket=topic.bucket, Key=topic.key)["Body"].read()
+    subscriber.S3.put_object(Body=data, Bucket=subscriber.RESPONSE_BUCKET_NAME, Key=dest_key)
+    return len(data), 1
+
+
+def run(subscriber, sink: ResponseSink, mode: str, size: int) -> dict:
+    local_aws.reset()
+    sink.sizes.clear()
+
+    key = "topic/0000.json"
+    local_aws.S3.objects[(TOPIC_BUCKET_NAME, key)] = b"x" * size
+
+    copy_object = subscriber.copy_object
+    if mode == "read":
+        subscriber.copy_object = lambda topic, dest_key: read_object(subscriber, topic, dest_key)
+    subscriber.SUBSCRIBER_MODE = subscriber.SUBSCRIBER_MODE_EVENT
+    subscriber.CONFIRMED_UNSENT = []
+    subscriber.SUBSCRIBER_COPY_MODE = subscriber.COPY_MODE_STREAM if mode == "stream" else subscriber.COPY_MODE_COPY
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        # イベントの size を省略して HeadObject で取得させる
+        subscriber.handler(s3_event([key]), None)
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        subscriber.copy_object = copy_object
+
+    assert sink.sizes == {"response/0000.json": size}, sink.sizes
+
+    calls = dict(local_aws.LATENCY_MODEL.calls)
+    return {
+        "mode": mode,
+        "size[MiB]": round(size / MIB, 1),
+        "elapsed[ms]": round(elapsed * 1000, 1),
+        "peak[MiB]": round(peak / MIB, 1),
+        "s3.upload_part": calls.get("s3.upload_part", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 16, 64], help="topic の大きさ[MiB]")
+    parser.add_argument("--modes", nargs="+", default=["read", "copy", "stream"])
+    args = parser.parse_args()
+
+    subscriber = load_subscriber()
+    sink = ResponseSink(local_aws.S3, subscriber.RESPONSE_BUCKET_NAME)
+    subscriber.S3 = sink
+
+    for size in args.sizes:
+        for mode in args.modes:
+            print(run(subscriber, sink, mode, int(size * MIB)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""同時実行数 1 の subscriber で topic をすべて処理するまでの時間の比較 (SUBSCRIBER_MODE=event / drain)
+
+topic を並行に書き込み、topic ごとの S3 のイベント通知を ThrottledFunction で非同期呼び出しする。
+実行中に届いたイベントはスロットリングされ、--retry-delay から倍々に延ばした時間 (±50%) の後に再送される
+(実環境では 1 秒程度から最大 5 分まで延びるので、10 topic で 30s ～ 2m かかっていた)。
+
+- done[s]: すべての topic の response/ が書き込まれるまでの時間
+- invocations: handler を呼び出した回数 (スロットリングされたイベントの再送を含む)
+- throttles: スロットリングされた (または失敗した) イベントを再送した回数
+- db_loads / db_saves: DB の読み込み / 保存の回数
+
+--late 個の topic は ULID を採番してから SUBSCRIBER_SETTLE_MS の 2 倍の時間の後に書き込む
+(書き込みが遅れて、先に DB の最後のキーが進んだ topic も処理されることの確認)。
+
+python bench/bench_drain.py --topics 10 --retry-delay 0.5 --late 2"""
+
+import argparse
+import json
+import random
+import threading
+import time
+
+import ulid
+
+from bench_subscriber import TOPIC_BUCKET_NAME, load_subscriber, s3_event
+import local_aws  # noqa: E402
+
+
+class ThrottledFunction:
+    """予約された同時実行数が 1 の Lambda への非同期呼び出しのスタンドイン"""
+
+    def __init__(self, handler, retry_delay: float, seed: int = 0) -> None:
+        self.handler = handler
+        self.retry_delay = retry_delay
+        self.random = random.Random(seed)
+        self.running = threading.Lock()
+        self.lock = threading.Lock()
+        self.threads: list[threading.Thread] = []
+        self.invocations = 0
+        self.throttles = 0
+
+    def invoke(self, event: dict) -> None:
+        thread = threading.Thread(target=self._deliver, args=(event,))
+        thread.start()
+        self.threads.append(thread)
+
+    def _deliver(self, event: dict) -> None:
+        delay = self.retry_delay
+        while True:
+            if self.running.acquire(blocking=False):
+                try:
+                    with self.lock:
+                        self.invocations += 1
+                    self.handler(event, None)
+                    return
+                except Exception:
+                    # 失敗した場合もスロットリングと同じように再送する
+                    pass
+                finally:
+                    self.running.release()
+            with self.lock:
+                self.throttles += 1
+                jitter = self.random.uniform(0.5, 1.5)
+            time.sleep(delay * jitter)
+            delay *= 2
+
+    def join(self) -> None:
+        for thread in self.threads:
+            thread.join()
+
+
+DONE_TIMEOUT = 60
+
+
+def run(subscriber, mode: str, topics: int, retry_delay: float, late: int) -> dict:
+    local_aws.reset()
+    subscriber.SUBSCRIBER_MODE = mode
+    subscriber.CONFIRMED_UNSENT = []
+
+    counts = {"db_loads": 0, "db_saves": 0}
+    load_db = subscriber.load_db
+    save_db = subscriber.save_db
+
+    def counted_load_db():
+        counts["db_loads"] += 1
+        return load_db()
+
+    def counted_save_db(db):
+        counts["db_saves"] += 1
+        return save_db(db)
+
+    subscriber.load_db = counted_load_db
+    subscriber.save_db = counted_save_db
+    function = ThrottledFunction(subscriber.handler, retry_delay)
+
+    def publish(no: int):
+        key = f"topic/{ulid.new()}.json"
+        if no < late:
+            time.sleep(subscriber.SUBSCRIBER_SETTLE_MS * 2 / 1000)
+        body = json.dumps({"m": "insert", "d": f"topic-{no}"}).encode()
+        local_aws.S3.put_object(Body=body, Bucket=TOPIC_BUCKET_NAME, Key=key)
+        function.invoke(s3_event([key]))
+
+    start = time.perf_counter()
+    try:
+        publishers = [threading.Thread(target=publish, args=(no,)) for no in range(topics)]
+        for thread in publishers:
+            thread.start()
+        for thread in publishers:
+            thread.join()
+
+        while True:
+            responses = [k for (b, k) in list(local_aws.S3.objects)
+                         if b == subscriber.RESPONSE_BUCKET_NAME and k.startswith(subscriber.RESPONSE_FOLDER)]
+            if len(responses) >= topics:
+                break
+            assert time.perf_counter() - start < DONE_TIMEOUT, (len(responses), topics)
+            time.sleep(0.01)
+        done = time.perf_counter() - start
+
+        # スロットリングされたイベントの再送がすべて終わるまで待つ
+        function.join()
+    finally:
+        subscriber.load_db = load_db
+        subscriber.save_db = save_db
+
+    db = json.loads(local_aws.S3.objects[(subscriber.DB_BUCKET_NAME, subscriber.DB_KEY)])
+    assert len(db["data"]) == topics, (len(db["data"]), topics)
+
+    return {
+        "mode": mode,
+        "topics": topics,
+        "late": late,
+        "done[s]": round(done, 2),
+        "invocations": function.invocations,
+        "throttles": function.throttles,
+        **counts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--topics", type=int, default=10)
+    parser.add_argument("--retry-delay", type=float, default=0.5, help="スロットリングされたイベントの最初の再送までの時間[s]")
+    parser.add_argument("--settle-ms", type=int, default=200, help="SUBSCRIBER_SETTLE_MS")
+    parser.add_argument("--late", type=int, default=0, help="書き込みが遅れる topic の数")
+    parser.add_argument("--modes", nargs="+", default=["event", "drain"])
+    args = parser.parse_args()
+
+    subscriber = load_subscriber()
+    subscriber.SUBSCRIBER_SETTLE_MS = args.settle_ms
+
+    for mode in args.modes:
+        print(run(subscriber, mode, args.topics, args.retry_delay, args.late))
+
+
+if __name__ == "__main__":
+    main()
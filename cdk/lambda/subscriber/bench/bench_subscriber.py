@@ -0,0 +1,91 @@
+"""subscriber の 1 回の呼び出しで複数の topic を処理するときの並行数ごとの所要時間の比較
+
+S3 は dynamodb-ope-queue の bench/local_aws.py のスタンドインを使用する。
+イベントの topic だけを処理する SUBSCRIBER_MODE=event で計測する (drain との比較は bench/bench_drain.py)。
+--fail を指定すると topic の一部を削除しておき、失敗した topic だけが報告されることを確認する。
+
+python bench/bench_subscriber.py --topics 10 --workers 1 8"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../dynamodb-ope-queue/bench"))
+
+import local_aws  # noqa: E402
+
+TOPIC_BUCKET_NAME = "bench-api-bucket"
+
+
+def load_subscriber():
+    """subscriber の main.py を dynamodb-ope-queue の main と別の名前で import して S3 を差し替える"""
+
+    spec = importlib.util.spec_from_file_location(
+        "subscriber_main", os.path.join(os.path.dirname(__file__), "../main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.S3 = local_aws.S3
+    module.TOPIC_BUCKET_NAME = TOPIC_BUCKET_NAME
+    return module
+
+
+def s3_event(keys: list[str]) -> dict:
+    return {
+        "Records": [
+            {"eventSource": "aws:s3", "s3": {"bucket": {"name": TOPIC_BUCKET_NAME}, "object": {"key": key}}}
+            for key in keys
+        ]
+    }
+
+
+def run(subscriber, workers: int, topics: int, size: int, fail: int) -> dict:
+    local_aws.reset()
+    subscriber.SUBSCRIBER_MODE = subscriber.SUBSCRIBER_MODE_EVENT
+    subscriber.CONFIRMED_UNSENT = []
+    subscriber.EXECUTOR = ThreadPoolExecutor(max_workers=workers)
+
+    keys = [f"topic/{n:04}.json" for n in range(topics)]
+    body = json.dumps({"data": "x" * size}).encode()
+    for key in keys[fail:]:
+        local_aws.S3.objects[(TOPIC_BUCKET_NAME, key)] = body
+
+    start = time.perf_counter()
+    try:
+        subscriber.handler(s3_event(keys), None)
+        failed = ""
+    except Exception as e:
+        failed = str(e)
+    elapsed = time.perf_counter() - start
+
+    responses = [k for (b, k) in local_aws.S3.objects
+                 if b == subscriber.RESPONSE_BUCKET_NAME and k.startswith(subscriber.RESPONSE_FOLDER)]
+    assert len(responses) == topics - fail, (len(responses), topics - fail)
+
+    return {
+        "workers": workers,
+        "topics": topics,
+        "elapsed[ms]": round(elapsed * 1000, 1),
+        "failed": failed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--topics", type=int, default=10)
+    parser.add_argument("--size", type=int, default=1024, help="topic の data の大きさ[byte]")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--fail", type=int, default=0, help="存在しない topic の数")
+    args = parser.parse_args()
+
+    subscriber = load_subscriber()
+
+    for workers in args.workers:
+        print(run(subscriber, workers, args.topics, args.size, args.fail))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,601 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
-S3 = boto3.client("s3")
+import logging
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL") or "INFO")
+# ------------------------------------------------------------------
 
 
-def handler(event, context):
-    print(event)
+TOPIC_BUCKET_NAME = os.environ.get("TOPIC_BUCKET_NAME") or "async-api-sample--api-bucket"
+TOPIC_FOLDER = "topic/"
+# publisher が複数の ope を 1 つにまとめて書き込んだ topic ({"v": "1", "ops": [...]}) のファイル名の接尾辞
+# (ファイル名は先頭の ope の topic id で、i 番目の ope の topic id は先頭の id に i を加えた ULID)
+TOPIC_BATCH_SUFFIX = ".batch.json"
+RESPONSE_BUCKET_NAME = os.environ.get("RESPONSE_BUCKET_NAME") or "async-api-sample--response-bucket"
+RESPONSE_FOLDER = "response/"
+# topic を適用した DB
+DB_BUCKET_NAME = os.environ.get("DB_BUCKET_NAME") or "async-api-sample--db-bucket"
+DB_KEY = os.environ.get("DB_KEY") or "db.json"
+
+# topic の処理方式
+#   event: イベントに含まれる topic だけを処理する (呼び出しごとに DB を読み込んで保存する)
+#   drain: DB に記録した最後の topic のキーより後の topic/ を一覧して、未処理の topic をまとめて処理する
+#          (同時実行数 1 でスロットリングされたイベントが再送されたときには処理済みになっている)
+#          一覧するのはファイル名が ULID (採番順にソートできる) の topic だけで、それ以外と、
+#          最後のキーより前に遅れて書き込まれた topic はイベントの topic として処理する
+SUBSCRIBER_MODE_EVENT = "event"
+SUBSCRIBER_MODE_DRAIN = "drain"
+SUBSCRIBER_MODE = os.environ.get("SUBSCRIBER_MODE") or SUBSCRIBER_MODE_DRAIN
+# drain で 1 回の一覧で取得して、まとめて適用する topic の数
+SUBSCRIBER_BATCH_SIZE = int(os.environ.get("SUBSCRIBER_BATCH_SIZE") or "100")
+# drain で 1 回の呼び出しで新しい topic の一覧を続ける時間[s] (Lambda のタイムアウトより短くする)
+SUBSCRIBER_DRAIN_TIMEOUT = float(os.environ.get("SUBSCRIBER_DRAIN_TIMEOUT") or "20")
+# キーの ULID の時刻からこの時間[ms]が経過していない topic は、先に採番された topic の書き込みが
+# 終わっていない可能性があるので処理しない (先に処理すると、後から届いた topic が最後のキーより前になり処理されない)
+SUBSCRIBER_SETTLE_MS = int(os.environ.get("SUBSCRIBER_SETTLE_MS") or "1000")
+# この大きさ[byte]を超える topic は読み込まずに、DB には response/ の参照を記録する
+# (response/ は SUBSCRIBER_COPY_MODE で書き込むので、topic の大きさに関係なくメモリに保持しない)
+# 適用した topic のキーを DB に記録しておく時間[s] (再送されたイベントの topic を再度適用しないため)
+# S3 のイベント通知の非同期呼び出しが再試行される最大の時間 (6 時間) より長くする
+SUBSCRIBER_APPLIED_TTL = int(os.environ.get("SUBSCRIBER_APPLIED_TTL") or str(7 * 60 * 60))
+SUBSCRIBER_INLINE_MAX_BYTES = int(os.environ.get("SUBSCRIBER_INLINE_MAX_BYTES") or str(256 * 1024))
+# まとめて書き込まれた topic の大きさ[byte]の上限 (ope ごとに DB に適用するので読み込んで保持する)
+# publisher は Lambda のペイロードの上限 (6MB) を超える topic を書き込めないので、それ以下にする
+# 超える topic は DB に適用せずにエラーを response/ に書き込む
+SUBSCRIBER_BATCH_MAX_BYTES = int(os.environ.get("SUBSCRIBER_BATCH_MAX_BYTES") or str(6 * 1024 * 1024))
+ULID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+# 1 回の呼び出しで並行に処理する topic の数
+SUBSCRIBER_MAX_WORKERS = int(os.environ.get("SUBSCRIBER_MAX_WORKERS") or "8")
+
+# topic を response/ に書き込む方式
+#   copy: 内容を変換しないので S3 のサーバー側でコピーする (Lambda はデータを読み込まない)
+#   stream: 内容を STREAM_CHUNK_SIZE ずつ読み込んで書き込む (変換が必要な場合やバケット間のコピーが許可されていない場合)
+#           MULTIPART_PART_SIZE を超える場合はマルチパートアップロードにするので、
+#           topic の大きさに関係なく保持するのは 1 パート分までになる
+COPY_MODE_COPY = "copy"
+COPY_MODE_STREAM = "stream"
+SUBSCRIBER_COPY_MODE = os.environ.get("SUBSCRIBER_COPY_MODE") or COPY_MODE_COPY
+STREAM_CHUNK_SIZE = 1024 * 1024
+# マルチパートアップロードの 1 パートの大きさ (S3 の下限は最後のパート以外 5MiB)
+MULTIPART_PART_SIZE = int(os.environ.get("MULTIPART_PART_SIZE") or str(8 * 1024 * 1024))
+# CopyObject でコピーできる上限 (超える場合は UploadPartCopy で分割してコピーする)
+COPY_OBJECT_MAX_SIZE = 5 * 1024 * 1024 * 1024
+COPY_PART_SIZE = 512 * 1024 * 1024
+
+# ------------------------------------------------------------------
+
+
+S3 = boto3.client("s3", config=Config(max_pool_connections=SUBSCRIBER_MAX_WORKERS))
+
+EXECUTOR = ThreadPoolExecutor(max_workers=SUBSCRIBER_MAX_WORKERS)
+
+# このコンテナで response/ をすべて書き込んだことを確認した DB の unsent
+CONFIRMED_UNSENT: list[dict] = []
+
+
+class Topic:
+    """処理する topic のオブジェクト
+
+    identifier は失敗を報告するときの識別子 (S3 のイベントの場合はキー、SQS 経由の場合は messageId)。"""
+
+    def __init__(self, identifier: str, bucket: str, key: str, size: int | None = None) -> None:
+        self.identifier = identifier
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        # まとめて書き込まれた topic の内容 (ope ごとの response/ を書き込むために保持する)
+        self.batch: dict | None = None
+        # 不正な topic の場合のエラー (DB には適用せず、エラーを response/ に書き込む)
+        self.error: str | None = None
+
+    @property
+    def is_batch(self) -> bool:
+        return self.key.endswith(TOPIC_BATCH_SUFFIX)
+
 
-    records = event["Records"]
+def convert_s3_records(records: list[dict], identifier: str | None = None) -> list[Topic]:
+    topics = []
     for record in records:
         s3_obj = record["s3"]
-        bucket = s3_obj["bucket"]["name"]
-        key: str = s3_obj["object"]["key"]
-        response = S3.get_object(Bucket=bucket, Key=key)
-        data = response["Body"].read()
-
-        response_key = "response/" + key.split("/")[-1]
-        S3.put_object(
-            Body=data, Bucket="async-api-sample--response-bucket", Key=response_key)
+        # イベントのキーは URL エンコードされている
+        key = unquote_plus(s3_obj["object"]["key"])
+        topics.append(Topic(identifier or key, s3_obj["bucket"]["name"], key, s3_obj["object"].get("size")))
+    return topics
+
+
+def convert_topics(event) -> tuple[list[Topic], bool]:
+    """イベントの topic と、SQS 経由のイベントかどうかを返す
+
+    S3 のイベント通知を直接受け取る場合と、SQS に送った通知を受け取る場合 (body が S3 のイベント) の両方に対応する。"""
+
+    topics: list[Topic] = []
+    from_sqs = False
+    for record in (event or {}).get("Records") or []:
+        if record.get("eventSource") == "aws:sqs":
+            from_sqs = True
+            body = json.loads(record["body"])
+            topics.extend(convert_s3_records(body.get("Records") or [], record["messageId"]))
+        else:
+            topics.extend(convert_s3_records([record]))
+    return topics, from_sqs
+
+
+def convert_topic_time(key: str) -> float | None:
+    """topic のキーのファイル名が ULID であれば、その時刻 (UNIX 時間[s]) を返す"""
+
+    name = key.split("/")[-1].split(".")[0]
+    if len(name) != 26 or any(c not in ULID_ALPHABET for c in name):
+        return None
+    ms = 0
+    for c in name[:10]:
+        ms = ms * 32 + ULID_ALPHABET.index(c)
+    return ms / 1000
+
+
+def convert_batch_topic_ids(topic: Topic, count: int) -> list[str]:
+    """まとめて書き込まれた topic の ope ごとの topic id を返す"""
+
+    first = 0
+    for c in topic.key.split("/")[-1][:26]:
+        first = first * 32 + ULID_ALPHABET.index(c)
+    return ["".join(ULID_ALPHABET[((first + i) >> (5 * n)) & 31] for n in range(25, -1, -1)) for i in range(count)]
+
+
+def load_db() -> dict:
+    """DB を読み込む
+
+    skey: 最後に適用した topic のキー (ファイル名が ULID の topic だけ)
+    data: 適用した topic の内容
+    applied: 適用した topic のキーと適用した時刻 (SUBSCRIBER_APPLIED_TTL の間だけ保持する)
+    unsent: 保存した後に response/ を書き込む topic ({"key": キー, "error": 不正な topic の場合のエラー})
+            (書き込みに失敗した場合は次の呼び出しで書き込む)"""
+
+    try:
+        body = S3.get_object(Bucket=DB_BUCKET_NAME, Key=DB_KEY)["Body"].read()
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            return {"skey": "", "data": [], "applied": {}, "unsent": []}
+        raise
+    db = json.loads(body)
+    db.setdefault("applied", {})
+    db["unsent"] = [{"key": u} if isinstance(u, str) else u for u in db.get("unsent") or []]
+    return db
+
+
+def prune_applied(db: dict) -> None:
+    expired = time.time() - SUBSCRIBER_APPLIED_TTL
+    db["applied"] = {key: at for key, at in db["applied"].items() if at >= expired}
+
+
+def save_db(db: dict) -> None:
+    S3.put_object(Body=json.dumps(db).encode(), Bucket=DB_BUCKET_NAME, Key=DB_KEY)
+
+
+def convert_response_key(topic: Topic) -> str:
+    return RESPONSE_FOLDER + topic.key.split("/")[-1]
+
+
+def convert_unsent(topic: Topic) -> dict:
+    return {"key": topic.key, **({"error": topic.error} if topic.error else {})}
+
+
+def convert_unsent_topic(unsent: dict) -> Topic:
+    topic = Topic(unsent["key"], TOPIC_BUCKET_NAME, unsent["key"])
+    topic.error = unsent.get("error")
+    return topic
+
+
+def read_topic(topic: Topic) -> bytes | None:
+    """topic の内容を返す (上限を超える場合は読み込まずに None を返す)
+
+    上限は SUBSCRIBER_INLINE_MAX_BYTES で、まとめて書き込まれた topic は ope ごとに適用するので
+    SUBSCRIBER_BATCH_MAX_BYTES までは読み込む。"""
+
+    max_bytes = SUBSCRIBER_BATCH_MAX_BYTES if topic.is_batch else SUBSCRIBER_INLINE_MAX_BYTES
+    if topic.size is not None and topic.size > max_bytes:
+        return None
+    response = S3.get_object(Bucket=topic.bucket, Key=topic.key)
+    if response["ContentLength"] > max_bytes:
+        response["Body"].close()
+        return None
+    return response["Body"].read()
+
+
+def convert_topic_opes(topic: Topic, body: bytes) -> list[dict]:
+    """topic の内容を適用する ope のリストに変換する (不正な場合は ValueError)
+
+    topic は dynamodb-ope-queue の ope と同じ形式 ({"m": "insert" | "drop", "d": data})。
+    まとめて書き込まれた topic は {"v": "1", "ops": [ope, ...]}。"""
+
+    data = json.loads(body or b"{}")
+    if topic.is_batch:
+        opes = data.get("ops") if isinstance(data, dict) else None
+        if not isinstance(opes, list) or not opes:
+            raise ValueError("invalid batch topic")
+    else:
+        opes = [data]
+    for ope in opes:
+        if not isinstance(ope, dict) or ope.get("m", "insert") not in ("insert", "drop"):
+            raise ValueError("invalid ope")
+    return opes
+
+
+def apply_ope(db: dict, ope: dict, body: bytes) -> None:
+    if ope.get("m") == "drop":
+        db["data"].clear()
+    else:
+        db["data"].append(ope["d"] if "d" in ope else body.decode())
+
+
+def apply_topic(db: dict, topic: Topic, body: bytes | None) -> None:
+    """topic を DB に適用して、適用した topic として記録する
+
+    m を省略した場合は insert、d を省略した場合は topic の内容をそのまま追加する。
+    まとめて書き込まれた topic は ops を順に適用する。
+    body が None (大きい topic) の場合は response/ の参照を追加する
+    (まとめて書き込まれた topic の場合は ope ごとに適用できないので、不正な topic とする)。
+    不正な topic は DB に適用せずに topic.error を設定し、エラーを response/ に書き込んで先に進む
+    (drain で同じ topic が毎回最初に一覧されて、以降の topic が処理されなくなるため)。"""
+
+    if body is None and topic.is_batch:
+        logger.warning({"msg": "invalid topic", "key": topic.key, "exception": "batch topic too large"})
+        topic.error = f"batch topic too large (> {SUBSCRIBER_BATCH_MAX_BYTES} bytes)"
+    elif body is None:
+        db["data"].append({"typ": "s3", "bucket": RESPONSE_BUCKET_NAME, "key": convert_response_key(topic)})
+    else:
+        try:
+            opes = convert_topic_opes(topic, body)
+        except ValueError as e:
+            logger.warning({"msg": "invalid topic", "key": topic.key, "exception": f"{e}"})
+            topic.error = f"{e}"
+            opes = []
+        if topic.is_batch and not topic.error:
+            topic.batch = {"ops": opes}
+        for ope in opes:
+            apply_ope(db, ope, body)
+
+    db["applied"][topic.key] = int(time.time())
+    if convert_topic_time(topic.key) is not None:
+        db["skey"] = max(db["skey"], topic.key)
+
+
+def copy_object(topic: Topic, dest_key: str) -> tuple[int, int]:
+    """topic を S3 のサーバー側でコピーして (バイト数, パート数) を返す"""
+
+    size = topic.size
+    if size is None:
+        size = S3.head_object(Bucket=topic.bucket, Key=topic.key)["ContentLength"]
+
+    source = {"Bucket": topic.bucket, "Key": topic.key}
+    if size <= COPY_OBJECT_MAX_SIZE:
+        S3.copy_object(CopySource=source, Bucket=RESPONSE_BUCKET_NAME, Key=dest_key)
+        return size, 1
+
+    upload_id = S3.create_multipart_upload(Bucket=RESPONSE_BUCKET_NAME, Key=dest_key)["UploadId"]
+    try:
+        parts = []
+        for number, offset in enumerate(range(0, size, COPY_PART_SIZE), start=1):
+            end = min(offset + COPY_PART_SIZE, size) - 1
+            response = S3.upload_part_copy(Bucket=RESPONSE_BUCKET_NAME, Key=dest_key, UploadId=upload_id,
+                                           PartNumber=number, CopySource=source,
+                                           CopySourceRange=f"bytes={offset}-{end}")
+            parts.append({"PartNumber": number, "ETag": response["CopyPartResult"]["ETag"]})
+        S3.complete_multipart_upload(Bucket=RESPONSE_BUCKET_NAME, Key=dest_key, UploadId=upload_id,
+                                     MultipartUpload={"Parts": parts})
+    except Exception:
+        S3.abort_multipart_upload(Bucket=RESPONSE_BUCKET_NAME, Key=dest_key, UploadId=upload_id)
+        raise
+    return size, len(parts)
+
+
+def stream_object(topic: Topic, dest_key: str, transform=None) -> tuple[int, int]:
+    """topic を STREAM_CHUNK_SIZE ずつ読み込んで (transform があれば変換して) 書き込み、(バイト数, パート数) を返す
+
+    MULTIPART_PART_SIZE に達するまでは PutObject 1 回で書き込み、
+    達した場合はマルチパートアップロードに切り替えて 1 パートずつ書き込む。"""
+
+    body = S3.get_object(Bucket=topic.bucket, Key=topic.key)["Body"]
+    buffer = bytearray()
+    upload_id = None
+    parts: list[dict] = []
+    size = 0
+
+    def upload_part(data: bytes) -> None:
+        response = S3.upload_part(Body=data, Bucket=RESPONSE_BUCKET_NAME, Key=dest_key, UploadId=upload_id,
+                                  PartNumber=len(parts) + 1)
+        parts.append({"PartNumber": len(parts) + 1, "ETag": response["ETag"]})
+
+    try:
+        for chunk in body.iter_chunks(STREAM_CHUNK_SIZE):
+            if transform:
+                chunk = transform(chunk)
+            buffer += chunk
+            size += len(chunk)
+            while len(buffer) >= MULTIPART_PART_SIZE:
+                if upload_id is None:
+                    upload_id = S3.create_multipart_upload(Bucket=RESPONSE_BUCKET_NAME, Key=dest_key)["UploadId"]
+                # パートの分だけを複製して送り、buffer には残りだけを残す
+                with memoryview(buffer) as view:
+                    upload_part(bytes(view[:MULTIPART_PART_SIZE]))
+                del buffer[:MULTIPART_PART_SIZE]
+
+        if upload_id is None:
+            S3.put_object(Body=bytes(buffer), Bucket=RESPONSE_BUCKET_NAME, Key=dest_key)
+            return size, 1
+
+        if buffer:
+            upload_part(bytes(buffer))
+        S3.complete_multipart_upload(Bucket=RESPONSE_BUCKET_NAME, Key=dest_key, UploadId=upload_id,
+                                     MultipartUpload={"Parts": parts})
+    except Exception:
+        if upload_id is not None:
+            S3.abort_multipart_upload(Bucket=RESPONSE_BUCKET_NAME, Key=dest_key, UploadId=upload_id)
+        raise
+    finally:
+        body.close()
+    return size, len(parts)
+
+
+def process_topic(topic: Topic) -> dict:
+    """topic の内容を response/ に保存して、処理の所要時間を返す"""
+
+    start = time.perf_counter()
+    response_key = convert_response_key(topic)
+    if SUBSCRIBER_COPY_MODE == COPY_MODE_STREAM:
+        size, parts = stream_object(topic, response_key)
+    else:
+        size, parts = copy_object(topic, response_key)
+    end = time.perf_counter()
+
+    return {
+        "key": topic.key,
+        "mode": SUBSCRIBER_COPY_MODE,
+        "bytes": size,
+        "parts": parts,
+        "total_ms": round((end - start) * 1000, 1),
+    }
+
+
+def process_batch_ope(topic: Topic, topic_id: str, ope: dict) -> dict:
+    """まとめて書き込まれた topic の 1 つの ope を response/{topic id}.json に保存して、処理の所要時間を返す"""
+
+    start = time.perf_counter()
+    body = json.dumps(ope, separators=(",", ":")).encode()
+    S3.put_object(Body=body, Bucket=RESPONSE_BUCKET_NAME, Key=RESPONSE_FOLDER + topic_id + ".json")
+    end = time.perf_counter()
+
+    return {
+        "key": topic.key,
+        "id": topic_id,
+        "mode": "batch",
+        "bytes": len(body),
+        "parts": 1,
+        "total_ms": round((end - start) * 1000, 1),
+    }
+
+
+def process_error(topic: Topic) -> dict:
+    """不正な topic のエラーを response/ に保存して、処理の所要時間を返す
+
+    まとめて書き込まれた topic の場合は ope の数がわからないので、先頭の topic id の response/ だけに保存する。"""
+
+    start = time.perf_counter()
+    response_key = (RESPONSE_FOLDER + topic.key.split("/")[-1][:26] + ".json" if topic.is_batch
+                    else convert_response_key(topic))
+    body = json.dumps({"status": "error", "message": topic.error}).encode()
+    S3.put_object(Body=body, Bucket=RESPONSE_BUCKET_NAME, Key=response_key)
+    end = time.perf_counter()
+
+    return {
+        "key": topic.key,
+        "mode": "error",
+        "bytes": len(body),
+        "parts": 1,
+        "total_ms": round((end - start) * 1000, 1),
+    }
+
+
+def write_responses(topics: list[Topic]) -> tuple[list[dict], list[Topic]]:
+    """topic の response/ を並行に書き込み、所要時間と失敗した topic を返す
+
+    まとめて書き込まれた topic は ope ごとに書き込み、1 つでも失敗した場合は topic の失敗とする。
+    topic ごとに独立しているので 1 つの失敗で他の topic の書き込みを止めない。"""
+
+    futures = []
+    failures: list[Topic] = []
+    for topic in topics:
+        if topic.error:
+            futures.append((topic, EXECUTOR.submit(process_error, topic)))
+            continue
+        if not topic.is_batch:
+            futures.append((topic, EXECUTOR.submit(process_topic, topic)))
+            continue
+        try:
+            if topic.batch is None:
+                # 前回の呼び出しで適用した topic (unsent) は読み込み直す (上限を超える topic は適用時にエラーにしている)
+                topic.batch = {"ops": convert_topic_opes(topic, read_topic(topic))}
+        except Exception as e:
+            logger.exception({"msg": "Failed", "key": topic.key, "exception": f"{e}"})
+            failures.append(topic)
+            continue
+        opes = topic.batch["ops"]
+        for topic_id, ope in zip(convert_batch_topic_ids(topic, len(opes)), opes):
+            futures.append((topic, EXECUTOR.submit(process_batch_ope, topic, topic_id, ope)))
+
+    timings = []
+    for topic, future in futures:
+        try:
+            timing = future.result()
+        except Exception as e:
+            logger.exception({"msg": "Failed", "key": topic.key, "exception": f"{e}"})
+            if topic not in failures:
+                failures.append(topic)
+            continue
+        logger.info({"msg": "topic processed", **timing})
+        timings.append(timing)
+    return timings, failures
+
+
+def apply_topics(db: dict, topics: list[Topic], in_order: bool) -> tuple[list[dict], list[Topic]]:
+    """topic を並行に読み込んでキーの順に DB に適用し、DB を 1 回だけ保存してから response/ をまとめて書き込む
+
+    in_order の場合は読み込みに失敗した topic 以降を適用しない (DB の最後のキーより前の topic は一覧されなくなるため)。
+    適用済みの topic (再送されたイベントの topic) は適用しない。
+    失敗した topic は読み込みと書き込みのどちらの場合も返す。"""
+
+    topics = sorted((t for t in topics if t.key not in db["applied"]), key=lambda t: t.key)
+    futures = [EXECUTOR.submit(read_topic, topic) for topic in topics]
+
+    applied: list[Topic] = []
+    failures: list[Topic] = []
+    for topic, future in zip(topics, futures):
+        if in_order and failures:
+            failures.append(topic)
+            continue
+        try:
+            body = future.result()
+        except Exception as e:
+            logger.exception({"msg": "Failed", "key": topic.key, "exception": f"{e}"})
+            failures.append(topic)
+            continue
+        apply_topic(db, topic, body)
+        applied.append(topic)
+
+    if not applied:
+        return [], failures
+
+    # 保存してから書き込むので、response/ があれば DB に適用済みになっている
+    # (unsent には前回までに書き込めなかった topic が残っている)
+    new_unsent = [convert_unsent(topic) for topic in applied]
+    saved_unsent = db["unsent"] + new_unsent
+    db["unsent"] = saved_unsent
+    prune_applied(db)
+    save_db(db)
+
+    global CONFIRMED_UNSENT
+    timings, write_failures = write_responses(applied)
+    if not write_failures and saved_unsent == new_unsent:
+        CONFIRMED_UNSENT = saved_unsent
+    failed_keys = {topic.key for topic in write_failures}
+    db["unsent"] = [u for u in saved_unsent if u not in new_unsent or u["key"] in failed_keys]
+    return timings, failures + write_failures
+
+
+def list_pending_topics(db: dict, start_after: str) -> tuple[list[Topic], str]:
+    """start_after より後のファイル名が ULID の未適用の topic と、次の一覧を始めるキーを返す"""
+
+    response = S3.list_objects_v2(Bucket=TOPIC_BUCKET_NAME, Prefix=TOPIC_FOLDER,
+                                  StartAfter=start_after or TOPIC_FOLDER, MaxKeys=SUBSCRIBER_BATCH_SIZE)
+    contents = response.get("Contents") or []
+    topics = [Topic(c["Key"], TOPIC_BUCKET_NAME, c["Key"], c["Size"])
+              for c in contents if convert_topic_time(c["Key"]) is not None and c["Key"] not in db["applied"]]
+    return topics, contents[-1]["Key"] if contents else start_after
+
+
+def drain_topics(db: dict) -> tuple[list[dict], list[Topic]]:
+    """DB の最後のキーより後の topic を SUBSCRIBER_BATCH_SIZE ずつ一覧し、一覧がなくなるまでまとめて適用する"""
+
+    deadline = time.monotonic() + SUBSCRIBER_DRAIN_TIMEOUT
+    timings: list[dict] = []
+    start_after = db["skey"]
+    while time.monotonic() < deadline:
+        pending, next_start_after = list_pending_topics(db, start_after)
+
+        # キーの順に適用するので、書き込み中の可能性がある topic より前の topic までを適用する
+        settled_until = time.time() - SUBSCRIBER_SETTLE_MS / 1000
+        topics = []
+        for topic in pending:
+            topic_time = convert_topic_time(topic.key)
+            if topic_time > settled_until:
+                # 新しい topic のイベントはこの呼び出しが終わるまでスロットリングされるので、待ってから処理する
+                time.sleep(max(0.0, min(topic_time - settled_until, deadline - time.monotonic())))
+                break
+            topics.append(topic)
+
+        if not topics:
+            if next_start_after == start_after:
+                break
+            if not pending:
+                # ファイル名が ULID ではない topic か適用済みの topic だけの場合は次の一覧に進む
+                start_after = next_start_after
+            continue
+
+        batch_timings, failures = apply_topics(db, topics, in_order=True)
+        timings.extend(batch_timings)
+        if failures:
+            return timings, failures
+        start_after = db["skey"]
+
+    return timings, []
+
+
+def handler(event, context):
+    # print(event)
+
+    topics, from_sqs = convert_topics(event)
+
+    start = time.perf_counter()
+    db = load_db()
+
+    # 前回の呼び出しが DB を保存した後に response/ を書き込めなかった可能性がある場合は書き込み直す (同じ内容で上書きするだけ)
+    # このコンテナで書き込みを確認済みであれば書き込まない
+    global CONFIRMED_UNSENT
+    if db["unsent"] and db["unsent"] != CONFIRMED_UNSENT:
+        unsent_failures = write_responses([convert_unsent_topic(u) for u in db["unsent"]])[1]
+        if not unsent_failures:
+            CONFIRMED_UNSENT = db["unsent"]
+        failed_keys = {topic.key for topic in unsent_failures}
+        db["unsent"] = [u for u in db["unsent"] if u["key"] in failed_keys]
+    else:
+        db["unsent"] = []
+
+    if SUBSCRIBER_MODE == SUBSCRIBER_MODE_DRAIN:
+        # ファイル名が ULID ではない topic と、最後のキー以前に遅れて書き込まれた topic (書き込みに SUBSCRIBER_SETTLE_MS
+        # より長くかかった場合) は一覧では処理されないので、イベントの topic として処理する (キーの順ではなくなる)
+        others = [topic for topic in topics if convert_topic_time(topic.key) is None or topic.key <= db["skey"]]
+        timings, failures = apply_topics(db, others, in_order=False)
+        drain_timings, drain_failures = drain_topics(db)
+        timings += drain_timings
+        failures += drain_failures
+    else:
+        timings, failures = apply_topics(db, topics, in_order=False)
+
+    # 適用した topic は再送されても適用しないが、失敗として報告するのはイベントの topic のうち適用されていないものだけにする
+    # (response/ の書き込みに失敗した topic は unsent から次の呼び出しで書き込む。
+    #  一覧で処理して失敗した topic は、その topic のイベントで再試行される)
+    if failures:
+        logger.warning({"msg": "failed topics", "keys": [t.key for t in failures]})
+    failures = [topic for topic in topics if topic.key not in db["applied"]]
+
+    logger.info({
+        "msg": "batch processed",
+        "request_id": getattr(context, "aws_request_id", ""),
+        "mode": SUBSCRIBER_MODE,
+        "records": len(topics),
+        "processed": len(timings),
+        "failed": len(failures),
+        "total_ms": round((time.perf_counter() - start) * 1000, 1),
+        # 逐次に処理した場合の所要時間の目安
+        "sum_ms": round(sum(t["total_ms"] for t in timings), 1),
+    })
+
+    if failures and not from_sqs:
+        # S3 のイベント通知は非同期呼び出しなので、例外で Lambda に再試行させる
+        # (適用済みの topic は再試行でも適用しない)
+        raise Exception(f"failed topics : {[t.key for t in failures]}")
+
     return {
         'statusCode': 200,
-        'body': 'Hello, CDK!'
+        'body': json.dumps({"records": timings}),
+        # SQS 経由の場合は失敗したメッセージだけを再試行させる (ReportBatchItemFailures)
+        'batchItemFailures': [{"itemIdentifier": i} for i in dict.fromkeys(t.identifier for t in failures)],
     }
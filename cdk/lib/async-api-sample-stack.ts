@@ -53,7 +53,20 @@ export class AsyncApiSampleStack extends cdk.Stack {
 
     // api.addRoutes({
     //   path: "/s3",
-    //   methods: [apigw.HttpMethod.POST, apigw.HttpMethod.GET],
+    //   methods: [apigw.HttpMethod.POST, apigw.HttpMethod.GET, apigw.HttpMethod.DELETE],
+    //   integration: s3PubSubIntegration.integration,
+    // });
+
+    // // publish した topic の結果 (response/{topic id}.json) を待つ
+    // // (/s3/responses は ids パラメーターで複数の topic id をまとめて待つ)
+    // api.addRoutes({
+    //   path: "/s3/responses/{topicId}",
+    //   methods: [apigw.HttpMethod.GET],
+    //   integration: s3PubSubIntegration.integration,
+    // });
+    // api.addRoutes({
+    //   path: "/s3/responses",
+    //   methods: [apigw.HttpMethod.GET],
     //   integration: s3PubSubIntegration.integration,
     // });
 
@@ -72,5 +85,24 @@ export class AsyncApiSampleStack extends cdk.Stack {
       ],
       integration: dynamoDbOpeQueueIntegration.integration,
     });
+
+    // オブジェクトごとのキュー (cky: ${system_name}:${object_path})
+    api.addRoutes({
+      path: "/dy-queue/objects/{object+}",
+      methods: [
+        apigw.HttpMethod.POST,
+        apigw.HttpMethod.GET,
+        apigw.HttpMethod.DELETE,
+      ],
+      integration: dynamoDbOpeQueueIntegration.integration,
+    });
+
+    // submit=async で書き込んだ ope の結果
+    // (オブジェクトの ope は /dy-queue/objects/{object+} の GET で /ops/{skey} を受け付ける)
+    api.addRoutes({
+      path: "/dy-queue/ops/{skey}",
+      methods: [apigw.HttpMethod.GET],
+      integration: dynamoDbOpeQueueIntegration.integration,
+    });
   }
 }
@@ -4,9 +4,14 @@ import * as s3 from "aws-cdk-lib/aws-s3";
 import * as dynamodb from "aws-cdk-lib/aws-dynamodb";
 import * as lambda from "aws-cdk-lib/aws-lambda";
 import * as iam from "aws-cdk-lib/aws-iam";
+import { DynamoEventSource } from "aws-cdk-lib/aws-lambda-event-sources";
 import { HttpLambdaIntegration } from "aws-cdk-lib/aws-apigatewayv2-integrations";
 import * as path from "path";
 
+// ope の適用方式 (race or group or stream)
+// stream の場合は DynamoDB Streams から ope を適用する applier を作成する
+const OPE_APPLY_MODE: string = "race";
+
 export class DynamoDbOpeQueueIntegration {
   public integration: HttpLambdaIntegration;
   constructor(scope: Construct, prefix: string) {
@@ -20,8 +25,19 @@ export class DynamoDbOpeQueueIntegration {
           id: prefix + "DeleteExpiredData",
           enabled: true,
           prefix: "snapshot/",
+          // 公開中のスナップショット (pub=1) は削除しない
+          tagFilters: { pub: "0" },
           expiration: cdk.Duration.days(1),
         },
+        {
+          id: prefix + "DeleteExpiredBase",
+          enabled: true,
+          prefix: "base/",
+          // 公開中のスナップショットが参照している base (pub=1) は削除しない
+          // (公開されなかったスナップショットより後に削除されるように期間を長くする)
+          tagFilters: { pub: "0" },
+          expiration: cdk.Duration.days(2),
+        },
       ],
     });
 
@@ -44,6 +60,11 @@ export class DynamoDbOpeQueueIntegration {
       // TTL データを格納する属性
       timeToLiveAttribute: "expired",
       removalPolicy: cdk.RemovalPolicy.DESTROY,
+      // stream の場合は ope の書き込みを applier に通知する (どのオブジェクトに書き込まれたかだけを使う)
+      stream:
+        OPE_APPLY_MODE === "stream"
+          ? dynamodb.StreamViewType.KEYS_ONLY
+          : undefined,
     });
 
     const layer = new lambda.LayerVersion(scope, prefix + "OpeFunctionLayer", {
@@ -54,24 +75,49 @@ export class DynamoDbOpeQueueIntegration {
       license: "MIT",
     });
 
+    const code = lambda.Code.fromAsset(
+      path.join(__dirname, "../../lambda/dynamodb-ope-queue"),
+      {
+        exclude: ["layer", "bench"],
+      }
+    );
+
+    const environment = {
+      DYNAMODB_TABLE_NAME: opeQueueDynamoDb.tableName,
+      DYNAMODB_CHUNK_KEY_NAME: "ckey",
+      DYNAMODB_SORT_KEY_NAME: "skey",
+      DYNAMODB_TTL_ITEM_NAME: "expired",
+      S3_BUKET_NAME: dbBucket.bucketName,
+      // /dy-queue/objects/{object+} のオブジェクトの cky (${system_name}:${object_path}) の system_name
+      OBJECT_SYSTEM_NAME: "async-api-sample",
+      // watermark or sleep
+      OPE_COMMIT_WAIT_MODE: "watermark",
+      OPE_COMMIT_WAIT_SLEEP: "0.05",
+      // race or group or stream
+      OPE_APPLY_MODE: OPE_APPLY_MODE,
+      // sync or async (クエリパラメータ submit で呼び出しごとに指定することもできる)
+      SUBMIT_MODE: "sync",
+      // ope の結果の TTL[s] (async のときに結果を取得できる期間)
+      RESULT_TTL: "300",
+      // full or delta
+      SNAPSHOT_FORMAT: "delta",
+      // json or binary
+      SNAPSHOT_CODEC: "json",
+      // pointer or copy
+      PUBLISH_MODE: "pointer",
+      // db.json を読む既存の利用者のために非同期で db.json を更新する (none or async)
+      DB_JSON_SYNC: "async",
+      // 呼び出しごとにフェーズと API 呼び出しの所要時間のサマリーを出力する
+      TRACE_ENABLED: "true",
+      LOG_LEVEL: "INFO",
+    };
+
     const lambdaFunction = new lambda.Function(scope, prefix + "OpeFunction", {
       functionName: prefix + "ope-function",
       runtime: lambda.Runtime.PYTHON_3_12,
       handler: "main.handler",
-      code: lambda.Code.fromAsset(
-        path.join(__dirname, "../../lambda/dynamodb-ope-queue"),
-        {
-          exclude: ["layer"],
-        }
-      ),
-      environment: {
-        DYNAMODB_TABLE_NAME: opeQueueDynamoDb.tableName,
-        DYNAMODB_CHUNK_KEY_NAME: "ckey",
-        DYNAMODB_SORT_KEY_NAME: "skey",
-        DYNAMODB_TTL_ITEM_NAME: "expired",
-        S3_BUKET_NAME: dbBucket.bucketName,
-        LOG_LEVEL: "INFO",
-      },
+      code: code,
+      environment: environment,
       layers: [layer],
       memorySize: 256,
       timeout: cdk.Duration.seconds(10),
@@ -79,7 +125,7 @@ export class DynamoDbOpeQueueIntegration {
 
     const writePolicy = new iam.PolicyStatement({
       effect: iam.Effect.ALLOW,
-      actions: ["s3:PutObject"],
+      actions: ["s3:PutObject", "s3:PutObjectTagging"],
       resources: [dbBucket.bucketArn + "/*"],
     });
 
@@ -102,9 +148,87 @@ export class DynamoDbOpeQueueIntegration {
     lambdaFunction.addToRolePolicy(writePolicy);
     lambdaFunction.addToRolePolicy(listPolicy);
 
+    // DB_JSON_SYNC=async / SUBMIT_MODE=async のときに自身を非同期で呼び出す
+    // (lambdaFunction.functionArn を参照すると循環参照になるので ARN を組み立てる)
+    const invokeSelfPolicy = new iam.PolicyStatement({
+      effect: iam.Effect.ALLOW,
+      actions: ["lambda:InvokeFunction"],
+      resources: [
+        cdk.Stack.of(scope).formatArn({
+          service: "lambda",
+          resource: "function",
+          resourceName: prefix + "ope-function",
+          arnFormat: cdk.ArnFormat.COLON_RESOURCE_NAME,
+        }),
+      ],
+    });
+    lambdaFunction.addToRolePolicy(invokeSelfPolicy);
+
     // Lambda に DynamoDB の読み書きアクセス権限を付与
     opeQueueDynamoDb.grantReadWriteData(lambdaFunction);
 
+    if (OPE_APPLY_MODE === "stream") {
+      // DynamoDB Streams のシャードごとに 1 つずつ順番に呼び出され、ope をまとめて適用する
+      const applierFunction = new lambda.Function(
+        scope,
+        prefix + "ApplierFunction",
+        {
+          functionName: prefix + "applier-function",
+          runtime: lambda.Runtime.PYTHON_3_12,
+          handler: "applier.handler",
+          code: code,
+          environment: environment,
+          layers: [layer],
+          memorySize: 512,
+          timeout: cdk.Duration.seconds(30),
+        }
+      );
+
+      applierFunction.addToRolePolicy(readPolicy);
+      applierFunction.addToRolePolicy(writePolicy);
+      applierFunction.addToRolePolicy(listPolicy);
+      // DB_JSON_SYNC=async のときは applier も自身を非同期で呼び出す
+      applierFunction.addToRolePolicy(
+        new iam.PolicyStatement({
+          effect: iam.Effect.ALLOW,
+          actions: ["lambda:InvokeFunction"],
+          resources: [
+            cdk.Stack.of(scope).formatArn({
+              service: "lambda",
+              resource: "function",
+              resourceName: prefix + "applier-function",
+              arnFormat: cdk.ArnFormat.COLON_RESOURCE_NAME,
+            }),
+          ],
+        })
+      );
+      opeQueueDynamoDb.grantReadWriteData(applierFunction);
+
+      applierFunction.addEventSource(
+        new DynamoEventSource(opeQueueDynamoDb, {
+          startingPosition: lambda.StartingPosition.LATEST,
+          batchSize: 100,
+          maxBatchingWindow: cdk.Duration.millis(0),
+          // 同じシャードのバッチを並行に処理しない (オブジェクトごとに 1 つの applier にする)
+          parallelizationFactor: 1,
+          retryAttempts: 10,
+          // 失敗したオブジェクトの最初のレコードから再試行する
+          reportBatchItemFailures: true,
+          // ope の INSERT のレコードだけを受け取る
+          filters: [
+            lambda.FilterCriteria.filter({
+              eventName: lambda.FilterRule.isEqual("INSERT"),
+              dynamodb: {
+                Keys: {
+                  ckey: { S: [{ suffix: "_OPE" }] },
+                },
+              },
+            }),
+          ],
+        })
+      );
+    }
+
     const integration = new HttpLambdaIntegration(
       prefix + "DynamoDbOpeQueueLambdaIntegration",
       lambdaFunction
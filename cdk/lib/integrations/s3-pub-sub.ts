@@ -40,6 +40,14 @@ export class S3PubSubIntegration {
       ],
     });
 
+    // Sub. Lambda が topic を適用する DB
+    const dbBucket = new s3.Bucket(scope, prefix + "DbBucket", {
+      bucketName: prefix + "db-bucket",
+      versioned: false,
+      // 検証環境で削除ができるように指定する
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
     const subscriberFunction = new lambda.Function(
       scope,
       prefix + "SubscriberFunction",
@@ -48,8 +56,29 @@ export class S3PubSubIntegration {
         runtime: lambda.Runtime.PYTHON_3_12,
         handler: "main.handler",
         code: lambda.Code.fromAsset(
-          path.join(__dirname, "../../lambda/subscriber")
+          path.join(__dirname, "../../lambda/subscriber"),
+          {
+            exclude: ["bench"],
+          }
         ),
+        environment: {
+          TOPIC_BUCKET_NAME: bucket.bucketName,
+          RESPONSE_BUCKET_NAME: responseBucket.bucketName,
+          DB_BUCKET_NAME: dbBucket.bucketName,
+          // drain: 最後に処理した topic より後の topic/ を一覧してまとめて処理する / event: イベントの topic だけを処理する
+          SUBSCRIBER_MODE: "drain",
+          SUBSCRIBER_BATCH_SIZE: "100",
+          // タイムアウトより短くする
+          SUBSCRIBER_DRAIN_TIMEOUT: "20",
+          // publisher の PUBLISHER_PUT_TIMEOUT より長くする (ほとんどの書き込み中の topic を追い越して処理しないように)
+          SUBSCRIBER_SETTLE_MS: "3000",
+          // 1 回の呼び出しで並行に処理する topic の数
+          SUBSCRIBER_MAX_WORKERS: "8",
+          // copy: サーバー側でコピーする / stream: 分割して読み込み、大きい場合はマルチパートアップロードで書き込む
+          SUBSCRIBER_COPY_MODE: "copy",
+          LOG_LEVEL: "INFO",
+        },
+        timeout: cdk.Duration.seconds(30),
         // 同時実行数を1に制限
         reservedConcurrentExecutions: 1,
       }
@@ -63,16 +92,32 @@ export class S3PubSubIntegration {
         runtime: lambda.Runtime.PYTHON_3_12,
         handler: "main.handler",
         code: lambda.Code.fromAsset(
-          path.join(__dirname, "../../lambda/publisher")
+          path.join(__dirname, "../../lambda/publisher"),
+          {
+            exclude: ["bench"],
+          }
         ),
-        // 同時実行数を1に制限
-        reservedConcurrentExecutions: 1,
+        environment: {
+          TOPIC_BUCKET_NAME: bucket.bucketName,
+          RESPONSE_BUCKET_NAME: responseBucket.bucketName,
+          // 1 回のリクエストで受け付ける ope の数 (複数の場合は 1 つの topic にまとめて書き込む)
+          PUBLISHER_MAX_OPES: "100",
+          // GET /s3/responses で response/ を待つ時間の上限[s] (API Gateway の 30s とタイムアウトより短くする)
+          PUBLISHER_POLL_TIMEOUT: "25",
+          // topic/ の書き込みの接続と応答の待ち時間を打ち切る時間[s] (subscriber の SUBSCRIBER_SETTLE_MS より短くする、本文の送信は打ち切れない)
+          PUBLISHER_PUT_TIMEOUT: "2",
+          LOG_LEVEL: "INFO",
+        },
+        timeout: cdk.Duration.seconds(29),
+        // topic の書き込みは並行にできるので、同時実行数は制限しない
+        // (順番は topic id の ULID で決まり、書き込みは PUBLISHER_PUT_TIMEOUT で打ち切るのでほとんどの場合 subscriber が追い越さない)
       }
     );
 
     const writePolicy = new iam.PolicyStatement({
       effect: iam.Effect.ALLOW,
-      actions: ["s3:PutObject"],
+      // マルチパートアップロードを中断したときにアップロード済みのパートを破棄する
+      actions: ["s3:PutObject", "s3:AbortMultipartUpload"],
       resources: [responseBucket.bucketArn + "/*"],
     });
 
@@ -84,9 +129,41 @@ export class S3PubSubIntegration {
 
     subscriberFunction.addToRolePolicy(readPolicy);
     subscriberFunction.addToRolePolicy(writePolicy);
+    // 未処理の topic を一覧する
+    subscriberFunction.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["s3:ListBucket"],
+        resources: [bucket.bucketArn],
+      })
+    );
+    dbBucket.grantReadWrite(subscriberFunction);
 
     publisherFunction.addToRolePolicy(readPolicy);
     publisherFunction.addToRolePolicy(writePolicy);
+    // response/ を待つ
+    publisherFunction.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["s3:GetObject"],
+        resources: [responseBucket.bucketArn + "/response/*"],
+      })
+    );
+    publisherFunction.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["s3:ListBucket"],
+        resources: [responseBucket.bucketArn],
+      })
+    );
+    // topic/ に publish する
+    publisherFunction.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ["s3:PutObject"],
+        resources: [bucket.bucketArn + "/topic/*"],
+      })
+    );
 
     bucket.addEventNotification(
       s3.EventType.OBJECT_CREATED_PUT,
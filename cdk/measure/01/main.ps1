@@ -1,3 +1,7 @@
+# API_URL_BASE に API Gateway のステージの URL を設定しておく
+# (async-api-sample-stack.ts で S3PubSubIntegration と /s3/responses のルートを有効にしておく。
+#  未設定の場合は response/ を 1 秒ごとに一覧して確認する)
+$apiUrlBase = $env:API_URL_BASE
 
 try {
     Push-Location $PSScriptRoot
@@ -9,25 +13,59 @@ try {
 
     Write-Host "********** upload ************"
 
-    . .\upload-10-topic.ps1
+    $topicIds = @(. .\upload-10-topic.ps1)
 
     
     Write-Host "********** check reponse ************"
 
     $m = Measure-Command {
 
-        foreach ($i in (1..600)) {
-            
-            Start-Sleep -Seconds 1
+        $done = $false
 
-            $r = aws s3 ls "s3://async-api-sample--response-bucket/response/" --summarize
-            $r_count = $($($r | Select-String "Total Objects") -match "\d+" | Out-Null; [int]($Matches[0]))
+        # response/ を一覧し続ける代わりに、Pub. Lambda の GET /s3/responses で
+        # すべての topic の結果が書き込まれるまで待つ (待ちきれなかった場合は 202 が返るので再度待つ)
+        # API_URL_BASE が未設定か、ルートが有効になっていない (404) 場合は response/ の一覧で確認する
+        if ($apiUrlBase) {
+            foreach ($i in (1..30)) {
 
-            Write-Host "check $i : count $r_count"
-            Write-Host $r
+                try {
+                    $r = Invoke-WebRequest -Uri "$apiUrlBase/s3/responses?ids=$($topicIds -join ',')" -SkipHttpErrorCheck
+                }
+                catch {
+                    Write-Host "GET /s3/responses failed : $_"
+                    break
+                }
 
-            if ($r_count -ge 10) {
-                break
+                if ($r.StatusCode -eq 404) {
+                    Write-Host "GET /s3/responses is not enabled (404)"
+                    break
+                }
+
+                $pending = ($r.Content | ConvertFrom-Json).pending
+
+                Write-Host "check $i : status $($r.StatusCode) pending $pending"
+
+                if ($r.StatusCode -eq 200) {
+                    $done = $true
+                    break
+                }
+            }
+        }
+
+        if (-not $done) {
+            foreach ($i in (1..600)) {
+
+                Start-Sleep -Seconds 1
+
+                $r = aws s3 ls "s3://async-api-sample--response-bucket/response/" --summarize
+                $r_count = $($($r | Select-String "Total Objects") -match "\d+" | Out-Null; [int]($Matches[0]))
+
+                Write-Host "check $i : count $r_count"
+                Write-Host $r
+
+                if ($r_count -ge $topicIds.Count) {
+                    break
+                }
             }
         }
     }
@@ -40,4 +78,3 @@ try {
 catch {
     Pop-Location
 }
-
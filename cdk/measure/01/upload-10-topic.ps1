@@ -1,8 +1,17 @@
 function Invoke-Parallel {
     1..10 | ForEach-Object -Parallel {
-        $filename = "$(New-Guid).json"
+        # Sub. Lambda (SUBSCRIBER_MODE=drain) は topic をキーの順に処理するので、採番順にソートできる ULID をキーにする
+        $alphabet = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+        $time = [DateTimeOffset]::UtcNow.ToUnixTimeMilliseconds()
+        $ulid = -join @(
+            (9..0 | ForEach-Object { $alphabet[($time -shr (5 * $_)) -band 31] })
+            (1..16 | ForEach-Object { $alphabet[(Get-Random -Maximum 32)] })
+        )
+        $filename = "$ulid.json"
         Write-Output '{}' | aws s3 cp - "s3://async-api-sample--api-bucket/topic/$filename"
         Write-Host "$_ : $filename"
+        # 結果を待つために topic id を返す
+        Write-Output $ulid
     } -ThrottleLimit 10
 }
 Invoke-Parallel
@@ -0,0 +1,505 @@
+"""CloudWatch Logs Insights のエクスポート (logs-insights-results*.json) の解析
+
+エクスポートを 1 レコードずつ読み込み (ファイル全体をメモリに載せない)、
+@logStream ごとに START / END / REPORT の RequestId で区切って 1 回の呼び出しにまとめる。
+呼び出しの中のログは以下の 2 つの形式に対応する。
+
+- 旧形式: "[debug] : ${data} : ${event} : ${value}"
+- 現行の形式: Lambda の Python ランタイムの "[INFO]\\t${time}\\t${RequestId}\\t{'msg': ...}"
+  ("trace summary" があればそのフェーズの時間を使用する)
+
+出力する内容
+- フェーズごとのレイテンシのヒストグラム (コールドスタート / ウォームスタート別)
+- 同じ data を持つ呼び出し (再試行など)
+- 欠落した ope: 自分の ope より前にコミットされていたのに、取得した ope に含まれていなかった ope
+- skey の巻き戻り: 公開済みより古いスナップショットを読み込んだ / 公開した呼び出し
+
+python research/log_analysis.py research/logs-insights-results.json research/logs-insights-results_2.json"""
+
+import argparse
+import ast
+import bisect
+import json
+import re
+import sys
+from array import array
+from datetime import datetime
+
+# 1 回に読み込むバイト数
+READ_CHUNK_SIZE = 1024 * 1024
+
+RE_START = re.compile(r"^START RequestId: (\S+)")
+RE_END = re.compile(r"^END RequestId: (\S+)")
+RE_REPORT = re.compile(r"^REPORT RequestId: (\S+)\tDuration: ([\d.]+) ms")
+RE_INIT_DURATION = re.compile(r"Init Duration: ([\d.]+) ms")
+RE_DEBUG = re.compile(r"^\[debug\] : (.*?) : (.+?) : (.*)$", re.DOTALL)
+RE_STRUCTURED = re.compile(r"^\[(\w+)\]\t(\S+)\t(\S+)\t(\{.*\})\s*$", re.DOTALL)
+
+# 旧形式のイベントの出力順
+# Logs Insights は同じ時刻のレコードの順序を保証しないので、同じ時刻の場合はこの順で並べる
+LEGACY_EVENTS = ["loaded db", "new skey", "write ope", "query ope",
+                 "snap db", "write db", "query last db", "save db", "cp db"]
+# 旧形式のイベントと、直前のイベントからそのイベントまでの時間を割り当てるフェーズ
+# 旧形式には query の前の待機 (sleep) のログがないので wait は query に含まれる
+LEGACY_EVENT_PHASES = {
+    "loaded db": "load",
+    "new skey": "load",
+    "write ope": "put_ope",
+    "query ope": "query",
+    "snap db": "apply",
+    "write db": "save",
+    "query last db": "save",
+    "save db": "publish",
+    "cp db": "publish",
+}
+
+PHASES = ["put_ope", "wait", "query", "load", "apply", "save", "publish", "other"]
+
+# ヒストグラムの区切り[ms]
+HISTOGRAM_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+# ------------------------------------------------------------------
+
+
+def iter_records(path: str):
+    """エクスポートの JSON 配列 (または JSON Lines) のレコードを 1 件ずつ返す"""
+
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+        while True:
+            # 区切り文字を読み飛ばす
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,[]":
+                pos += 1
+
+            if pos >= len(buffer):
+                if eof:
+                    return
+                buffer = f.read(READ_CHUNK_SIZE)
+                pos = 0
+                eof = not buffer
+                continue
+
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # レコードの途中でバッファが終わっているので続きを読み込む
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+
+            yield record
+            pos = end
+
+
+def parse_timestamp(value: str) -> float:
+    """"2024-03-02 05:12:17.637" を UNIX 時間[s]に変換する"""
+    return datetime.fromisoformat(value.replace("Z", "")).timestamp()
+
+
+# ------------------------------------------------------------------
+
+
+class Invocation:
+    """1 回の Lambda の呼び出し"""
+
+    __slots__ = ("rid", "stream", "start", "end", "duration", "init",
+                 "data", "events", "summary", "own", "written", "loaded", "queried",
+                 "published", "complete")
+
+    def __init__(self, rid: str, stream: str) -> None:
+        self.rid = rid
+        self.stream = stream
+        self.start: float | None = None
+        self.end: float | None = None
+        self.duration: float | None = None
+        self.init: float | None = None
+        self.data: set[str] = set()
+        # (時刻, イベント, 値)
+        self.events: list[tuple[float, str, str]] = []
+        self.summary: dict | None = None
+        self.own = ""
+        self.written: float | None = None
+        self.loaded: str | None = None
+        self.queried: set[str] = set()
+        # (時刻, skey)
+        self.published: list[tuple[float, str]] = []
+        self.complete = False
+
+    @property
+    def cold(self) -> bool:
+        return self.init is not None
+
+    def add_debug(self, ts: float, data: str, event: str, value: str) -> None:
+        value = value.strip()
+        if data:
+            self.data.add(data)
+        self.events.append((ts, event, value))
+
+        if event == "new skey":
+            self.own = value
+        elif event == "write ope":
+            self.own = value
+            self.written = ts
+        elif event == "loaded db":
+            self.loaded = "" if value == "None" else value
+        elif event == "query ope":
+            self.queried.update(v for v in value.split(",") if v)
+        elif event in ("save db", "cp db"):
+            self.published.append((ts, value))
+
+    def add_structured(self, ts: float, message: dict) -> None:
+        msg = message.get("msg") or ""
+        if message.get("data"):
+            self.data.add(str(message["data"]))
+
+        if msg == "trace summary":
+            self.summary = message
+        elif msg in ("put to dynamodb with watermark - after", "put to dynamodb - after"):
+            self.own = message.get("skey") or ""
+            self.written = ts
+        elif msg == "query items":
+            self.queried.update(message.get("skeys") or [])
+        elif msg.startswith("load snapshot - "):
+            self.loaded = message.get("skey") or message.get("cur") or ""
+        elif msg == "check current db skey from dynamo - after":
+            self.published.append((ts, message.get("cur") or ""))
+
+    def phases(self) -> dict[str, float]:
+        """フェーズごとの時間[ms]"""
+
+        if self.summary:
+            phases = dict(self.summary.get("phases") or {})
+            phases["other"] = self.summary.get("other_ms") or 0.0
+            return phases
+
+        phases: dict[str, float] = {}
+        order = {e: i for i, e in enumerate(LEGACY_EVENTS)}
+        events = sorted(self.events, key=lambda e: (e[0], order.get(e[1], len(order))))
+        prev = self.start if self.start is not None else (events[0][0] if events else None)
+        for ts, event, _ in events:
+            phase = LEGACY_EVENT_PHASES.get(event, "other")
+            phases[phase] = phases.get(phase, 0.0) + (ts - prev) * 1000
+            prev = ts
+        if self.end is not None and prev is not None:
+            phases["other"] = phases.get("other", 0.0) + (self.end - prev) * 1000
+        return phases
+
+
+class StreamAssembler:
+    """@logStream ごとにレコードを呼び出しにまとめる
+
+    1 つのログストリーム (= 1 つの実行環境) では呼び出しが直列に行われるので、
+    START / END / REPORT の間のレコードはその RequestId の呼び出しのものになる。
+    エクスポートは時刻の降順・昇順のどちらでもよい。"""
+
+    def __init__(self) -> None:
+        self.open: dict[str, Invocation] = {}
+        # 区切りのレコードより前に現れたレコード (エクスポートの範囲の端)
+        self.orphans: dict[str, Invocation] = {}
+        self.init_pending: set[str] = set()
+
+    def _invocation(self, stream: str, rid: str) -> tuple[Invocation, Invocation | None]:
+        """rid の呼び出しと、それによって閉じられる呼び出しを返す"""
+
+        closed = None
+        inv = self.open.get(stream)
+        if inv is not None and inv.rid != rid:
+            closed = inv
+            inv = None
+        if inv is None:
+            inv = Invocation(rid, stream)
+            # 呼び出しが分かる前のレコードを引き継ぐ
+            if (orphan := self.orphans.pop(stream, None)):
+                inv.events.extend(orphan.events)
+                inv.data.update(orphan.data)
+                inv.queried.update(orphan.queried)
+                inv.published.extend(orphan.published)
+                inv.summary = inv.summary or orphan.summary
+                inv.own = inv.own or orphan.own
+                inv.written = inv.written or orphan.written
+                inv.loaded = inv.loaded if inv.loaded is not None else orphan.loaded
+            self.open[stream] = inv
+        return inv, closed
+
+    def add(self, record: dict):
+        """レコードを追加し、完了した呼び出しを返す"""
+
+        message = record.get("@message") or ""
+        stream = record.get("@logStream") or ""
+        ts = parse_timestamp(record["@timestamp"])
+
+        if message.startswith("INIT_START"):
+            # 降順の場合は START の後、昇順の場合は START の前に現れる
+            inv = self.open.get(stream)
+            if inv is not None and inv.start is not None and inv.end is not None:
+                inv.init = inv.init or 0.0
+            else:
+                self.init_pending.add(stream)
+            return
+
+        for pattern, kind in ((RE_START, "start"), (RE_END, "end"), (RE_REPORT, "report")):
+            if (m := pattern.match(message)):
+                inv, closed = self._invocation(stream, m.group(1))
+                if kind == "start":
+                    inv.start = ts
+                    if stream in self.init_pending:
+                        self.init_pending.discard(stream)
+                        inv.init = inv.init or 0.0
+                elif kind == "end":
+                    inv.end = ts
+                else:
+                    inv.duration = float(m.group(2))
+                    if (init := RE_INIT_DURATION.search(message)):
+                        inv.init = float(init.group(1))
+                    if inv.end is None:
+                        inv.end = ts
+
+                if inv.start is not None and inv.end is not None and inv.duration is not None:
+                    inv.complete = True
+                if closed is not None:
+                    yield closed
+                return
+
+        inv = self.open.get(stream)
+        if inv is None or inv.complete:
+            # 前後の区切りが閉じた後のレコードは次の呼び出しのもの
+            if inv is not None:
+                yield self.open.pop(stream)
+            inv = self.orphans.get(stream) or Invocation("", stream)
+            self.orphans[stream] = inv
+
+        if (m := RE_DEBUG.match(message)):
+            inv.add_debug(ts, m.group(1).strip(), m.group(2).strip(), m.group(3))
+        elif (m := RE_STRUCTURED.match(message)):
+            try:
+                parsed = ast.literal_eval(m.group(4))
+            except (ValueError, SyntaxError):
+                return
+            if isinstance(parsed, dict):
+                inv.add_structured(ts, parsed)
+
+    def flush(self):
+        yield from self.open.values()
+        yield from self.orphans.values()
+        self.open.clear()
+        self.orphans.clear()
+
+
+# ------------------------------------------------------------------
+
+
+class Histogram:
+    """レイテンシの分布 (値はコンパクトな配列で保持する)"""
+
+    def __init__(self) -> None:
+        self.values = array("d")
+
+    def add(self, value: float) -> None:
+        self.values.append(value)
+
+    def percentile(self, sorted_values: list[float], p: float) -> float:
+        if not sorted_values:
+            return 0.0
+        index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+        return sorted_values[index]
+
+    def stats(self) -> dict:
+        values = sorted(self.values)
+        buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        for v in values:
+            buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, v)] += 1
+        return {
+            "n": len(values),
+            "p50": round(self.percentile(values, 50), 2),
+            "p90": round(self.percentile(values, 90), 2),
+            "p99": round(self.percentile(values, 99), 2),
+            "max": round(values[-1], 2) if values else 0.0,
+            "buckets": buckets,
+        }
+
+
+class Analysis:
+    """呼び出しごとの集計と、呼び出しをまたいだ異常の検出"""
+
+    def __init__(self) -> None:
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        self.invocations = 0
+        self.incomplete = 0
+        # data -> RequestId のリスト
+        self.data: dict[str, list[str]] = {}
+        # 異常の検出用に呼び出しの最小限の情報だけを残す
+        # (RequestId, 開始時刻, 書き込んだ時刻, 自分の skey, 読み込んだ skey, 取得した skey)
+        self.opes: list[tuple[str, float, float, str, str, frozenset]] = []
+        # (公開した時刻, skey, RequestId)
+        self.publishes: list[tuple[float, str, str]] = []
+        # (開始時刻, 読み込んだ skey, RequestId)
+        self.loads: list[tuple[float, str, str]] = []
+
+    def histogram(self, phase: str, kind: str) -> Histogram:
+        key = (phase, kind)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        return self.histograms[key]
+
+    def add(self, inv: Invocation) -> None:
+        if not inv.rid:
+            # 区切りのレコードがない (エクスポートの範囲の端)
+            self.incomplete += 1
+            return
+        if not inv.complete:
+            self.incomplete += 1
+
+        self.invocations += 1
+        kind = "cold" if inv.cold else "warm"
+
+        if inv.duration is not None:
+            self.histogram("total", kind).add(inv.duration)
+        if inv.init:
+            self.histogram("init", kind).add(inv.init)
+        for phase, ms in inv.phases().items():
+            self.histogram(phase, kind).add(ms)
+
+        for data in inv.data:
+            self.data.setdefault(data, []).append(inv.rid)
+
+        start = inv.start if inv.start is not None else (
+            inv.events[0][0] if inv.events else 0.0)
+        if inv.own and inv.loaded is not None:
+            self.opes.append((inv.rid, start, inv.written or start, inv.own,
+                              inv.loaded, frozenset(inv.queried)))
+        if inv.loaded is not None:
+            self.loads.append((start, inv.loaded, inv.rid))
+        for ts, skey in inv.published:
+            if skey and skey != "None":
+                self.publishes.append((ts, skey, inv.rid))
+
+    def missing_opes(self) -> list[dict]:
+        """自分の ope より前にコミットされていた範囲内の ope が、取得結果に含まれていない呼び出し"""
+
+        written = sorted((own, at, rid) for rid, _, at, own, _, _ in self.opes)
+        skeys = [w[0] for w in written]
+
+        anomalies = []
+        for rid, _, at, own, loaded, queried in self.opes:
+            lo = bisect.bisect_right(skeys, loaded)
+            hi = bisect.bisect_left(skeys, own)
+            missing = [(skey, other) for skey, other_at, other in written[lo:hi]
+                       if other_at < at and skey not in queried]
+            if missing:
+                anomalies.append({"rid": rid, "own": own, "loaded": loaded,
+                                  "missing": [m[0] for m in missing],
+                                  "writers": [m[1] for m in missing]})
+        return anomalies
+
+    def skey_regressions(self) -> list[dict]:
+        """公開済みのスナップショットより古いスナップショットを読み込んだ / 公開した呼び出し"""
+
+        anomalies = []
+
+        publishes = sorted(self.publishes)
+        latest = ""
+        for ts, skey, rid in publishes:
+            if skey < latest:
+                anomalies.append({"kind": "publish", "rid": rid, "skey": skey, "latest": latest})
+            latest = max(latest, skey)
+
+        # 開始時刻より前に公開済みの最大の skey と比較する
+        times = [p[0] for p in publishes]
+        prefix_max: list[str] = []
+        for _, skey, _ in publishes:
+            prefix_max.append(max(prefix_max[-1], skey) if prefix_max else skey)
+        for start, loaded, rid in sorted(self.loads):
+            i = bisect.bisect_left(times, start)
+            if i and loaded < prefix_max[i - 1]:
+                anomalies.append({"kind": "load", "rid": rid, "skey": loaded,
+                                  "latest": prefix_max[i - 1]})
+        return anomalies
+
+    def report(self, limit: int) -> dict:
+        phases = ["total", "init", *PHASES]
+        return {
+            "invocations": self.invocations,
+            "incomplete": self.incomplete,
+            "histogram_bounds_ms": HISTOGRAM_BOUNDS,
+            "phases": {
+                phase: {kind: self.histograms[(phase, kind)].stats()
+                        for kind in ("cold", "warm") if (phase, kind) in self.histograms}
+                for phase in phases
+                if any((phase, kind) in self.histograms for kind in ("cold", "warm"))
+            },
+            "duplicated_data_count": sum(1 for rids in self.data.values() if len(rids) > 1),
+            "duplicated_data": dict(list(
+                (data, rids) for data, rids in self.data.items() if len(rids) > 1)[:limit]),
+            "missing_opes": self.missing_opes()[:limit],
+            "skey_regressions": self.skey_regressions()[:limit],
+        }
+
+
+# ------------------------------------------------------------------
+
+
+def analyze(paths: list[str]) -> Analysis:
+    analysis = Analysis()
+    for path in paths:
+        assembler = StreamAssembler()
+        for record in iter_records(path):
+            for inv in assembler.add(record):
+                analysis.add(inv)
+        for inv in assembler.flush():
+            analysis.add(inv)
+    return analysis
+
+
+def print_report(report: dict) -> None:
+    print(f"invocations: {report['invocations']} (incomplete: {report['incomplete']})")
+    print()
+
+    bounds = report["histogram_bounds_ms"]
+    labels = [f"<{b}" for b in bounds] + [f">={bounds[-1]}"]
+    print(f"{'phase':<8} {'kind':<5} {'n':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  "
+          + " ".join(f"{label:>6}" for label in labels))
+    for phase, kinds in report["phases"].items():
+        for kind, s in kinds.items():
+            print(f"{phase:<8} {kind:<5} {s['n']:>6} {s['p50']:>9} {s['p90']:>9} {s['p99']:>9} {s['max']:>9}  "
+                  + " ".join(f"{c:>6}" for c in s["buckets"]))
+    print()
+
+    print(f"duplicated data: {report['duplicated_data_count']}")
+    for data, rids in report["duplicated_data"].items():
+        print(f"  {data}: {', '.join(rids)}")
+    print()
+
+    print(f"missing opes: {len(report['missing_opes'])}")
+    for a in report["missing_opes"]:
+        print(f"  {a['rid']} own={a['own']} loaded={a['loaded']} missing={','.join(a['missing'])}")
+    print()
+
+    print(f"skey regressions: {len(report['skey_regressions'])}")
+    for a in report["skey_regressions"]:
+        print(f"  [{a['kind']}] {a['rid']} skey={a['skey']} latest={a['latest']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="Logs Insights のエクスポート (JSON)")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力する")
+    parser.add_argument("--limit", type=int, default=50, help="出力する異常の件数の上限")
+    args = parser.parse_args()
+
+    report = analyze(args.paths).report(args.limit)
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
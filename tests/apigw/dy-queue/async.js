@@ -0,0 +1,135 @@
+import http from "k6/http";
+import { check, sleep } from "k6";
+import { Trend } from "k6/metrics";
+import { textSummary } from "https://jslib.k6.io/k6-summary/0.0.2/index.js";
+const API_URL_BASE = __ENV.API_URL_BASE;
+
+// POST の応答方式 (submit=sync / async) ごとにシナリオを順番に実行する
+const SUBMIT_MODES = ["sync", "async"];
+const VUS = Number(__ENV.VUS || 10);
+// 1 シナリオの実行時間[s]
+const DURATION = Number(__ENV.DURATION || 60);
+// 前のシナリオのリクエストが終わるのを待つ時間[s]
+const GAP = 10;
+// async のときに結果を取得する間隔[s] と上限の回数
+const POLL_INTERVAL = 0.1;
+const POLL_MAX = 100;
+
+// POST してから ope の結果を取得できるまでの時間[ms] (sync は POST の応答時間と同じ)
+const applied = new Trend("dy_queue_applied", true);
+
+export const options = {
+  scenarios: Object.fromEntries(
+    SUBMIT_MODES.map((mode, i) => [
+      mode,
+      {
+        executor: "constant-vus",
+        vus: VUS,
+        duration: `${DURATION}s`,
+        startTime: `${i * (DURATION + GAP)}s`,
+        exec: "post",
+        env: { SUBMIT: mode },
+        tags: { submit: mode },
+      },
+    ])
+  ),
+  thresholds: {
+    http_req_failed: ["rate<0.01"], // リクエストの失敗率は1%未満
+    // 応答方式ごとの値をサマリーに表示するためのしきい値
+    ...Object.fromEntries(
+      SUBMIT_MODES.flatMap((mode) => [
+        [`http_req_duration{submit:${mode},name:post}`, ["p(95)<10000"]],
+        [`dy_queue_applied{submit:${mode}}`, ["p(95)<20000"]],
+      ])
+    ),
+  },
+};
+
+// 応答方式ごとに別のオブジェクトに書き込み、互いの影響を受けないようにする
+function objectUrl(mode) {
+  return `${API_URL_BASE}/dy-queue/objects/k6/submit-${mode}`;
+}
+
+export function setup() {
+  console.log("Setup: テスト前にデータの削除を行う");
+  const headers = { "Content-Type": "application/json" };
+  for (const mode of SUBMIT_MODES) {
+    const response = http.del(objectUrl(mode), JSON.stringify({ data: "" }), {
+      headers: headers,
+    });
+    if (response.status !== 200) {
+      throw new Error(`Setup failed: データの削除に失敗しました (submit: ${mode})`);
+    }
+  }
+}
+
+export function post() {
+  const mode = __ENV.SUBMIT;
+  const headers = { "Content-Type": "application/json" };
+
+  const data = `${("000" + __VU.toString()).slice(-3)}-${(
+    "000" + __ITER.toString()
+  ).slice(-3)}`;
+
+  const start = Date.now();
+  const response = http.post(`${objectUrl(mode)}?submit=${mode}`, JSON.stringify({ data: data }), {
+    headers: headers,
+    tags: { name: "post" },
+  });
+
+  const status = mode === "async" ? 202 : 200;
+  const res = check(response, {
+    [`is status ${status}`]: (r) => r.status === status,
+  });
+  if (!res) {
+    console.log(`failed. status: ${response.status}, body: ${response.body}`);
+    return;
+  }
+  if (mode === "sync") {
+    applied.add(Date.now() - start);
+    return;
+  }
+
+  // 適用されるまで結果を取得する
+  const skey = JSON.parse(response.body).skey;
+  for (let n = 0; n < POLL_MAX; n++) {
+    const result = http.get(`${objectUrl(mode)}/ops/${skey}`, { tags: { name: "result" } });
+    if (result.status === 200) {
+      applied.add(Date.now() - start);
+      return;
+    }
+    if (result.status !== 202) {
+      console.log(`failed. status: ${result.status}, body: ${result.body}`);
+      return;
+    }
+    sleep(POLL_INTERVAL);
+  }
+  console.log(`timeout. skey: ${skey}`);
+}
+
+export function teardown() {
+  console.log("Teardown: テスト後のデータ確認");
+  for (const mode of SUBMIT_MODES) {
+    const response = http.get(objectUrl(mode));
+    if (response.status !== 200) {
+      console.log(`データ取得失敗 (submit: ${mode})`);
+      continue;
+    }
+    const body = JSON.parse(response.body);
+    console.log(`submit: ${mode}, skey : ${body.skey}, data.length : ${body.data.length}`);
+  }
+}
+
+export function handleSummary(data) {
+  const lines = ["", "submit\tpost p(95)[ms]\tapplied p(50)[ms]\tapplied p(95)[ms]"];
+  for (const mode of SUBMIT_MODES) {
+    const post = data.metrics[`http_req_duration{submit:${mode},name:post}`].values;
+    const done = data.metrics[`dy_queue_applied{submit:${mode}}`].values;
+    lines.push(
+      `${mode}\t${post["p(95)"].toFixed(1)}\t${done["med"].toFixed(1)}\t${done["p(95)"].toFixed(1)}`
+    );
+  }
+  return {
+    stdout: textSummary(data, { indent: " ", enableColors: true }) + lines.join("\n") + "\n",
+  };
+}
@@ -0,0 +1,115 @@
+import http from "k6/http";
+import { check } from "k6";
+import { Counter } from "k6/metrics";
+import { textSummary } from "https://jslib.k6.io/k6-summary/0.0.2/index.js";
+const API_URL_BASE = __ENV.API_URL_BASE;
+
+// バッチサイズ (1 回の POST でまとめて書き込む ope の数) ごとにシナリオを順番に実行する
+const BATCH_SIZES = [1, 10, 100];
+const VUS = Number(__ENV.VUS || 10);
+// 1 シナリオの実行時間[s]
+const DURATION = Number(__ENV.DURATION || 60);
+// 前のシナリオのリクエストが終わるのを待つ時間[s]
+const GAP = 10;
+
+// 適用された ope の数 (シナリオのタグ batch で集計する)
+const opes = new Counter("dy_queue_opes");
+
+export const options = {
+  scenarios: Object.fromEntries(
+    BATCH_SIZES.map((size, i) => [
+      `batch_${size}`,
+      {
+        executor: "constant-vus",
+        vus: VUS,
+        duration: `${DURATION}s`,
+        startTime: `${i * (DURATION + GAP)}s`,
+        exec: "post",
+        env: { BATCH: size.toString() },
+        tags: { batch: size.toString() },
+      },
+    ])
+  ),
+  thresholds: {
+    http_req_failed: ["rate<0.01"], // リクエストの失敗率は1%未満
+    // バッチサイズごとの値をサマリーに表示するためのしきい値
+    ...Object.fromEntries(
+      BATCH_SIZES.flatMap((size) => [
+        [`dy_queue_opes{batch:${size}}`, ["count>0"]],
+        [`http_req_duration{batch:${size}}`, ["p(95)<10000"]],
+      ])
+    ),
+  },
+};
+
+// バッチサイズごとに別のオブジェクトに書き込み、互いの影響を受けないようにする
+function objectUrl(size) {
+  return `${API_URL_BASE}/dy-queue/objects/k6/batch-${size}`;
+}
+
+export function setup() {
+  console.log("Setup: テスト前にデータの削除を行う");
+  const headers = { "Content-Type": "application/json" };
+  for (const size of BATCH_SIZES) {
+    const response = http.del(objectUrl(size), JSON.stringify({ data: "" }), {
+      headers: headers,
+    });
+    if (response.status !== 200) {
+      throw new Error(`Setup failed: データの削除に失敗しました (batch: ${size})`);
+    }
+  }
+}
+
+export function post() {
+  const size = Number(__ENV.BATCH);
+  const headers = { "Content-Type": "application/json" };
+
+  const prefix = `${("000" + __VU.toString()).slice(-3)}-${(
+    "000" + __ITER.toString()
+  ).slice(-3)}`;
+  const ops = [];
+  for (let n = 0; n < size; n++) {
+    ops.push({ data: `${prefix}-${("000" + n.toString()).slice(-3)}` });
+  }
+
+  const response = http.post(objectUrl(size), JSON.stringify({ ops: ops }), {
+    headers: headers,
+  });
+
+  const res = check(response, {
+    "is status 200": (r) => r.status === 200,
+    "has all results": (r) =>
+      r.status === 200 && JSON.parse(r.body).results.length === size,
+  });
+  if (!res) {
+    console.log(`failed. status: ${response.status}, body: ${response.body}`);
+    return;
+  }
+  opes.add(size);
+}
+
+export function teardown() {
+  console.log("Teardown: テスト後のデータ確認");
+  for (const size of BATCH_SIZES) {
+    const response = http.get(objectUrl(size));
+    if (response.status !== 200) {
+      console.log(`データ取得失敗 (batch: ${size})`);
+      continue;
+    }
+    const body = JSON.parse(response.body);
+    console.log(`batch: ${size}, skey : ${body.skey}, data.length : ${body.data.length}`);
+  }
+}
+
+export function handleSummary(data) {
+  // Counter の rate はテスト全体の時間で割った値なので、シナリオの実行時間で割りなおす
+  const lines = ["", "batch\topes\topes/s\thttp p(95)[ms]"];
+  for (const size of BATCH_SIZES) {
+    const count = data.metrics[`dy_queue_opes{batch:${size}}`].values.count;
+    const p95 = data.metrics[`http_req_duration{batch:${size}}`].values["p(95)"];
+    lines.push(`${size}\t${count}\t${(count / DURATION).toFixed(1)}\t${p95.toFixed(1)}`);
+  }
+  return {
+    stdout: textSummary(data, { indent: " ", enableColors: true }) + lines.join("\n") + "\n",
+  };
+}
@@ -1,6 +1,9 @@
 import http from "k6/http";
+import { check } from "k6";
 
 const API_URL_BASE = __ENV.API_URL_BASE;
+// 1 回のリクエストでまとめて publish する ope の数 (1 の場合は data だけを送る)
+const BATCH_SIZE = parseInt(__ENV.BATCH_SIZE || "1");
 
 export const options = {
   vus: 10,
@@ -11,5 +14,26 @@ export const options = {
 };
 
 export default function () {
-  http.get(API_URL_BASE + "/s3");
+  const data = `vu-${__VU}-iter-${__ITER}`;
+  const body =
+    BATCH_SIZE === 1
+      ? { data }
+      : {
+          ops: Array.from({ length: BATCH_SIZE }, (_, i) => ({
+            data: `${data}-${i}`,
+          })),
+        };
+
+  const res = http.post(API_URL_BASE + "/s3", JSON.stringify(body), {
+    headers: { "Content-Type": "application/json" },
+  });
+
+  // publish した topic id は response/{topic id}.json で結果を確認できる
+  check(res, {
+    "status is 202": (r) => r.status === 202,
+    "has topic ids": (r) =>
+      BATCH_SIZE === 1
+        ? !!r.json("topic_id")
+        : r.json("topic_ids").length === BATCH_SIZE,
+  });
 }
@@ -0,0 +1,498 @@
+"""verification.py の Lambda のステップの実行順序 (インターリーブ) を探索する
+
+- インターリーブはジェネレーターで必要になった分だけ生成する
+- 探索は実行済みの途中の状態をスナップショットして分岐ごとに巻き戻す深さ優先探索で行い、
+  同じ途中までの実行を何度も最初からやり直さない
+- partial-order reduction (sleep set): 異なる状態 (S3 と DynamoDB、異なるキー) だけに触れるステップは
+  実行順序を入れ替えても結果が変わらないので、入れ替えただけのインターリーブは 1 つだけ実行する
+- 訪問済みの状態をその時の sleep set と一緒に記録し、同じ状態に別の順序で到達した場合は
+  まだ実行していないステップだけを実行する (Godefroid の sleep set と state caching の組み合わせ)。
+  最終状態 (= 結果) はすべて到達するが、記録されるインターリーブは最終状態ごとの代表になる
+- 探索木の上位の分岐をシャードに分割してプロセスプールで並列に実行する
+- --count: 途中の状態 (と残りのステップ) ごとに、そこから先のすべてのインターリーブの結果の件数をメモ化して、
+  すべてのインターリーブを実行した場合と同じ結果ごとの件数を求める
+
+python explorer.py --writers 3
+python explorer.py --writers 4 --processes 8
+python explorer.py --writers 3 --count --compare 200000"""
+
+import argparse
+import math
+import time
+from collections import Counter
+from dataclasses import dataclass
+from multiprocessing import Pool
+
+from verification import S3, DynamoDb, Ope, Current, Lambda
+
+# 1 つの Lambda のステップ数 (step01 ～ step06)
+STEPS = 6
+
+# 並行に実行する Lambda の後に順番に実行する Lambda の数 (verification.py の lambda04, lambda05)
+DEFAULT_FOLLOWERS = 2
+
+INITIAL_S3 = ("09", "08")
+INITIAL_CUR = Current("09", ["08", "07"])
+
+
+@dataclass(frozen=True)
+class Outcome:
+    """1 つのインターリーブの実行結果
+
+    mid: 並行に実行した Lambda がすべて終わった時点 (verification.py の a3)
+    end: 後続の Lambda を順番に実行した後 (verification.py の a5)"""
+
+    errs: tuple[str, ...]
+
+    mid_s3: tuple[str, ...]
+    mid_cur: str
+    mid_prv: tuple[str, ...]
+
+    end_s3: tuple[str, ...]
+    end_cur: str
+    end_prv: tuple[str, ...]
+
+
+class Model:
+    """writers 個の Lambda を並行に、followers 個の Lambda をその後に順番に実行するシミュレーション"""
+
+    def __init__(self, writers: int = 3, followers: int = DEFAULT_FOLLOWERS) -> None:
+        self.writers = writers
+        self.followers = followers
+
+        self.s3 = S3()
+        self.dynamoDb = DynamoDb()
+        self.lambdas = [Lambda(self.s3, self.dynamoDb, Ope(str(10 + i)))
+                        for i in range(writers + followers)]
+        self.steps = [[lmd.step01, lmd.step02, lmd.step03, lmd.step04, lmd.step05, lmd.step06]
+                      for lmd in self.lambdas]
+        self.pcs = [0] * writers
+
+        self.reset()
+
+    def reset(self) -> None:
+        self.s3.clear()
+        self.dynamoDb.clear()
+        for lmd in self.lambdas:
+            lmd.clear()
+
+        self.s3.data.update(INITIAL_S3)
+        self.dynamoDb.cur = INITIAL_CUR
+
+        self.pcs = [0] * self.writers
+
+    def enabled(self) -> list[int]:
+        """次のステップが残っている Lambda"""
+        return [w for w in range(self.writers) if self.pcs[w] < STEPS]
+
+    def execute(self, w: int) -> None:
+        self.steps[w][self.pcs[w]]()
+        self.pcs[w] += 1
+
+    def footprint(self, w: int) -> tuple[frozenset, frozenset]:
+        """Lambda w の次のステップが読み込む状態と書き込む状態
+
+        ステップが触れるキーは Lambda 自身の変数だけで決まるので、
+        他の Lambda のステップを実行しても変わらない。"""
+
+        lmd = self.lambdas[w]
+        step = self.pcs[w]
+        if lmd.err:
+            # エラー後のステップは何もしない
+            return frozenset(), frozenset()
+
+        if step == 0:
+            return frozenset(), frozenset(["opes"])
+        if step == 1:
+            return frozenset(["opes", "cur"]), frozenset()
+        if step == 2:
+            if not lmd.step02_cur:
+                return frozenset(), frozenset()
+            return frozenset([("s3", lmd.step02_cur.cur), ("s3", lmd.step02_cur.prv[0])]), frozenset()
+        if step == 3:
+            return frozenset(), frozenset([("s3", lmd.ope.sky)])
+        if step == 4:
+            return frozenset(["cur"]), frozenset(["cur"])
+
+        prev = lmd.step04_update_prev_cur
+        if prev:
+            keys = [prev.cur] + ([lmd.step03_prv] if lmd.step03_prv else [])
+        else:
+            keys = [lmd.ope.sky]
+        return frozenset(), frozenset(("s3", k) for k in keys)
+
+    def key(self) -> tuple:
+        """以降の実行に影響する状態 (ハッシュ可能)
+
+        step02_opes は取得した後に参照されないので含めない。
+        後続の Lambda は並行に実行する Lambda が終わるまで初期状態のままなので含めない。"""
+
+        def cur_key(cur: Current | None):
+            return (cur.cur, tuple(cur.prv)) if cur else None
+
+        return (
+            frozenset(self.s3.data),
+            cur_key(self.dynamoDb.cur),
+            tuple(o.sky for o in self.dynamoDb.opes if o),
+            tuple(self.pcs),
+            tuple((lmd.err, cur_key(lmd.step02_cur), lmd.step03_cur, lmd.step03_prv,
+                   cur_key(lmd.step04_update_prev_cur)) for lmd in self.lambdas[:self.writers]),
+        )
+
+    def snapshot(self) -> tuple:
+        # Current と Ope は更新されずに置き換えられるので参照のままでよい
+        return (
+            frozenset(self.s3.data),
+            self.dynamoDb.cur,
+            tuple(self.dynamoDb.opes),
+            tuple(self.pcs),
+            tuple((lmd.err, lmd.step02_opes, lmd.step02_cur, lmd.step03_cur,
+                   lmd.step03_prv, lmd.step04_update_prev_cur) for lmd in self.lambdas),
+        )
+
+    def restore(self, snapshot: tuple) -> None:
+        s3_data, cur, opes, pcs, lambdas = snapshot
+        self.s3.data = set(s3_data)
+        self.dynamoDb.cur = cur
+        self.dynamoDb.opes = list(opes)
+        self.pcs = list(pcs)
+        for lmd, state in zip(self.lambdas, lambdas):
+            (lmd.err, lmd.step02_opes, lmd.step02_cur, lmd.step03_cur,
+             lmd.step03_prv, lmd.step04_update_prev_cur) = state
+
+    def finish(self) -> Outcome:
+        """後続の Lambda を順番に実行して結果を返す (状態は変更されるので呼び出し側で巻き戻す)"""
+
+        mid_s3 = tuple(sorted(self.s3.data))
+        mid_cur = self.dynamoDb.cur
+
+        for steps in self.steps[self.writers:]:
+            for step in steps:
+                step()
+
+        end_cur = self.dynamoDb.cur
+        return Outcome(
+            errs=tuple(lmd.err for lmd in self.lambdas),
+            mid_s3=mid_s3,
+            mid_cur=mid_cur.cur,
+            mid_prv=tuple(mid_cur.prv),
+            end_s3=tuple(sorted(self.s3.data)),
+            end_cur=end_cur.cur,
+            end_prv=tuple(end_cur.prv),
+        )
+
+    def run(self, schedule: tuple[int, ...]) -> Outcome:
+        """schedule (ステップごとに実行する Lambda の番号) を最初から実行する"""
+
+        self.reset()
+        for w in schedule:
+            self.execute(w)
+        return self.finish()
+
+
+def independent(a: tuple[frozenset, frozenset], b: tuple[frozenset, frozenset]) -> bool:
+    """2 つのステップの実行順序を入れ替えても結果が変わらないか"""
+
+    a_reads, a_writes = a
+    b_reads, b_writes = b
+    return not (a_writes & (b_reads | b_writes)) and not (b_writes & a_reads)
+
+
+def count_schedules(writers: int, steps: int = STEPS) -> int:
+    """インターリーブの総数 ((writers * steps)! / (steps!)^writers)"""
+    return math.factorial(writers * steps) // (math.factorial(steps) ** writers)
+
+
+# ------------------------------------------------------------------
+
+
+def iter_schedules(writers: int, steps: int = STEPS, prefix: tuple[int, ...] = ()):
+    """prefix から始まるインターリーブを辞書順に 1 つずつ生成する"""
+
+    remaining = [steps] * writers
+    for w in prefix:
+        remaining[w] -= 1
+    schedule = list(prefix)
+    total = writers * steps
+
+    def walk():
+        if len(schedule) == total:
+            yield tuple(schedule)
+            return
+        for w in range(writers):
+            if remaining[w]:
+                remaining[w] -= 1
+                schedule.append(w)
+                yield from walk()
+                schedule.pop()
+                remaining[w] += 1
+
+    yield from walk()
+
+
+def explore(model: Model, prefix: tuple[int, ...] = (), sleep: frozenset = frozenset(),
+            reduce: bool = True, cache: bool = True):
+    """prefix から始まるインターリーブを深さ優先で実行し、(schedule, outcome) を生成する
+
+    reduce が有効な場合は sleep set で実行順序を入れ替えただけのインターリーブを省く。
+    cache も有効な場合は訪問済みの状態を記録して、同じ状態からの探索を繰り返さない。
+    sleep は prefix の時点で既に他の分岐で実行済みの Lambda (split で求めたもの)。"""
+
+    model.reset()
+    for w in prefix:
+        model.execute(w)
+    schedule = list(prefix)
+
+    # 状態 -> その状態で実行しなかった (sleep set に入っていた) Lambda
+    visited: dict[tuple, frozenset] = {}
+    use_cache = reduce and cache
+
+    def dfs(sleep: frozenset):
+        enabled = model.enabled()
+        snapshot = model.snapshot()
+
+        if not enabled:
+            yield tuple(schedule), model.finish()
+            model.restore(snapshot)
+            return
+
+        candidates = enabled
+        if use_cache:
+            key = model.key()
+            slept = visited.get(key)
+            if slept is not None:
+                # 前回の訪問で実行しなかったステップのうち、今回 sleep set に入っていないものだけを実行する
+                if slept <= sleep:
+                    return
+                candidates = [w for w in enabled if w in slept]
+                visited[key] = slept & sleep
+            else:
+                visited[key] = sleep
+
+        done: list[int] = []
+        for w in candidates:
+            if w in sleep:
+                continue
+
+            if reduce:
+                fp = model.footprint(w)
+                child_sleep = frozenset(u for u in (*sleep, *done)
+                                        if independent(model.footprint(u), fp))
+            else:
+                child_sleep = frozenset()
+
+            model.execute(w)
+            schedule.append(w)
+            yield from dfs(child_sleep)
+            schedule.pop()
+            model.restore(snapshot)
+            done.append(w)
+
+    yield from dfs(sleep)
+
+
+def count_outcomes(model: Model, memo: dict[tuple, Counter] | None = None) -> Counter:
+    """すべてのインターリーブを実行した場合の結果ごとの件数を求める
+
+    途中の状態のハッシュ (key には残りのステップを表す pcs も含まれる) ごとに、
+    そこから先のインターリーブの結果の件数をメモ化するので、同じ状態に至る途中までの実行は 1 度しか行わない。"""
+
+    model.reset()
+    if memo is None:
+        memo = {}
+
+    def dfs() -> Counter:
+        key = model.key()
+        counts = memo.get(key)
+        if counts is not None:
+            return counts
+
+        enabled = model.enabled()
+        snapshot = model.snapshot()
+
+        if not enabled:
+            counts = Counter([model.finish()])
+            model.restore(snapshot)
+        else:
+            counts = Counter()
+            for w in enabled:
+                model.execute(w)
+                counts.update(dfs())
+                model.restore(snapshot)
+
+        memo[key] = counts
+        return counts
+
+    return dfs()
+
+
+def time_brute_force(model: Model, limit: int) -> tuple[int, float]:
+    """現在の方法 (インターリーブごとに最初から run する) で limit 件実行した件数と時間"""
+
+    start = time.perf_counter()
+    executed = 0
+    for schedule in iter_schedules(model.writers):
+        model.run(schedule)
+        executed += 1
+        if executed == limit:
+            break
+    return executed, time.perf_counter() - start
+
+
+def split(model: Model, depth: int, reduce: bool = True) -> list[tuple[tuple[int, ...], frozenset]]:
+    """探索木を depth 段目で分割し、各部分木の (prefix, sleep set) を返す"""
+
+    model.reset()
+    shards: list[tuple[tuple[int, ...], frozenset]] = []
+    schedule: list[int] = []
+
+    def dfs(sleep: frozenset):
+        enabled = model.enabled()
+        if len(schedule) == depth or not enabled:
+            shards.append((tuple(schedule), sleep))
+            return
+
+        snapshot = model.snapshot()
+        done: list[int] = []
+        for w in enabled:
+            if w in sleep:
+                continue
+            if reduce:
+                fp = model.footprint(w)
+                child_sleep = frozenset(u for u in (*sleep, *done)
+                                        if independent(model.footprint(u), fp))
+            else:
+                child_sleep = frozenset()
+            model.execute(w)
+            schedule.append(w)
+            dfs(child_sleep)
+            schedule.pop()
+            model.restore(snapshot)
+            done.append(w)
+
+    dfs(frozenset())
+    return shards
+
+
+# プロセスごとに 1 つの Model を使い回す
+_worker_model: Model | None = None
+
+
+def _init_worker(writers: int, followers: int) -> None:
+    global _worker_model
+    _worker_model = Model(writers, followers)
+
+
+def _explore_shard(args: tuple) -> list[tuple[tuple[int, ...], Outcome]]:
+    prefix, sleep, reduce, cache = args
+    return list(explore(_worker_model, prefix=prefix, sleep=sleep, reduce=reduce, cache=cache))
+
+
+def explore_parallel(writers: int, followers: int = DEFAULT_FOLLOWERS, reduce: bool = True,
+                     cache: bool = True, processes: int | None = None, depth: int = 1):
+    """探索木を分割してプロセスプールで探索し、(schedule, outcome) をシャードごとに生成する
+
+    シャードの完了順に返すので、schedule の順序は保証しない。
+    訪問済みの状態はシャードごとに記録する (シャードをまたいだ重複は残る)。"""
+
+    shards = split(Model(writers, followers), depth=depth, reduce=reduce)
+    tasks = [(prefix, sleep, reduce, cache) for prefix, sleep in shards]
+
+    if processes == 1:
+        _init_worker(writers, followers)
+        for task in tasks:
+            yield from _explore_shard(task)
+        return
+
+    with Pool(processes, initializer=_init_worker, initargs=(writers, followers)) as pool:
+        for rows in pool.imap_unordered(_explore_shard, tasks):
+            yield from rows
+
+
+def _write_shard(args: tuple) -> int:
+    sink_factory, prefix, sleep, reduce, cache = args
+    with sink_factory() as sink:
+        count = 0
+        for schedule, outcome in explore(_worker_model, prefix=prefix, sleep=sleep,
+                                         reduce=reduce, cache=cache):
+            sink.write(schedule, outcome)
+            count += 1
+    return count
+
+
+def explore_into(sink_factory, writers: int, followers: int = DEFAULT_FOLLOWERS, reduce: bool = True,
+                 cache: bool = True, processes: int | None = None, depth: int = 1):
+    """explore_parallel と同様に探索し、各ワーカーが sink_factory() で開いた書き込み先に直接書き込む
+
+    結果をメインプロセスに送らないので、書き込みもワーカーの数だけ並列になる。
+    sink_factory はワーカーに渡すので pickle できる必要がある (functools.partial など)。
+    シャードが完了するたびに書き込んだ件数を生成する。"""
+
+    shards = split(Model(writers, followers), depth=depth, reduce=reduce)
+    tasks = [(sink_factory, prefix, sleep, reduce, cache) for prefix, sleep in shards]
+
+    if processes == 1:
+        _init_worker(writers, followers)
+        for task in tasks:
+            yield _write_shard(task)
+        return
+
+    with Pool(processes, initializer=_init_worker, initargs=(writers, followers)) as pool:
+        yield from pool.imap_unordered(_write_shard, tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=3, help="並行に実行する Lambda の数")
+    parser.add_argument("--followers", type=int, default=DEFAULT_FOLLOWERS,
+                        help="その後に順番に実行する Lambda の数")
+    parser.add_argument("--no-reduce", action="store_true",
+                        help="partial-order reduction を行わずにすべてのインターリーブを実行する")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="訪問済みの状態を記録せずに sleep set だけで削減する")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--count", action="store_true",
+                        help="状態ごとのメモ化ですべてのインターリーブの結果ごとの件数を求める")
+    parser.add_argument("--compare", type=int, default=0, metavar="N",
+                        help="--count と一緒に指定すると、現在の方法で N 件実行した時間から全件の時間を推定して比較する")
+    parser.add_argument("--depth", type=int, default=1,
+                        help="シャードに分割する探索木の深さ (深くするとシャードをまたいだ重複が増える)")
+    args = parser.parse_args()
+
+    total = count_schedules(args.writers)
+    start = time.perf_counter()
+
+    if args.count:
+        memo: dict[tuple, Counter] = {}
+        outcomes = count_outcomes(Model(args.writers, args.followers), memo)
+        elapsed = time.perf_counter() - start
+
+        assert sum(outcomes.values()) == total
+        print(f"writers: {args.writers}, interleavings: {total}, states: {len(memo)}, "
+              f"outcomes: {len(outcomes)}, {elapsed:.3f}[s]")
+        if args.compare:
+            executed, brute = time_brute_force(Model(args.writers, args.followers), args.compare)
+            estimated = brute / executed * total
+            print(f"brute force: {executed} interleavings in {brute:.1f}[s], "
+                  f"estimated {estimated:.0f}[s] for all, speedup: x{estimated / elapsed:.0f}")
+        for outcome, count in outcomes.most_common():
+            print(f"{count:>20} : {outcome}")
+        return
+
+    explored = 0
+    outcomes: Counter[Outcome] = Counter()
+    for _, outcome in explore_parallel(args.writers, args.followers, reduce=not args.no_reduce,
+                                       cache=not args.no_cache, processes=args.processes,
+                                       depth=args.depth):
+        explored += 1
+        outcomes[outcome] += 1
+
+    elapsed = time.perf_counter() - start
+    print(f"writers: {args.writers}, interleavings: {total}, explored: {explored} "
+          f"({explored / total:.2e}), outcomes: {len(outcomes)}, {elapsed:.1f}[s]")
+    for outcome, count in outcomes.most_common():
+        print(f"{count:>10} : {outcome}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""verification2.py の Lambda (next_step のステートマシン) をランダムな順序で並行に実行する
+
+- シードを指定した乱数で、実行可能な Lambda から 1 つを選んでステップを 1 つ実行することを繰り返す
+- ステップごとに不変条件を確認する
+  - lost_ope: 完了した Lambda の操作が最新のスナップショットに適用されている
+  - cur_regression: DynamoDB の cur が小さくならない
+  - obs_inconsistent: cur が obs に含まれ、obs のオブジェクトがすべて S3 に存在する
+  - lambda_error: Lambda がエラーで終了しない
+  - livelock: 1 つの Lambda のステップ数が上限を超えない
+- 不変条件を満たさないインターリーブは、同じ種類の違反が起きる範囲で
+  Lambda とステップを取り除いて最小のインターリーブに縮小し、ステップごとの状態を表示する
+
+python fuzz.py --lambdas 3 --runs 100000
+python fuzz.py --lambdas 1000 --duration 60"""
+
+import argparse
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from verification2 import S3, DynamoDb, Ope, Current, Lambda, ope_bit
+
+# 1 つの Lambda が実行できるステップ数の上限 (超えた場合は livelock とする)
+MAX_STEPS_PER_LAMBDA = 1000
+
+
+@dataclass
+class Violation:
+    kind: str
+    message: str
+    # 違反が起きたステップ (スケジュールの位置)
+    step: int
+
+
+class Simulation:
+    """lambdas 個の Lambda を並行に、followers 個の Lambda をその後に 1 つずつ実行する
+
+    操作の sky は first_sky から digits 桁の 0 埋めの文字列で順に割り当てる。
+    初期状態は first_sky の 1 つ前の sky のスナップショットが S3 と DynamoDB の cur にある状態。"""
+
+    def __init__(self, lambdas: int, followers: int = 0, digits: int = 8, first_sky: int = 1,
+                 max_steps_per_lambda: int = MAX_STEPS_PER_LAMBDA) -> None:
+        self.s3 = S3()
+        self.dynamoDb = DynamoDb()
+
+        initial = f"{first_sky - 1:0{digits}}"
+        self.s3.save(initial)
+        self.dynamoDb.cur = Current(initial, {initial})
+
+        self.lambdas = [Lambda(self.s3, self.dynamoDb, Ope(f"{first_sky + n:0{digits}}"))
+                        for n in range(lambdas + followers)]
+        self.max_steps_per_lambda = max_steps_per_lambda
+
+        # 実行可能な Lambda と、その active の中の位置
+        self.active: list[int] = list(range(lambdas))
+        self.position: dict[int, int] = {n: n for n in range(lambdas)}
+        self.next_follower = lambdas
+
+        self.step_counts = [0] * len(self.lambdas)
+        self.steps = 0
+
+        # 完了した Lambda の操作 (ope_bit の集合)
+        self.completed = 0
+        self.last_cur = initial
+
+    def runnable(self, n: int) -> bool:
+        return n in self.position
+
+    def _deactivate(self, n: int) -> None:
+        # 最後の要素と入れ替えて削除する
+        index = self.position.pop(n)
+        last = self.active.pop()
+        if last != n:
+            self.active[index] = last
+            self.position[last] = index
+
+        if not self.active and self.next_follower < len(self.lambdas):
+            # 並行に実行する Lambda がすべて終わったので後続の Lambda を 1 つずつ実行する
+            self.active.append(self.next_follower)
+            self.position[self.next_follower] = 0
+            self.next_follower += 1
+
+    def step(self, n: int) -> Violation | None:
+        """Lambda n のステップを 1 つ実行して不変条件を確認する"""
+
+        lmd = self.lambdas[n]
+        name = lmd.next_step.__name__
+        more = lmd.next()
+
+        at = self.steps
+        self.steps += 1
+        self.step_counts[n] += 1
+
+        if not more:
+            self._deactivate(n)
+            if lmd.err:
+                return Violation("lambda_error", f"lambda {n} ({lmd.ope.sky}) failed at {lmd.err}", at)
+            self.completed |= ope_bit(lmd.ope.sky)
+        elif self.step_counts[n] > self.max_steps_per_lambda:
+            # 実行を打ち切る
+            lmd.err = "livelock"
+            lmd.next_step = None
+            self._deactivate(n)
+            return Violation("livelock", f"lambda {n} ({lmd.ope.sky}) is still running after "
+                             f"{self.step_counts[n]} steps (last: {name})", at)
+
+        cur = self.dynamoDb.cur
+        if cur.cur < self.last_cur:
+            return Violation("cur_regression", f"cur {self.last_cur} -> {cur.cur} by {name}", at)
+
+        applied = self.s3.applied.get(cur.cur, 0)
+        if cur.cur != self.last_cur:
+            self.last_cur = cur.cur
+            lost = self.completed & ~applied
+            if lost:
+                skies = [o.ope.sky for o in self.lambdas if lost & ope_bit(o.ope.sky)]
+                return Violation("lost_ope", f"cur {cur.cur} does not contain completed {skies}", at)
+        elif not more and not lmd.err and not applied & ope_bit(lmd.ope.sky):
+            return Violation("lost_ope", f"lambda {n} ({lmd.ope.sky}) completed by {name} "
+                             f"but cur {cur.cur} does not contain it", at)
+
+        if cur.cur not in cur.obs:
+            return Violation("obs_inconsistent", f"cur {cur.cur} is not in obs {sorted(cur.obs)}", at)
+        missing = [sky for sky in cur.obs if sky not in self.s3.data]
+        if missing:
+            return Violation("obs_inconsistent", f"obs {sorted(missing)} are not in S3 (after {name})", at)
+
+        return None
+
+    def run(self, rng: random.Random, stop: bool = True) -> tuple[list[int], Violation | None]:
+        """すべての Lambda が終わるか、不変条件を満たさなくなるまでランダムな順序で実行する
+
+        stop が False の場合は不変条件を満たさなくなってもすべての Lambda が終わるまで実行し、最初の違反を返す。"""
+
+        schedule: list[int] = []
+        first: Violation | None = None
+        active = self.active
+        while active:
+            n = active[rng.randrange(len(active))]
+            schedule.append(n)
+            violation = self.step(n)
+            if violation:
+                if stop:
+                    return schedule, violation
+                first = first or violation
+        return schedule, first
+
+
+def reproduces(factory, schedule: list[int], kind: str) -> tuple[bool, list[int]]:
+    """schedule で同じ種類の違反が起きるか。起きる場合は違反までに実行したステップだけを返す"""
+
+    sim: Simulation = factory()
+    executed: list[int] = []
+    for n in schedule:
+        if not sim.runnable(n):
+            continue
+        executed.append(n)
+        violation = sim.step(n)
+        if violation:
+            return violation.kind == kind, executed
+    return False, executed
+
+
+def ddmin(items: list, test) -> list:
+    """test を満たす範囲で items から要素を取り除く (delta debugging)"""
+
+    chunks = 2
+    while len(items) >= 2:
+        size = max(1, len(items) // chunks)
+        removed = False
+        for start in range(0, len(items), size):
+            candidate = items[:start] + items[start + size:]
+            if candidate and test(candidate):
+                items = candidate
+                chunks = max(chunks - 1, 2)
+                removed = True
+                break
+        if not removed:
+            if size == 1:
+                break
+            chunks = min(chunks * 2, len(items))
+    return items
+
+
+def shrink(factory, schedule: list[int], kind: str) -> list[int]:
+    """同じ種類の違反が起きる最小のインターリーブに縮小する
+
+    最初に Lambda を丸ごと取り除き、その後にステップを 1 つずつ取り除く。"""
+
+    _, schedule = reproduces(factory, schedule, kind)
+
+    def test_lambdas(keep: list[int]) -> bool:
+        keep_set = set(keep)
+        ok, _ = reproduces(factory, [n for n in schedule if n in keep_set], kind)
+        return ok
+
+    keep = set(ddmin(sorted(set(schedule)), test_lambdas))
+    _, schedule = reproduces(factory, [n for n in schedule if n in keep], kind)
+
+    def test_steps(candidate: list[int]) -> bool:
+        ok, _ = reproduces(factory, candidate, kind)
+        return ok
+
+    schedule = ddmin(schedule, test_steps)
+    _, schedule = reproduces(factory, schedule, kind)
+    return schedule
+
+
+def format_state(sim: Simulation) -> str:
+    cur = sim.dynamoDb.cur
+    return f"s3={sorted(sim.s3.data)} cur={cur.cur} obs={sorted(cur.obs)}"
+
+
+def print_trace(factory, schedule: list[int]) -> None:
+    """schedule を実行してステップごとの状態を表示する"""
+
+    sim: Simulation = factory()
+    print(f"{'':>5} {'':<36} {format_state(sim)}")
+    for at, n in enumerate(schedule):
+        lmd = sim.lambdas[n]
+        name = lmd.next_step.__name__
+        violation = sim.step(n)
+        print(f"{at:>5} lambda {n:>4} ({lmd.ope.sky}) {name:<24} {format_state(sim)}")
+        if violation:
+            print(f"      {violation.kind}: {violation.message}")
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lambdas", type=int, default=3, help="並行に実行する Lambda の数")
+    parser.add_argument("--followers", type=int, default=0, help="その後に 1 つずつ実行する Lambda の数")
+    parser.add_argument("--runs", type=int, default=None, help="実行する回数 (シードの数)")
+    parser.add_argument("--duration", type=float, default=None, help="実行する時間 [s]")
+    parser.add_argument("--seed", type=int, default=0, help="最初のシード")
+    parser.add_argument("--no-shrink", action="store_true")
+    args = parser.parse_args()
+
+    if args.runs is None and args.duration is None:
+        args.runs = 10000
+
+    def factory():
+        return Simulation(args.lambdas, args.followers)
+
+    violations: Counter[str] = Counter()
+    first: dict[str, tuple[int, list[int], Violation]] = {}
+
+    start = time.perf_counter()
+    steps = 0
+    runs = 0
+    seed = args.seed
+    while True:
+        if args.runs is not None and runs >= args.runs:
+            break
+        if args.duration is not None and time.perf_counter() - start >= args.duration:
+            break
+
+        sim = factory()
+        schedule, violation = sim.run(random.Random(seed))
+        steps += sim.steps
+        runs += 1
+        if violation:
+            violations[violation.kind] += 1
+            first.setdefault(violation.kind, (seed, schedule, violation))
+        seed += 1
+
+    elapsed = time.perf_counter() - start
+    print(f"lambdas: {args.lambdas}, runs: {runs}, steps: {steps}, {elapsed:.1f}[s], "
+          f"{steps / elapsed * 60:,.0f} steps/min")
+    for kind, count in violations.most_common():
+        print(f"{count:>10} : {kind}")
+
+    for kind, (seed, schedule, violation) in first.items():
+        print(f"---- {kind} (seed {seed}, step {violation.step}): {violation.message}")
+        if not args.no_shrink:
+            schedule = shrink(factory, schedule, kind)
+        print(f"schedule ({len(schedule)} steps): {schedule}")
+        print_trace(factory, schedule)
+
+
+if __name__ == "__main__":
+    main()
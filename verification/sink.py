@@ -0,0 +1,286 @@
+"""インターリーブの実行結果の書き込み先
+
+- SqliteSink: verification.db の logs / s3 / dynamodb テーブルに executemany でまとめて書き込む
+- AnomalySink: 異常な結果のインターリーブだけを SqliteSink に書き込み、
+  それ以外は結果の分類ごとの件数だけを outcomes テーブルに集計する
+- write_run / write_outcome_counts: 探索の条件 (partial-order reduction の有無、インターリーブの総数、書き込んだ件数) と
+  すべてのインターリーブの結果ごとの件数 (explorer.count_outcomes) を run / outcomes テーブルに書き込む
+  (reduction が有効な場合の logs は代表のインターリーブだけなので、件数は outcomes から求める)
+
+どちらも WAL で開き、id の採番を書き込みのトランザクションの中で行うので、
+並列に実行するワーカーがそれぞれ開いて同じファイルに書き込める。"""
+
+import sqlite3
+from abc import ABC, abstractmethod
+
+from explorer import Outcome
+
+DEFAULT_DB_FILE = "./verification.db"
+
+# executemany でまとめて書き込む logs の行数
+BATCH_SIZE = 10000
+
+# 他のワーカーの書き込みの完了を待つ時間 [s]
+BUSY_TIMEOUT = 60
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    # WAL では NORMAL でもデータベースは壊れない (電源断で直前のトランザクションが失われるだけ)
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+]
+
+# 各 Lambda のステップを実行した位置の列名の接頭辞 (lambda01 が i、lambda02 が j、...)
+POSITION_PREFIXES = "ijklmnopqrs"
+
+
+def is_anomaly(outcome: Outcome) -> bool:
+    """エラーになった Lambda がある、または S3 のオブジェクトが cur と 1 つ前のスナップショットと一致しない"""
+
+    if any(outcome.errs):
+        return True
+    if set(outcome.mid_s3) != {outcome.mid_cur, *outcome.mid_prv[:1]}:
+        return True
+    return set(outcome.end_s3) != {outcome.end_cur, *outcome.end_prv[:1]}
+
+
+OUTCOMES_TABLE = """
+CREATE TABLE IF NOT EXISTS outcomes (
+    errs TEXT NOT NULL,
+    a3_s3 TEXT NOT NULL,
+    a3_dynamodb_cur TEXT NOT NULL,
+    a3_dynamodb_prv TEXT NOT NULL,
+    a5_s3 TEXT NOT NULL,
+    a5_dynamodb_cur TEXT NOT NULL,
+    a5_dynamodb_prv TEXT NOT NULL,
+    anomaly INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (errs, a3_s3, a3_dynamodb_cur, a3_dynamodb_prv,
+                 a5_s3, a5_dynamodb_cur, a5_dynamodb_prv)
+    )
+"""
+
+RUN_TABLE = """
+CREATE TABLE IF NOT EXISTS run (
+    reduced INTEGER NOT NULL,
+    schedules INTEGER NOT NULL,
+    written INTEGER NOT NULL
+    )
+"""
+
+
+def add_outcome_counts(conn: sqlite3.Connection, counts: dict[Outcome, int]) -> None:
+    """結果ごとの件数を outcomes テーブルに加算する (他のワーカーが集計した件数に加算する)"""
+
+    rows = [(",".join(o.errs), ",".join(o.mid_s3), o.mid_cur, ",".join(o.mid_prv),
+             ",".join(o.end_s3), o.end_cur, ",".join(o.end_prv), int(is_anomaly(o)), count)
+            for o, count in counts.items()]
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany("""
+        INSERT INTO outcomes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO UPDATE SET count = count + excluded.count
+        """, rows)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def write_outcome_counts(db_file: str, counts: dict[Outcome, int]) -> None:
+    """すべてのインターリーブの結果ごとの件数で outcomes テーブルを置き換える"""
+
+    conn = connect(db_file)
+    try:
+        conn.execute(OUTCOMES_TABLE)
+        conn.execute("DELETE FROM outcomes")
+        add_outcome_counts(conn, counts)
+    finally:
+        conn.close()
+
+
+def write_run(db_file: str, reduced: bool, schedules: int, written: int) -> None:
+    """探索の条件を run テーブルに書き込む (verification_check.py が logs の件数の意味を判断する)"""
+
+    conn = connect(db_file)
+    try:
+        conn.execute(RUN_TABLE)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM run")
+        conn.execute("INSERT INTO run VALUES (?, ?, ?)", (int(reduced), schedules, written))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+class Sink(ABC):
+    """(schedule, outcome) の書き込み先"""
+
+    @abstractmethod
+    def write(self, schedule: tuple[int, ...], outcome: Outcome) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def connect(db_file: str) -> sqlite3.Connection:
+    # トランザクションは明示的に開始する
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, isolation_level=None)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class SqliteSink(Sink):
+    """verification.py と同じテーブルに書き込む
+
+    logs の列は並行に実行する Lambda の数 (writers) と後続の Lambda の数 (followers) で決まる。
+    writers = 3, followers = 2 の場合は verification_check.py が読み込む従来の列と同じになる。"""
+
+    def __init__(self, db_file: str = DEFAULT_DB_FILE, writers: int = 3, followers: int = 2,
+                 batch_size: int = BATCH_SIZE) -> None:
+        self.writers = writers
+        self.batch_size = batch_size
+
+        positions = [f"{POSITION_PREFIXES[w]}{step + 1}" for w in range(writers) for step in range(6)]
+        errs = [f"lambda{n + 1}_err" for n in range(writers + followers)]
+        self.columns = ["id", *positions, *errs,
+                        "a3_s3_count", "a3_dynamodb_cur", "a3_dynamodb_prv_count",
+                        "a5_s3_count", "a5_dynamodb_cur", "a5_dynamodb_prv_count"]
+
+        self.conn = connect(db_file)
+        self.conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY,
+            {", ".join(f"{c} INTEGER NOT NULL" for c in positions)},
+            {", ".join(f"{c} TEXT NOT NULL" for c in errs)},
+            a3_s3_count INTEGER NOT NULL,
+            a3_dynamodb_cur TEXT NOT NULL,
+            a3_dynamodb_prv_count INTEGER NOT NULL,
+            a5_s3_count INTEGER NOT NULL,
+            a5_dynamodb_cur TEXT NOT NULL,
+            a5_dynamodb_prv_count INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS s3 (
+            id INTEGER PRIMARY KEY,
+            log_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            data TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS dynamodb (
+            id INTEGER PRIMARY KEY,
+            log_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            prev_data TEXT NOT NULL
+            )
+        """)
+
+        self.insert_logs = (f"INSERT INTO logs ({', '.join(self.columns)}) "
+                            f"VALUES ({', '.join('?' * len(self.columns))})")
+        self.pending: list[tuple[tuple[int, ...], Outcome]] = []
+        self.written = 0
+
+    def write(self, schedule: tuple[int, ...], outcome: Outcome) -> None:
+        self.pending.append((schedule, outcome))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+
+        # 行は id を除いて作成しておき、ロックを取っている間は id を付けるだけにする
+        logs = []
+        s3 = []
+        dynamodb = []
+        for n, (schedule, outcome) in enumerate(self.pending):
+            positions: list[list[int]] = [[] for _ in range(self.writers)]
+            for slot, w in enumerate(schedule):
+                positions[w].append(slot)
+            logs.append((*sum(positions, []), *outcome.errs,
+                         len(outcome.mid_s3), outcome.mid_cur, len(outcome.mid_prv),
+                         len(outcome.end_s3), outcome.end_cur, len(outcome.end_prv)))
+            for d in outcome.mid_s3:
+                s3.append((n, "a3", d))
+            for d in outcome.end_s3:
+                s3.append((n, "a5", d))
+            for d in outcome.mid_prv:
+                dynamodb.append((n, "a3", d))
+            for d in outcome.end_prv:
+                dynamodb.append((n, "a5", d))
+
+        # 他のワーカーと id が重複しないように、書き込みのロックを取ってから採番する
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            (last_id,) = self.conn.execute("SELECT COALESCE(MAX(id), -1) FROM logs").fetchone()
+            base = last_id + 1
+
+            self.conn.executemany(self.insert_logs, [(base + n, *row) for n, row in enumerate(logs)])
+            self.conn.executemany("INSERT INTO s3 (log_id, name, data) VALUES (?, ?, ?)",
+                                  [(base + n, name, d) for n, name, d in s3])
+            self.conn.executemany("INSERT INTO dynamodb (log_id, name, prev_data) VALUES (?, ?, ?)",
+                                  [(base + n, name, d) for n, name, d in dynamodb])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        self.written += len(self.pending)
+        self.pending.clear()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+
+class AnomalySink(Sink):
+    """異常な結果 (is_anomaly) のインターリーブだけを書き込み、結果の分類ごとの件数を集計する
+
+    count が False の場合は件数を集計しない (partial-order reduction で書き込む件数が
+    インターリーブの件数と一致しない場合に、write_outcome_counts ですべての件数を書き込むため)。"""
+
+    def __init__(self, db_file: str = DEFAULT_DB_FILE, writers: int = 3, followers: int = 2,
+                 batch_size: int = BATCH_SIZE, count: bool = True) -> None:
+        self.anomalies = SqliteSink(db_file, writers, followers, batch_size)
+        self.conn = self.anomalies.conn
+        self.conn.execute(OUTCOMES_TABLE)
+        self.count = count
+        self.counts: dict[Outcome, int] = {}
+
+    def add(self, outcome: Outcome, count: int = 1) -> None:
+        """書き込まずに件数だけを集計する (count_outcomes で求めた件数など)"""
+        self.counts[outcome] = self.counts.get(outcome, 0) + count
+
+    def write(self, schedule: tuple[int, ...], outcome: Outcome) -> None:
+        if self.count:
+            self.add(outcome)
+        if is_anomaly(outcome):
+            self.anomalies.write(schedule, outcome)
+
+    def flush(self) -> None:
+        self.anomalies.flush()
+        if not self.counts:
+            return
+        add_outcome_counts(self.conn, self.counts)
+        self.counts.clear()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self.anomalies.close()
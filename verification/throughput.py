@@ -0,0 +1,337 @@
+"""verification2.py の Lambda のステップを離散イベントシミュレーションで実行し、スループットを見積もる
+
+- concurrency 個のクライアントがそれぞれ操作を 1 つずつ送信し、完了したら次の操作を送信する (クローズドループ)
+- Lambda の各ステップは DynamoDB / S3 の呼び出し 1 回 (スナップショットの保存は適用と保存) として、
+  呼び出しの種類ごとの対数正規分布のレイテンシの後にステップを実行する
+  - レイテンシの分布は research/ のログ (Logs Insights のエクスポート) のフェーズごとの時間から推定できる (--fit)
+  - S3 の読み込み / 書き込みと操作の適用にはスナップショットのサイズに比例する時間を加える
+  - post_data の ope 書き込み後の待機 (OPE_COMMIT_WAIT_SLEEP) は操作の取得の前に加える
+- concurrency・スナップショットのサイズ・待機時間の組み合わせごとに以下を出力する
+  - throughput: 1 秒あたりにエラーなく完了した操作の数
+  - p50 / p99: 操作の送信から完了までの時間[ms]
+  - wasted: Lambda の実行時間のうち、cur の更新に失敗した、またはエラーで終わった呼び出しの割合
+  - retries: 操作あたりのスナップショットの再取得 (step_get_cur) の回数
+  - errors / lost: エラーで終わった操作 / 完了したのに最新のスナップショットに含まれない操作の割合
+
+既定 (--guarded) では、cur の更新に失敗した Lambda が自分の保存したオブジェクトを削除する際に、
+それが (同じ sky で保存した他の Lambda の) 現在の cur であれば削除しない。
+--unguarded を指定すると verification2.py のままのプロトコルを実行するが、cur のオブジェクトが削除されて
+後続の Lambda がすべて再取得を繰り返す (fuzz.py の livelock) 既知の不具合があり、ほとんどの操作がエラーになる
+(結果の protocol 列が unguarded になり、スループットの見積もりではなく不具合の再現として使用する)。
+
+レイテンシは NumPy でブロックごとにまとめて生成する。
+同じ標準正規乱数を組み合わせをまたいで使用する (common random numbers) ので、パラメーターによる差が乱数のばらつきに埋もれにくい。
+
+python throughput.py --concurrency 1 2 4 8 16 32 --size-kb 10 1000 --sleep-ms 0 50 --csv throughput.csv
+python throughput.py --concurrency 1 4 16 64 --size-kb 10 100 1000 10000
+python throughput.py --unguarded --concurrency 1 4 16
+python throughput.py --fit ../research/logs-insights-results.json ../research/logs-insights-results_2.json"""
+
+import argparse
+import csv
+import heapq
+import itertools
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from verification2 import S3, DynamoDb, Ope, Current, Lambda, ope_bit
+
+# 呼び出しの種類ごとのレイテンシ (中央値[ms], 対数の標準偏差)
+# research/ のログのウォームスタートの p50 / p90 から求めた値
+DEFAULT_LATENCIES: dict[str, tuple[float, float]] = {
+    "put_ope": (7.0, 0.28),
+    "query": (7.0, 0.69),
+    "s3_get": (24.0, 1.0),
+    "apply": (43.0, 0.25),
+    "s3_put": (17.0, 0.24),
+    "update_cur": (7.0, 0.28),
+    "put_res": (7.0, 0.28),
+    "get_cur": (7.0, 0.69),
+    "get_res": (7.0, 0.69),
+    "s3_delete": (17.0, 0.24),
+}
+
+# ログのフェーズと、そのフェーズの時間から推定する呼び出し
+PHASE_CALLS = {
+    "put_ope": ["put_ope", "update_cur", "put_res"],
+    "query": ["query", "get_cur", "get_res"],
+    "load": ["s3_get"],
+    "apply": ["apply"],
+    "save": ["s3_put", "s3_delete"],
+}
+
+# ステップと、ステップで行う呼び出し
+STEP_CALLS = {
+    "step_put_ope": ["put_ope"],
+    "step_query_ope_and_cur": ["query"],
+    "step_load_db_obj": ["s3_get"],
+    "step_save_db_obj": ["apply", "s3_put"],
+    "step_put_other_ope_result": ["put_res"],
+    "step_update_cur": ["update_cur"],
+    "step_remove_obj": ["s3_delete"],
+    "step_get_cur": ["get_cur"],
+    "step_query_ope_result": ["get_res"],
+}
+
+# スナップショットのサイズに比例する時間 [ms/MB]
+S3_MS_PER_MB = 1000 / 80
+APPLY_MS_PER_MB = 20.0
+
+# 1 回に生成するレイテンシの数
+BLOCK_SIZE = 1 << 14
+
+# 1 つの Lambda が実行できるステップ数の上限 (超えた場合はエラーとして打ち切る)
+MAX_STEPS_PER_LAMBDA = 50
+
+SKY_DIGITS = 10
+
+
+def fit_latencies(paths: list[str]) -> dict[str, tuple[float, float]]:
+    """ログのウォームスタートのフェーズごとの時間から、呼び出しの種類ごとの対数正規分布を推定する"""
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "research"))
+    from log_analysis import analyze
+
+    analysis = analyze(paths)
+    latencies = dict(DEFAULT_LATENCIES)
+    for phase, calls in PHASE_CALLS.items():
+        if (phase, "warm") not in analysis.histograms:
+            continue
+        values = np.asarray(analysis.histograms[(phase, "warm")].values)
+        values = values[values > 0]
+        if len(values) < 2:
+            continue
+        logs = np.log(values)
+        for call in calls:
+            latencies[call] = (float(np.exp(logs.mean())), float(logs.std()))
+    return latencies
+
+
+class LatencyModel:
+    """呼び出しの種類ごとのレイテンシを NumPy でブロックごとに生成して 1 つずつ返す"""
+
+    def __init__(self, latencies: dict[str, tuple[float, float]], size_kb: float, seed: int) -> None:
+        self.latencies = latencies
+        size_mb = size_kb / 1024
+        self.extra = {"s3_get": size_mb * S3_MS_PER_MB, "s3_put": size_mb * S3_MS_PER_MB,
+                      "apply": size_mb * APPLY_MS_PER_MB}
+        # 呼び出しの種類ごとに別の乱数列にして、他の呼び出しの回数が変わっても同じ列を使うようにする
+        self.rngs = {call: np.random.default_rng([seed, n]) for n, call in enumerate(sorted(latencies))}
+        self.blocks: dict[str, list[float]] = {call: [] for call in latencies}
+
+    def _refill(self, call: str) -> list[float]:
+        median, sigma = self.latencies[call]
+        z = self.rngs[call].standard_normal(BLOCK_SIZE)
+        block = (median * np.exp(sigma * z) + self.extra.get(call, 0.0)).tolist()
+        block.reverse()
+        self.blocks[call] = block
+        return block
+
+    def sample(self, call: str) -> float:
+        block = self.blocks[call] or self._refill(call)
+        return block.pop()
+
+
+class GuardedLambda(Lambda):
+    """現在の cur のオブジェクトを削除しない Lambda"""
+
+    def step_remove_obj(self) -> None:
+        cur = self.dynamoDb.cur
+        for sky in self.remove_sky_list:
+            if not cur or sky != cur.cur:
+                self.s3.delete(sky)
+        self.next_step = None
+
+
+class Client:
+    """1 つの操作を実行中の Lambda とその計測値"""
+
+    __slots__ = ("lmd", "issued", "busy", "steps", "updated")
+
+    def __init__(self, lmd: Lambda, issued: float) -> None:
+        self.lmd = lmd
+        self.issued = issued
+        self.busy = 0.0
+        self.steps = 0
+        self.updated = True
+
+
+def simulate(concurrency: int, size_kb: float, sleep_ms: float, duration_s: float,
+             latencies: dict[str, tuple[float, float]] = DEFAULT_LATENCIES, seed: int = 0,
+             guarded: bool = True) -> dict:
+    model = LatencyModel(latencies, size_kb, seed)
+    lambda_class = GuardedLambda if guarded else Lambda
+
+    s3 = S3()
+    dynamoDb = DynamoDb()
+    initial = "0" * SKY_DIGITS
+    s3.save(initial)
+    dynamoDb.cur = Current(initial, {initial})
+
+    duration_ms = duration_s * 1000
+    heap: list[tuple[float, int, Client]] = []
+    seq = itertools.count()
+    skies = itertools.count(1)
+
+    latencies_ms: list[float] = []
+    completed: list[str] = []
+    errors = 0
+    busy = 0.0
+    wasted = 0.0
+    retries = 0
+
+    def schedule(client: Client, now: float) -> None:
+        name = client.lmd.next_step.__name__
+        delay = 0.0
+        if name != "step_remove_obj" or client.lmd.remove_sky_list:
+            for call in STEP_CALLS[name]:
+                delay += model.sample(call)
+        if name == "step_query_ope_and_cur":
+            delay += sleep_ms
+        client.busy += delay
+        heapq.heappush(heap, (now + delay, next(seq), client))
+
+    def issue(now: float) -> None:
+        client = Client(lambda_class(s3, dynamoDb, Ope(f"{next(skies):0{SKY_DIGITS}}")), now)
+        schedule(client, now)
+
+    for _ in range(concurrency):
+        issue(0.0)
+
+    while heap:
+        now, _, client = heapq.heappop(heap)
+        if now > duration_ms:
+            break
+
+        lmd = client.lmd
+        name = lmd.next_step.__name__
+        more = lmd.next()
+        client.steps += 1
+
+        if name == "step_get_cur":
+            retries += 1
+        elif name == "step_update_cur" and not lmd.update_result_cur:
+            client.updated = False
+
+        if more and client.steps >= MAX_STEPS_PER_LAMBDA:
+            lmd.err = "livelock"
+            more = False
+
+        if more:
+            schedule(client, now)
+            continue
+
+        # 操作が完了したので次の操作を送信する
+        busy += client.busy
+        if lmd.err:
+            errors += 1
+            wasted += client.busy
+        else:
+            completed.append(lmd.ope.sky)
+            latencies_ms.append(now - client.issued)
+            if not client.updated:
+                wasted += client.busy
+        issue(now)
+
+    applied = s3.applied.get(dynamoDb.cur.cur, 0)
+    lost = sum(1 for sky in completed if not applied & ope_bit(sky))
+    finished = len(completed) + errors
+
+    result = {
+        "protocol": PROTOCOL_GUARDED if guarded else PROTOCOL_UNGUARDED,
+        "concurrency": concurrency,
+        "size_kb": size_kb,
+        "sleep_ms": sleep_ms,
+        "ops": len(completed),
+        "throughput": len(completed) / duration_s,
+        "p50": 0.0,
+        "p99": 0.0,
+        "wasted": wasted / busy if busy else 0.0,
+        "retries": retries / finished if finished else 0.0,
+        "errors": errors / finished if finished else 0.0,
+        "lost": lost / len(completed) if completed else 0.0,
+    }
+    if latencies_ms:
+        result["p50"], result["p99"] = np.percentile(np.asarray(latencies_ms), [50, 99]).tolist()
+    return result
+
+
+def _simulate(args: tuple) -> dict:
+    return simulate(*args)
+
+
+def sweep(concurrencies: list[int], sizes_kb: list[float], sleeps_ms: list[float], duration_s: float,
+          latencies: dict[str, tuple[float, float]] = DEFAULT_LATENCIES, seed: int = 0,
+          guarded: bool = True, processes: int | None = 1) -> list[dict]:
+    """パラメーターのすべての組み合わせをシミュレーションする (すべての組み合わせで同じ seed を使用する)"""
+
+    tasks = [(c, size, sleep, duration_s, latencies, seed, guarded)
+             for c, size, sleep in itertools.product(concurrencies, sizes_kb, sleeps_ms)]
+    if processes == 1:
+        return [_simulate(task) for task in tasks]
+    with Pool(processes) as pool:
+        return pool.map(_simulate, tasks)
+
+
+# 結果の protocol 列 (unguarded は既知の不具合のある verification2.py のままのプロトコル)
+PROTOCOL_GUARDED = "guarded"
+PROTOCOL_UNGUARDED = "unguarded"
+
+COLUMNS = ["protocol", "concurrency", "size_kb", "sleep_ms", "ops", "throughput", "p50", "p99",
+           "wasted", "retries", "errors", "lost"]
+
+
+def print_results(results: list[dict]) -> None:
+    print(" ".join(f"{c:>11}" for c in COLUMNS))
+    for r in results:
+        print(" ".join(f"{r[c]:>11.3f}" if isinstance(r[c], float) else f"{r[c]:>11}" for c in COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--size-kb", type=float, nargs="+", default=[10, 1000])
+    parser.add_argument("--sleep-ms", type=float, nargs="+", default=[0, 50])
+    parser.add_argument("--duration", type=float, default=60, help="シミュレーションする時間 [s]")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fit", nargs="+", metavar="LOG",
+                        help="レイテンシの分布を推定する Logs Insights のエクスポート")
+    protocol = parser.add_mutually_exclusive_group()
+    protocol.add_argument("--guarded", dest="guarded", action="store_true", default=True,
+                          help="cur の更新に失敗した Lambda が現在の cur のオブジェクトを削除しないようにする (既定)")
+    protocol.add_argument("--unguarded", dest="guarded", action="store_false",
+                          help="verification2.py のままの既知の不具合 (livelock) があるプロトコルを実行する")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--csv", help="結果を CSV に出力する")
+    args = parser.parse_args()
+
+    latencies = DEFAULT_LATENCIES
+    if args.fit:
+        latencies = fit_latencies(args.fit)
+        for call, (median, sigma) in latencies.items():
+            print(f"{call:<12} median={median:8.2f}[ms] sigma={sigma:.2f}")
+
+    if not args.guarded:
+        print("protocol: unguarded (verification2.py as is, known to livelock: "
+              "errors are expected and throughput is not an estimate)", file=sys.stderr)
+
+    start = time.perf_counter()
+    results = sweep(args.concurrency, args.size_kb, args.sleep_ms, args.duration,
+                    latencies=latencies, seed=args.seed, guarded=args.guarded,
+                    processes=args.processes)
+    print_results(results)
+    print(f"{len(results)} points, {time.perf_counter() - start:.1f}[s]")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
+import argparse
+import bisect
 import random
-from dataclasses import dataclass, field
+import threading
 import time
-import sqlite3
-import os
-import copy
+from collections import Counter
+from dataclasses import dataclass
 
 
 @dataclass
@@ -21,13 +22,21 @@ class Current:
     obs: set[str]
 
 
+def ope_bit(sky: str) -> int:
+    """適用済みの操作の集合 (操作の sky の数値の位置のビットを立てた int) での操作のビット"""
+    return 1 << int(sky)
+
+
 class S3:
 
     def __init__(self) -> None:
         self.data: set = set()
+        # 検証用: スナップショットごとに適用済みの操作 (ope_bit の集合、削除後も保持する)
+        self.applied: dict[str, int] = {}
 
-    def save(self, sky: str) -> None:
+    def save(self, sky: str, applied: int = 0) -> None:
         self.data.add(sky)
+        self.applied[sky] = applied
 
     def load(self, sky: str) -> str | None:
         if sky in self.data:
@@ -39,46 +48,71 @@ class S3:
 
     def clear(self) -> None:
         self.data.clear()
+        self.applied.clear()
 
 
 class DynamoDb:
 
     def __init__(self) -> None:
         self.cur: Current | None = None
-        self.opes: list[Ope | None] = [None for _ in range(20)]
-        self.res: list[list[Res]] = [None for _ in range(20)]
+        # ソートキーの順に並べた操作の sky
+        self.ope_skies: list[str] = []
+        self.opes: dict[str, Ope] = {}
+        self.res: dict[str, list[Res]] = {}
+        # 検証用: 操作の sky -> 結果
+        self.res_by_ope: dict[str, Res] = {}
 
     def put_ope(self, ope: Ope) -> None:
-        self.opes[int(ope.sky)] = ope
-    
+        if ope.sky not in self.opes:
+            bisect.insort(self.ope_skies, ope.sky)
+        self.opes[ope.sky] = ope
+
     def put_res(self, sky: str, res: list[Res]) -> None:
-        self.res[int(sky)] = res
+        self.res[sky] = res
+        for r in res:
+            self.res_by_ope[r.sky] = r
 
     def update_cur(self, sky: str, remove_sky_list: list[str]) -> Current | None:
-        prev = copy.deepcopy(self.cur) if self.cur else None
+        prev = self.get_cur()
 
         if prev and sky <= prev.cur:
             # cur が古い場合は更新をしないようにする
             return None
 
         if not self.cur:
-            self.cur = Current(sky,set([sky]))
+            self.cur = Current(sky, set([sky]))
         else:
-            self.cur.cur = sky
+            # 読み込んだ Lambda が持っている Current を変更しないように置き換える
+            obs = set(self.cur.obs)
             for s in remove_sky_list:
-                self.cur.obs.discard(s)
-        
+                obs.discard(s)
+            obs.add(sky)
+            self.cur = Current(sky, obs)
+
         return prev
 
     def query_ope_and_cur(self) -> tuple[Current | None, list[Ope]]:
-        return (self.cur, [v for v in self.opes if v])
-    
+        """現在の最新データと、それより新しい操作を取得する"""
+
+        cur = self.get_cur()
+        start = bisect.bisect_right(self.ope_skies, cur.cur) if cur else 0
+        return (cur, [self.opes[sky] for sky in self.ope_skies[start:]])
+
     def get_cur(self) -> Current | None:
-        return self.cur
+        # DynamoDB からの読み込みと同じように複製を返す
+        if self.cur:
+            return Current(self.cur.cur, set(self.cur.obs))
+        return None
+
+    def get_res(self, sky: str) -> Res | None:
+        return self.res_by_ope.get(sky)
 
     def clear(self) -> None:
         self.cur = None
-        self.opes = [None for _ in range(20)]
+        self.ope_skies = []
+        self.opes = {}
+        self.res = {}
+        self.res_by_ope = {}
 
 
 class Lambda:
@@ -87,22 +121,8 @@ class Lambda:
         self.dynamoDb = dynamoDb
         self.ope = ope
 
-        self.err = ""
-        self.next_step = self.step_put_ope
-
-        self.opes: list[Ope] = None
-        self.cur: Current | None = None
-
-        self.s3_db: str | None = None
-
-        self.step03_cur: str | None = None
-        self.step03_prv: str | None = None
+        self.clear()
 
-        self.step04_update_prev_cur: Current | None = None
-        
-        self.update_result_cur: Current | None = None
-        self.remove_sky_list: list[str] = []
-    
     @property
     def cur_sky(self) -> str | None:
         if self.cur:
@@ -112,19 +132,23 @@ class Lambda:
     def clear(self) -> None:
         self.err = ""
         self.next_step = self.step_put_ope
-        self.opes = None
-        self.cur = None
-        self.cur_sky = None
-        self.step03_cur = None
-        self.step03_prv = None
-        self.step04_update_prev_cur = None
-        self.update_result_cur = None
-        self.remove_sky_list = []
+        self.opes: list[Ope] = None
+        self.cur: Current | None = None
+        self.s3_db: str | None = None
+        self.applied = 0
+        self.update_result_cur: Current | None = None
+        self.remove_sky_list: list[str] = []
+        self.result: Res | None = None
 
     def next(self) -> bool:
+        """次のステップを 1 つ実行する。まだステップが残っている場合は True"""
+
+        self.next_step()
+        return self.next_step is not None
 
-        while self.next_step:
-            self.next_step()
+    def run(self) -> None:
+        while self.next():
+            pass
 
     def step_put_ope(self) -> None:
         """DynamoDB のキューに操作を書き込む"""
@@ -155,14 +179,13 @@ class Lambda:
             # このとき、opes[-1] の操作が現在時間に比べて 10 ms 以上古ければ強い整合性のある読み込みは必要なしと判断する
             pass
 
-        
         if self.cur_sky >= self.ope.sky:
             # 他のプロセスで操作が完了しているということなので完了状態を取得しに行く
-            self.next_step = 10
+            self.next_step = self.step_query_ope_result
         else:
             # オブジェクトの取得をする
             self.next_step = self.step_load_db_obj
-    
+
     def step_load_db_obj(self) -> None:
         """S3からDBファイルを取得する"""
 
@@ -171,16 +194,16 @@ class Lambda:
 
         if self.s3_db:
             # オブジェクトを取得できたので操作の適用を行う
-            if self.no_effect_proc_apply_opes():
-                # 他の操作も行ったのでその結果を保存する
-                self.next_step = self.step_put_other_ope_result
-            else:
-                # 操作を行ったので最新情報を更新する
-                self.next_step = self.step_update_cur
+            applied = self.s3.applied.get(self.s3_db, 0)
+            for o in self.opes:
+                if o.sky > self.cur_sky:
+                    applied |= ope_bit(o.sky)
+            self.applied = applied
+            self.next_step = self.step_save_db_obj
         else:
             # オブジェクトの取得ができなかったのでリトライ
             self.next_step = self.step_get_cur
-    
+
     def no_effect_proc_apply_opes(self) -> bool:
         """操作の適用
         note: 本来は取得したオブジェクトに操作の適用を順次行う
@@ -190,29 +213,40 @@ class Lambda:
         if len(self.opes) == 1:
             # 自分の操作だけの適用であれば保存は行わない
             return False
-        
+
         # 自分以外の操作を適用した場合はその操作の結果を保存する
         return True
 
+    def step_save_db_obj(self) -> None:
+        """操作を適用したDBファイルを最後の操作の sky で S3 に保存する"""
+
+        self.s3.save(self.opes[-1].sky, self.applied)
+
+        if self.no_effect_proc_apply_opes():
+            # 他の操作も行ったのでその結果を保存する
+            self.next_step = self.step_put_other_ope_result
+        else:
+            # 操作を行ったので最新情報を更新する
+            self.next_step = self.step_update_cur
+
     def step_put_other_ope_result(self) -> None:
         """自分以外の操作の結果を保存する
         note: 結果データは自分以外の操作の中でも最も大きなskyをソートキーとして保存する"""
-        res = [Res(o.sky,0) for o in self.opes if o.sky != self.ope.sky]
+        res = [Res(o.sky, 0) for o in self.opes if o.sky != self.ope.sky]
         if res:
             self.dynamoDb.put_res(res[-1].sky, res)
-        
+
         # 結果を保存したので最新情報に更新する
         self.next_step = self.step_update_cur
 
     def step_update_cur(self) -> None:
         """最新のデータの適用状況を更新する"""
-        
+
         last_ope = self.opes[-1]
         self.remove_sky_list = list(self.cur.obs) if self.cur else []
-        
-        
+
         self.update_result_cur = self.dynamoDb.update_cur(last_ope.sky, self.remove_sky_list)
-        
+
         if self.update_result_cur:
             # 保存が完了したのでアップデート前に保管されていた最新データに保管されていたオブジェクトデータを削除する
             self.remove_sky_list = list(self.update_result_cur.obs)
@@ -220,16 +254,17 @@ class Lambda:
             # アップデート失敗をしたので保存をしようとしたデータが最新でなかった
             # そのためこのプロセスで保存したオブジェクトを削除する
             self.remove_sky_list = [last_ope.sky]
-        
+
         # オブジェクトの削除ステップに移動
         self.next_step = self.step_remove_obj
-        
 
     def step_remove_obj(self) -> None:
         """不要なオブジェクトを削除する"""
-        pass
 
-    
+        for sky in self.remove_sky_list:
+            self.s3.delete(sky)
+        self.next_step = None
+
     def step_get_cur(self) -> None:
         """現在の最新操作適用状態のみを取得する"""
 
@@ -241,389 +276,48 @@ class Lambda:
         else:
             # オブジェクトの取得をする
             self.next_step = self.step_load_db_obj
-        
+
     def step_query_ope_result(self) -> None:
         """他のプロセスで操作が実行されているのでその結果を取得する"""
-        pass
-
 
-    def step04(self) -> None:
+        self.result = self.dynamoDb.get_res(self.ope.sky)
+        if not self.result:
+            self.err = "step_query_ope_result"
+        self.next_step = None
 
-        if self.err:
-            return
-        self.s3.save(self.ope.sky)
 
-    def step05(self) -> None:
-
-        if self.err:
-            return
-        if self.step03_cur:
-            prev = [self.step03_cur, self.step03_prv]
-        else:
-            prev = []
-        cur = Current(self.ope.sky, prev)
-        self.step04_update_prev_cur = self.dynamoDb.update_cur(cur)
-
-    def step06(self):
-
-        if self.err:
-            return
-        if self.step04_update_prev_cur:
-            # 更新成功
-            if self.step04_update_prev_cur.prv[0] == self.step03_cur:
-                # 同じ cur をもとに更新をしていた場合は削除する
-                self.s3.delete(self.step04_update_prev_cur.cur)
-            # 更新成功であれば
-            if self.step03_prv:
-                self.s3.delete(self.step03_prv)
-        else:
-            # update が失敗の時は自分のデータを削除
-            self.s3.delete(self.ope.sky)
+def main():
+    """verification.py と同じ 3 つの Lambda を並行に、2 つの Lambda をその後に順番に実行する
 
+    並行に実行する Lambda はシードごとにランダムな順序でステップを実行し、結果ごとの件数を表示する。"""
 
-def main():
+    # fuzz は Lambda などのこのモジュールのクラスを使用するのでここで import する
+    from fuzz import Simulation
 
-    s3 = S3()
-    dynamoDb = DynamoDb()
-
-    ope1 = Ope("10")
-    ope2 = Ope("11")
-    ope3 = Ope("12")
-    ope4 = Ope("13")
-    ope5 = Ope("14")
-
-    current = Current("09", ["08", "07"])
-
-    lambda01 = Lambda(s3, dynamoDb, ope1)
-    lambda02 = Lambda(s3, dynamoDb, ope2)
-    lambda03 = Lambda(s3, dynamoDb, ope3)
-    lambda04 = Lambda(s3, dynamoDb, ope4)
-    lambda05 = Lambda(s3, dynamoDb, ope5)
-
-    ope1s = [
-        lambda01.step_put_ope, lambda01.step_query_ope_and_cur, lambda01.step_load_db_obj, lambda01.step04, lambda01.step05, lambda01.step06
-    ]
-    ope2s = [
-        lambda02.step_put_ope, lambda02.step_query_ope_and_cur, lambda02.step_load_db_obj, lambda02.step04, lambda02.step05, lambda02.step06
-    ]
-
-    ope3s = [
-        lambda03.step_put_ope, lambda03.step_query_ope_and_cur, lambda03.step_load_db_obj, lambda03.step04, lambda03.step05, lambda03.step06
-    ]
-
-    ope4s = [
-        lambda04.step_put_ope, lambda04.step_query_ope_and_cur, lambda04.step_load_db_obj, lambda04.step04, lambda04.step05, lambda04.step06
-    ]
-
-    ope5s = [
-        lambda05.step_put_ope, lambda05.step_query_ope_and_cur, lambda05.step_load_db_obj, lambda05.step04, lambda05.step05, lambda05.step06
-    ]
-
-    db_file = "./verification.db"
-
-    existed_db = os.path.exists(db_file)
-
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS logs (
-        id INTEGER PRIMARY KEY,
-                    
-        i1 INTEGER NOT NULL,
-        i2 INTEGER NOT NULL,
-        i3 INTEGER NOT NULL,
-        i4 INTEGER NOT NULL,
-        i5 INTEGER NOT NULL,
-        i6 INTEGER NOT NULL,
-                    
-        j1 INTEGER NOT NULL,
-        j2 INTEGER NOT NULL,
-        j3 INTEGER NOT NULL,
-        j4 INTEGER NOT NULL,
-        j5 INTEGER NOT NULL,
-        j6 INTEGER NOT NULL,
-                    
-        k1 INTEGER NOT NULL,
-        k2 INTEGER NOT NULL,
-        k3 INTEGER NOT NULL,
-        k4 INTEGER NOT NULL,
-        k5 INTEGER NOT NULL,
-        k6 INTEGER NOT NULL,
-                    
-        lambda1_err TEXT NOT NULL,
-        lambda2_err TEXT NOT NULL,
-        lambda3_err TEXT NOT NULL,
-        lambda4_err TEXT NOT NULL,
-        lambda5_err TEXT NOT NULL,
-                    
-        a3_s3_count INTEGER NOT NULL,
-                    
-        a3_dynamodb_cur TEXT NOT NULL,
-        a3_dynamodb_prv_count INTEGER NOT NULL,
-                    
-        a5_s3_count INTEGER NOT NULL,
-                    
-        a5_dynamodb_cur TEXT NOT NULL,
-        a5_dynamodb_prv_count INTEGER NOT NULL
-        )
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS s3 (
-        id INTEGER PRIMARY KEY,
-        log_id INTEGER NOT NULL,
-        
-        name TEXT NOT NULL,
-        data TEXT NOT NULL
-        )
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS dynamodb (
-        id INTEGER PRIMARY KEY,
-        log_id INTEGER NOT NULL,
-        
-        name TEXT NOT NULL,
-        prev_data TEXT NOT NULL
-        );
-    """)
-    conn.commit()
-
-    a3_s3_data_count: int = None
-    a3_s3_data: set[str] = None
-    a3_dynamodb_cur: str = None
-    a3_dynamodb_prv_count: int = None
-    a3_dynamodb_prv: list[str] = None
-
-    def capcher_a3():
-        global a3_s3_data_count
-        global a3_s3_data
-        global a3_dynamodb_cur
-        global a3_dynamodb_prv_count
-        global a3_dynamodb_prv
-
-        a3_s3_data_count = len(s3.data)
-        a3_s3_data = set(s3.data)
-        a3_dynamodb_cur = dynamoDb.cur.cur
-        a3_dynamodb_prv_count = len(dynamoDb.cur.prv)
-        a3_dynamodb_prv = list(dynamoDb.cur.prv)
-
-    def insert_logs():
-
-        a5_s3_data_count = len(s3.data)
-        a5_s3_data = set(s3.data)
-        a5_dynamodb_cur = dynamoDb.cur.cur
-        a5_dynamodb_prv_count = len(dynamoDb.cur.prv)
-        a5_dynamodb_prv = list(dynamoDb.cur.prv)
-
-        cursor.execute('''
-    INSERT INTO logs (id,
-        i1, i2, i3, i4, i5, i6,
-        j1, j2, j3, j4, j5, j6,
-        k1, k2, k3, k4, k5, k6,
-        lambda1_err, lambda2_err, lambda3_err, lambda4_err, lambda5_err,
-        a3_s3_count,
-        a3_dynamodb_cur,
-        a3_dynamodb_prv_count,
-        a5_s3_count,
-        a5_dynamodb_cur,
-        a5_dynamodb_prv_count) VALUES (?,
-        ?, ?, ?, ?, ?, ?,
-        ?, ?, ?, ?, ?, ?,
-        ?, ?, ?, ?, ?, ?,
-        ?, ?, ?, ?, ?,
-        ?,
-        ?,
-        ?,
-        ?,
-        ?,
-        ?)
-    ''', (_id,
-          i1, i2, i3, i4, i5, i6,
-          j1, j2, j3, j4, j5, j6,
-          k1, k2, k3, k4, k5, k6,
-          lambda01.err, lambda02.err, lambda03.err, lambda04.err, lambda05.err,
-          a3_s3_data_count,
-          a3_dynamodb_cur,
-          a3_dynamodb_prv_count,
-          a5_s3_data_count,
-          a5_dynamodb_cur,
-          a5_dynamodb_prv_count))
-
-        for d in a3_s3_data:
-            cursor.execute('''
-        INSERT INTO s3 (log_id,
-            name,data) VALUES (?,
-            ?, ?)
-        ''', (_id,
-              "a3", d))
-
-        for d in a3_dynamodb_prv:
-            cursor.execute('''
-        INSERT INTO dynamodb (log_id,
-            name,prev_data) VALUES (?,
-            ?, ?)
-        ''', (_id,
-              "a3", d))
-
-        for d in a5_s3_data:
-            cursor.execute('''
-        INSERT INTO s3 (log_id,
-            name,data) VALUES (?,
-            ?, ?)
-        ''', (_id,
-              "a5", d))
-
-        for d in a5_dynamodb_prv:
-            cursor.execute('''
-        INSERT INTO dynamodb (log_id,
-            name,prev_data) VALUES (?,
-            ?, ?)
-        ''', (_id,
-              "a5", d))
-
-    operations = [None for _ in range(6*3)]
-
-    def run():
-        s3.clear()
-        dynamoDb.clear()
-        lambda01.clear()
-        lambda02.clear()
-        lambda03.clear()
-        lambda04.clear()
-        lambda05.clear()
-
-        s3.data.add("09")
-        s3.data.add("08")
-
-        dynamoDb.cur = current
-
-        for func in operations:
-            func()
-
-        capcher_a3()
-
-        for func in ope4s:
-            func()
-
-        for func in ope5s:
-            func()
-
-        insert_logs()
-
-    _id = 0
-
-    t = time.perf_counter()
-    try:
-        start = time.perf_counter()
-        for i1 in range(0, len(operations)-5):
-            for i2 in range(1 + i1, len(operations)-4):
-                for i3 in range(1 + i2, len(operations)-3):
-                    for i4 in range(1 + i3, len(operations)-2):
-                        for i5 in range(1 + i4, len(operations)-1):
-                            for i6 in range(1 + i5, len(operations)-0):
-
-                                j_index_list = set(
-                                    [i for i in range(len(operations))])
-                                j_index_list.remove(i1)
-                                j_index_list.remove(i2)
-                                j_index_list.remove(i3)
-                                j_index_list.remove(i4)
-                                j_index_list.remove(i5)
-                                j_index_list.remove(i6)
-
-                                j_index_list = list(j_index_list)
-                                for _j1 in range(0, len(j_index_list)-5):
-                                    for _j2 in range(1 + _j1, len(j_index_list)-4):
-                                        for _j3 in range(1 + _j2, len(j_index_list)-3):
-                                            for _j4 in range(1 + _j3, len(j_index_list)-2):
-                                                for _j5 in range(1 + _j4, len(j_index_list)-1):
-                                                    for _j6 in range(1 + _j5, len(j_index_list)-0):
-
-                                                        j1 = j_index_list[_j1]
-                                                        j2 = j_index_list[_j2]
-                                                        j3 = j_index_list[_j3]
-                                                        j4 = j_index_list[_j4]
-                                                        j5 = j_index_list[_j5]
-                                                        j6 = j_index_list[_j6]
-
-                                                        k_index_list = set(
-                                                            j_index_list)
-                                                        k_index_list.remove(j1)
-                                                        k_index_list.remove(j2)
-                                                        k_index_list.remove(j3)
-                                                        k_index_list.remove(j4)
-                                                        k_index_list.remove(j5)
-                                                        k_index_list.remove(j6)
-
-                                                        k_index_list = list(
-                                                            k_index_list)
-                                                        k1 = k_index_list[0]
-                                                        k2 = k_index_list[1]
-                                                        k3 = k_index_list[2]
-                                                        k4 = k_index_list[3]
-                                                        k5 = k_index_list[4]
-                                                        k6 = k_index_list[5]
-
-                                                        # print(
-                                                        #     "------------------------")
-                                                        # print(
-                                                        #     f"{i1} , {i2} , {i3} , {i4} , {i5} , {i6}")
-                                                        # print(
-                                                        #     f"{j1} , {j2} , {j3} , {j4} , {j5} , {j6}")
-                                                        # print(
-                                                        #     f"{k1} , {k2} , {k3} , {k4} , {k5} , {k6}")
-
-                                                        operations[i1] = ope1s[0]
-                                                        operations[i2] = ope1s[1]
-                                                        operations[i3] = ope1s[2]
-                                                        operations[i4] = ope1s[3]
-                                                        operations[i5] = ope1s[4]
-                                                        operations[i6] = ope1s[5]
-
-                                                        operations[j1] = ope2s[0]
-                                                        operations[j2] = ope2s[1]
-                                                        operations[j3] = ope2s[2]
-                                                        operations[j4] = ope2s[3]
-                                                        operations[j5] = ope2s[4]
-                                                        operations[j6] = ope2s[5]
-
-                                                        operations[k1] = ope3s[0]
-                                                        operations[k2] = ope3s[1]
-                                                        operations[k3] = ope3s[2]
-                                                        operations[k4] = ope3s[3]
-                                                        operations[k5] = ope3s[4]
-                                                        operations[k6] = ope3s[5]
-
-                                                        run()
-
-                                                        if _id % 10000 == 0:
-                                                            t2 = time.perf_counter()
-                                                            one_t = (
-                                                                t2 - t) * 0.0001
-                                                            remaining_time = (
-                                                                17153136 - _id + 1) * one_t
-                                                            print(str(_id).rjust(
-                                                                8) + " / 17153136 : "+str(int(remaining_time)).rjust(5)+"[s]\r", end="")
-
-                                                            t = t2
-
-                                                        _id = _id + 1
-
-    finally:
-        conn.commit()
-        cursor.close()
-        conn.close()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
 
+    outcomes: Counter[tuple] = Counter()
+    violations: Counter[str] = Counter()
+    for seed in range(args.seed, args.seed + args.runs):
+        sim = Simulation(lambdas=3, followers=2, digits=2, first_sky=10)
+        _, violation = sim.run(random.Random(seed), stop=False)
+        if violation:
+            violations[violation.kind] += 1
+        cur = sim.dynamoDb.cur
+        outcomes[(tuple(lmd.err for lmd in sim.lambdas), tuple(sorted(sim.s3.data)),
+                  cur.cur, tuple(sorted(cur.obs)))] += 1
 
-if __name__ == "__main__":
-    # main()
-    pass
+    for (errs, s3, cur, obs), count in outcomes.most_common():
+        print(f"{count:>8} : errs={errs} s3={s3} cur={cur} obs={obs}")
+    for kind, count in violations.most_common():
+        print(f"{count:>8} : {kind}")
 
 
-import random
-import time
-import threading
 
+# 以下はステップを並行に実行する方法の検討用 (thread_demo() で実行する)
 
 class Obj:
 
@@ -667,21 +361,18 @@ class Obj:
         time.sleep(random.random() * 5)
         self.state = 3
 
-obj01 = Obj("obj01")
-obj02 = Obj("obj02")
-obj03 = Obj("obj03")
 
-def run(obj:Obj):
-    while obj.next():
-        pass
-thread01 = threading.Thread(target=run, args=(obj01,))
-thread02 = threading.Thread(target=run, args=(obj02,))
-thread03 = threading.Thread(target=run, args=(obj03,))
+def thread_demo():
+    def run(obj: Obj):
+        while obj.next():
+            pass
+
+    threads = [threading.Thread(target=run, args=(Obj(f"obj0{n}"),)) for n in range(1, 4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
-thread01.start()
-thread02.start()
-thread03.start()
 
-thread01.join()
-thread02.join()
-thread03.join()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,97 +1,265 @@
+"""verification.db の検索とインターリーブの再実行
+
+python verification_check.py index
+python verification_check.py query --a5-s3-count ">2"
+python verification_check.py query --errors --a5-cur 14 --count
+python verification_check.py replay 23814
+
+index で結果の列 (エラー、最終的な cur、S3 のオブジェクト数) のインデックスを作成する。
+query はインデックスを使用するので、数千万行でもすぐに結果を返す。
+partial-order reduction を有効にして書き込んだ verification.db の logs は代表のインターリーブだけなので、
+query --count は logs の件数 (representatives) と、outcomes テーブルの結果ごとの件数から求めた
+インターリーブの件数 (schedules) を分けて表示する。
+replay は logs の 1 行の実行順序を最初から実行し、ステップごとの状態を表示する。"""
+
+import argparse
+import operator
+import re
 import sqlite3
-from verification import S3, DynamoDb, Ope, Current, Lambda
+import sys
+
+from explorer import Model, STEPS
+from sink import DEFAULT_DB_FILE, POSITION_PREFIXES
+
+STEP_NAMES = ["step01", "step02", "step03", "step04", "step05", "step06"]
+
+# query で表示する列
+SUMMARY_COLUMNS = ["a3_s3_count", "a3_dynamodb_cur", "a3_dynamodb_prv_count",
+                   "a5_s3_count", "a5_dynamodb_cur", "a5_dynamodb_prv_count"]
+
+COMPARISON = re.compile(r"^\s*(>=|<=|!=|>|<|=)?\s*(\d+)\s*$")
+
+OPERATORS = {"=": operator.eq, "!=": operator.ne, ">": operator.gt, "<": operator.lt,
+             ">=": operator.ge, "<=": operator.le}
+
+
+class LogsTable:
+    """logs テーブルの列の構成 (並行に実行した Lambda の数は列から求める)"""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(logs)")]
+        if not columns:
+            raise ValueError("logs table does not exist")
+
+        self.columns = columns
+        self.errs = [c for c in columns if re.fullmatch(r"lambda\d+_err", c)]
+        self.writers = sum(1 for p in POSITION_PREFIXES if f"{p}1" in columns)
+        self.followers = len(self.errs) - self.writers
+
+    def schedule(self, row: sqlite3.Row) -> tuple[int, ...]:
+        """ステップの実行位置の列から、ステップごとに実行する Lambda の番号の並びに戻す"""
+
+        schedule = [0] * (self.writers * STEPS)
+        for w in range(self.writers):
+            for step in range(STEPS):
+                schedule[row[f"{POSITION_PREFIXES[w]}{step + 1}"]] = w
+        return tuple(schedule)
+
+
+def create_indexes(conn: sqlite3.Connection) -> None:
+    table = LogsTable(conn)
+
+    statements = [
+        "CREATE INDEX IF NOT EXISTS idx_logs_a5 ON logs (a5_s3_count, a5_dynamodb_cur)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_a5_cur ON logs (a5_dynamodb_cur)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_a3 ON logs (a3_s3_count, a3_dynamodb_cur)",
+        # エラーの行は少ないので、エラーの行だけの部分インデックスにする
+        (f"CREATE INDEX IF NOT EXISTS idx_logs_err ON logs ({', '.join(table.errs)}) "
+         f"WHERE {' OR '.join(f'{c} != ' + repr('') for c in table.errs)}"),
+        "CREATE INDEX IF NOT EXISTS idx_s3_log_id ON s3 (log_id)",
+        "CREATE INDEX IF NOT EXISTS idx_dynamodb_log_id ON dynamodb (log_id)",
+    ]
+    for statement in statements:
+        print(statement)
+        conn.execute(statement)
+
+    # クエリプランナーがインデックスを選べるように統計を更新する
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def comparison(expression: str) -> tuple[str, int]:
+    """">2" のような条件を (演算子, 値) に変換する (演算子を省略した場合は =)"""
+
+    match = COMPARISON.match(expression)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid comparison: {expression}")
+    return match.group(1) or "=", int(match.group(2))
+
+
+def load_run(conn: sqlite3.Connection) -> tuple[bool, int, int] | None:
+    """verification.py が記録した (reduction の有無, インターリーブの総数, 書き込んだ件数) を返す (記録がない場合は None)"""
+
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'run'").fetchone():
+        return None
+    row = conn.execute("SELECT reduced, schedules, written FROM run").fetchone()
+    return (bool(row[0]), row[1], row[2]) if row else None
+
+
+def build_conditions(table: LogsTable, args: argparse.Namespace) -> list[tuple[str, str, object]]:
+    """query の条件を (列, 演算子, 値) のリストにする (--errors はいずれかの Lambda のエラーなので含まない)"""
+
+    conditions: list[tuple[str, str, object]] = []
+    if args.err_lambda:
+        conditions.append((f"lambda{args.err_lambda}_err", "!=", ""))
+    for column, value in [("a5_dynamodb_cur", args.a5_cur), ("a3_dynamodb_cur", args.a3_cur)]:
+        if value is not None:
+            conditions.append((column, "=", value))
+    for column, value in [("a5_s3_count", args.a5_s3_count), ("a3_s3_count", args.a3_s3_count),
+                          ("a5_dynamodb_prv_count", args.a5_prv_count)]:
+        if value is not None:
+            conditions.append((column, *value))
+    return conditions
+
+
+def count_outcome_schedules(conn: sqlite3.Connection, table: LogsTable, args: argparse.Namespace) -> int:
+    """outcomes テーブルの結果ごとの件数から、条件に一致するインターリーブの件数を求める"""
+
+    def split(value: str) -> list[str]:
+        return value.split(",") if value else []
 
-db_file = "./verification.db"
+    conditions = build_conditions(table, args)
+    total = 0
+    for errs, a3_s3, a3_cur, a3_prv, a5_s3, a5_cur, a5_prv, count in conn.execute(
+            "SELECT errs, a3_s3, a3_dynamodb_cur, a3_dynamodb_prv, a5_s3, a5_dynamodb_cur, a5_dynamodb_prv, count "
+            "FROM outcomes"):
+        values = {
+            **dict(zip(table.errs, errs.split(","))),
+            "a3_s3_count": len(split(a3_s3)), "a3_dynamodb_cur": a3_cur, "a3_dynamodb_prv_count": len(split(a3_prv)),
+            "a5_s3_count": len(split(a5_s3)), "a5_dynamodb_cur": a5_cur, "a5_dynamodb_prv_count": len(split(a5_prv)),
+        }
+        if args.errors and not any(values[c] for c in table.errs):
+            continue
+        if all(OPERATORS[op](values[column], value) for column, op, value in conditions):
+            total += count
+    return total
 
-conn = sqlite3.connect(db_file)
-cur = conn.cursor()
 
+def query(conn: sqlite3.Connection, args: argparse.Namespace) -> None:
+    table = LogsTable(conn)
+    run = load_run(conn)
+    reduced = run is not None and run[0]
 
-# id	i1	i2	i3	i4	i5	i6	j1	j2	j3	j4	j5	j6	k1	k2	k3	k4	k5	k6	lambda1_err	lambda2_err	lambda3_err	lambda4_err	lambda5_err	a3_s3_count	a3_dynamodb_cur	a3_dynamodb_prv_count	a5_s3_count	a5_dynamodb_cur	a5_dynamodb_prv_count
-# 23814	0	1	2	3	6	7	8	9	10	11	12	13	4	5	14	15	16	17			step03			2	11	2	2	14	2
+    conditions: list[str] = []
+    params: list = []
 
-cur.execute("""
-SELECT * FROM logs WHERE id = ?
-""", (23814,))
+    if args.errors:
+        # 部分インデックス idx_logs_err と同じ条件にする
+        conditions.append("(" + " OR ".join(f"{c} != ''" for c in table.errs) + ")")
+    for column, op, value in build_conditions(table, args):
+        conditions.append(f"{column} {op} ?")
+        params.append(value)
 
-item = [row for row in cur.fetchall()][0]
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
 
+    if args.explain:
+        for row in conn.execute(f"EXPLAIN QUERY PLAN SELECT id FROM logs{where}", params):
+            print(row[-1])
 
-s3 = S3()
-dynamoDb = DynamoDb()
+    if args.count:
+        (count,) = conn.execute(f"SELECT COUNT(*) FROM logs{where}", params).fetchone()
+        if not reduced:
+            print(count)
+            return
+        # logs は代表のインターリーブだけなので、インターリーブの件数は outcomes から求めて分けて表示する
+        print(f"representatives: {count}")
+        print(f"schedules: {count_outcome_schedules(conn, table, args)} (of {run[1]})")
+        return
 
-ope1 = Ope("10")
-ope2 = Ope("11")
-ope3 = Ope("12")
-ope4 = Ope("13")
-ope5 = Ope("14")
+    if reduced:
+        print(f"note: logs has {run[2]} representative interleavings of {run[1]} (partial-order reduction), "
+              "use --count for the number of interleavings", file=sys.stderr)
 
-current = Current("09", ["08", "07"])
+    columns = ["id", *table.errs, *SUMMARY_COLUMNS]
+    print("\t".join(columns))
+    for row in conn.execute(f"SELECT {', '.join(columns)} FROM logs{where} ORDER BY id LIMIT ?",
+                            [*params, args.limit]):
+        print("\t".join(str(v) for v in row))
 
-lambda01 = Lambda(s3, dynamoDb, ope1)
-lambda02 = Lambda(s3, dynamoDb, ope2)
-lambda03 = Lambda(s3, dynamoDb, ope3)
-lambda04 = Lambda(s3, dynamoDb, ope4)
-lambda05 = Lambda(s3, dynamoDb, ope5)
 
-ope1s = [
-    lambda01.step01, lambda01.step02, lambda01.step03, lambda01.step04, lambda01.step05, lambda01.step06
-]
-ope2s = [
-    lambda02.step01, lambda02.step02, lambda02.step03, lambda02.step04, lambda02.step05, lambda02.step06
-]
+def format_state(model: Model) -> str:
+    cur = model.dynamoDb.cur
+    opes = [o.sky for o in model.dynamoDb.opes if o]
+    errs = [lmd.err or "-" for lmd in model.lambdas]
+    return (f"s3={sorted(model.s3.data)} cur={cur.cur if cur else None} "
+            f"prv={list(cur.prv) if cur else None} opes={opes} err={errs}")
 
-ope3s = [
-    lambda03.step01, lambda03.step02, lambda03.step03, lambda03.step04, lambda03.step05, lambda03.step06
-]
 
-ope4s = [
-    lambda04.step01, lambda04.step02, lambda04.step03, lambda04.step04, lambda04.step05, lambda04.step06
-]
+def replay(conn: sqlite3.Connection, log_id: int) -> None:
+    table = LogsTable(conn)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM logs WHERE id = ?", (log_id,)).fetchone()
+    if row is None:
+        raise SystemExit(f"log {log_id} not found")
 
-ope5s = [
-    lambda05.step01, lambda05.step02, lambda05.step03, lambda05.step04, lambda05.step05, lambda05.step06
-]
+    schedule = table.schedule(row)
+    model = Model(table.writers, table.followers)
 
-operations = [None for _ in range(6*3)]
+    print(f"{'':>4} {'':<18} {format_state(model)}")
 
-index_list = [r for r in item][1:]
+    pcs = [0] * table.writers
+    for slot, w in enumerate(schedule):
+        model.execute(w)
+        print(f"{slot:>4} lambda{w + 1:02}.{STEP_NAMES[pcs[w]]:<7} {format_state(model)}")
+        pcs[w] += 1
 
-for i in range(6):
-    operations[index_list[i+0]] = ope1s[i]
+    print("---- a3")
 
-for i in range(6):
-    operations[index_list[i+6]] = ope2s[i]
+    # 後続の Lambda を順番に実行する
+    for n, steps in enumerate(model.steps[table.writers:], start=table.writers):
+        for name, step in zip(STEP_NAMES, steps):
+            step()
+            print(f"{'':>4} lambda{n + 1:02}.{name:<7} {format_state(model)}")
 
-for i in range(6):
-    operations[index_list[i+12]] = ope3s[i]
+    print("---- a5")
 
+    # 記録されている結果と一致するかを確認する
+    cur = model.dynamoDb.cur
+    actual = {
+        **{c: lmd.err for c, lmd in zip(table.errs, model.lambdas)},
+        "a5_s3_count": len(model.s3.data),
+        "a5_dynamodb_cur": cur.cur,
+        "a5_dynamodb_prv_count": len(cur.prv),
+    }
+    mismatches = {c: (row[c], v) for c, v in actual.items() if row[c] != v}
+    print("recorded outcome matches" if not mismatches else f"recorded outcome differs: {mismatches}")
 
-def run():
-    s3.clear()
-    dynamoDb.clear()
-    lambda01.clear()
-    lambda02.clear()
-    lambda03.clear()
-    lambda04.clear()
-    lambda05.clear()
 
-    s3.data.add("09")
-    s3.data.add("08")
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=DEFAULT_DB_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
 
-    dynamoDb.cur = current
+    subparsers.add_parser("index", help="結果の列のインデックスを作成する")
 
-    for func in operations:
-        func()
+    query_parser = subparsers.add_parser("query", help="結果の条件でインターリーブを検索する")
+    query_parser.add_argument("--errors", action="store_true", help="エラーになった Lambda がある")
+    query_parser.add_argument("--err-lambda", type=int, help="指定した番号の Lambda がエラーになった")
+    query_parser.add_argument("--a5-cur", help="最終的な cur")
+    query_parser.add_argument("--a3-cur", help="並行に実行した Lambda が終わった時点の cur")
+    query_parser.add_argument("--a5-s3-count", type=comparison, help='最終的な S3 のオブジェクト数 (">2" など)')
+    query_parser.add_argument("--a3-s3-count", type=comparison, help="並行に実行した Lambda が終わった時点の S3 のオブジェクト数")
+    query_parser.add_argument("--a5-prv-count", type=comparison, help="最終的な prv の数")
+    query_parser.add_argument("--count", action="store_true", help="件数だけを表示する")
+    query_parser.add_argument("--limit", type=int, default=20)
+    query_parser.add_argument("--explain", action="store_true", help="クエリプランを表示する")
 
-    # for func in ope4s:
-    #     func()
+    replay_parser = subparsers.add_parser("replay", help="インターリーブを再実行してステップごとの状態を表示する")
+    replay_parser.add_argument("id", type=int)
 
-    # for func in ope5s:
-    #     func()
+    args = parser.parse_args()
 
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == "index":
+            create_indexes(conn)
+        elif args.command == "query":
+            query(conn, args)
+        else:
+            replay(conn, args.id)
+    finally:
+        conn.close()
 
-run()
 
-print(s3.data)
-print(dynamoDb.cur)
+if __name__ == "__main__":
+    main()